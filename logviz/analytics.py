@@ -0,0 +1,497 @@
+"""Cross-run metric analytics: group-bys over runs, pivot tables and time series.
+
+`metric_data` keeps one JSON text value per (run, sample, key), which SQLite has to scan and
+parse row by row for every aggregate. When the optional `duckdb` and `pyarrow` packages are
+installed, each run's numeric metrics, its spec columns and per-sample event summaries are
+also written to an embedded DuckDB database (`analytics.duckdb`, next to the SQLite one)
+after it is ingested, and the queries here run against that columnar mirror. The mirror is
+brought up to date with the runs table before each query, so runs ingested while it was
+unavailable (or locked by another process) are added then.
+
+Without those packages the same queries run against SQLite directly. They give the same
+results for ingested runs, only more slowly, but skip registered runs, whose metrics aren't
+in the database.
+"""
+import datetime
+import itertools
+import json
+import logging
+import math
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from logviz.database import Database
+
+# spec columns runs can be grouped and filtered by; completion_fns are joined with ","
+SPEC_COLUMNS = ("eval_name", "base_eval", "split", "completion_fns")
+GROUP_COLUMNS = ("run_id", *SPEC_COLUMNS)
+AGGREGATES = {
+    "mean": "AVG(value)",
+    "min": "MIN(value)",
+    "max": "MAX(value)",
+    "sum": "SUM(value)",
+    "count": "COUNT(value)",
+}
+# run columns runs can be filtered by range, as in `Database.get_run_page`, and the columns of
+# the metric values they are compared as (created_at there is the sample's)
+RANGE_COLUMNS = {"uploaded_at": "run_uploaded_at", "created_at": "run_created_at"}
+INTERVALS = ("minute", "hour", "day", "week", "month")
+# SQLite equivalents of DuckDB's date_trunc, as ISO 8601 strings
+_SQLITE_BUCKETS = {
+    "minute": "strftime('%Y-%m-%dT%H:%M:00', created_at)",
+    "hour": "strftime('%Y-%m-%dT%H:00:00', created_at)",
+    "day": "strftime('%Y-%m-%dT00:00:00', created_at)",
+    "week": "strftime('%Y-%m-%dT00:00:00', created_at, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01T00:00:00', created_at)",
+}
+ANALYTICS_FILENAME = "analytics.duckdb"
+# runs written to the mirror per transaction when catching up with the database
+SYNC_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+_MIRROR_SCHEMA = [
+    """ CREATE TABLE IF NOT EXISTS runs (
+            run_id VARCHAR PRIMARY KEY,
+            eval_name VARCHAR,
+            base_eval VARCHAR,
+            split VARCHAR,
+            completion_fns VARCHAR,
+            created_at TIMESTAMP,
+            uploaded_at VARCHAR
+        ) """,
+    """ CREATE TABLE IF NOT EXISTS metrics (
+            run_id VARCHAR NOT NULL,
+            sample_id VARCHAR NOT NULL,
+            key VARCHAR NOT NULL,
+            value DOUBLE,
+            created_at TIMESTAMP
+        ) """,
+    """ CREATE TABLE IF NOT EXISTS samples (
+            run_id VARCHAR NOT NULL,
+            sample_id VARCHAR NOT NULL,
+            num_events INTEGER,
+            num_sampling INTEGER,
+            num_function_calls INTEGER,
+            first_created_at VARCHAR,
+            last_created_at VARCHAR
+        ) """,
+]
+
+# metric values of every sample with its run's spec columns, one row per (run, sample)
+_MIRROR_VALUES = """
+    SELECT metrics.run_id, metrics.sample_id, metrics.value, metrics.created_at,
+           runs.eval_name, runs.base_eval, runs.split, runs.completion_fns,
+           runs.uploaded_at AS run_uploaded_at,
+           strftime(runs.created_at, '%Y-%m-%dT%H:%M:%S.%g') AS run_created_at
+    FROM metrics JOIN runs ON runs.run_id = metrics.run_id
+    WHERE metrics.key = ?
+"""
+# the same rows from SQLite; created_at is normalised as the runs table's is (see
+# `_COPY_SPEC_COLUMNS` in logviz.database), as strftime can't parse evals' "+0000" offsets
+_SQLITE_VALUES = """
+    WITH spec AS (
+        SELECT run_id,
+               MAX(CASE WHEN key = 'eval_name' THEN text END) AS eval_name,
+               MAX(CASE WHEN key = 'base_eval' THEN text END) AS base_eval,
+               MAX(CASE WHEN key = 'split' THEN text END) AS split,
+               MAX(CASE WHEN key = 'completion_fns' THEN (
+                   SELECT group_concat(fns.value, ',') FROM json_each(array) AS fns
+               ) END) AS completion_fns
+        FROM (
+            SELECT run_id, key,
+                   CASE WHEN json_valid(value) THEN json_extract(value, '$') END AS text,
+                   CASE WHEN json_valid(value) THEN
+                       CASE WHEN json_type(value) = 'array' THEN value END
+                   END AS array
+            FROM spec_data
+            WHERE key IN ('eval_name', 'base_eval', 'split', 'completion_fns')
+        )
+        GROUP BY run_id
+    )
+    SELECT metric.run_id, metric.sample_id,
+           CASE WHEN json_valid(metric.value) THEN
+               CASE json_type(metric.value)
+                   WHEN 'integer' THEN CAST(metric.value AS REAL)
+                   WHEN 'real' THEN CAST(metric.value AS REAL)
+                   WHEN 'true' THEN 1.0
+                   WHEN 'false' THEN 0.0
+               END
+           END AS value,
+           CASE WHEN json_valid(created.value) THEN strftime(
+               '%Y-%m-%dT%H:%M:%f',
+               CASE WHEN json_extract(created.value, '$') GLOB '*[+-][0-9][0-9][0-9][0-9]'
+                   THEN substr(
+                       json_extract(created.value, '$'),
+                       1,
+                       length(json_extract(created.value, '$')) - 2
+                   ) || ':' || substr(json_extract(created.value, '$'), -2)
+                   ELSE json_extract(created.value, '$')
+               END
+           ) END AS created_at,
+           spec.eval_name, spec.base_eval, spec.split, spec.completion_fns,
+           runs.uploaded_at AS run_uploaded_at, runs.created_at AS run_created_at
+    FROM metric_data AS metric
+    JOIN spec ON spec.run_id = metric.run_id
+    JOIN runs ON runs.run_id = metric.run_id
+    LEFT JOIN metric_data AS created ON created.sample_id = metric.sample_id
+        AND created.run_id = metric.run_id AND created.key = 'created_at'
+    WHERE metric.key = ?
+"""
+
+_mirrors: dict[Path, Any] = {}
+_mirrors_lock = threading.Lock()
+# held while writing to a mirror, so that concurrent syncs (from GraphQL's reader threads, say)
+# don't both write the runs it is missing
+_writes_lock = threading.Lock()
+
+
+class Analytics:
+    # Set by the CLI's ingest commands, which would spend longer importing DuckDB and pyarrow
+    # than writing a small log takes: their runs are recorded as pending instead, and the
+    # server rewrites them before its next analytics query (see `sync`).
+    defer_writes = False
+
+    @staticmethod
+    def available() -> bool:
+        """Whether the columnar mirror can be used (its optional packages are installed)."""
+        try:
+            import duckdb  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @staticmethod
+    def mirror_path() -> Optional[Path]:
+        """Where the mirror of the current SQLite database lives (None for in-memory ones)."""
+        row = Database.get_connection().execute("PRAGMA database_list").fetchone()
+        if not row["file"]:
+            return None
+        return Path(row["file"]).with_name(ANALYTICS_FILENAME)
+
+    @classmethod
+    def mirror(cls) -> Optional[Any]:
+        """A cursor on the DuckDB mirror, or None if it can't be used (including while another
+        process has it open)."""
+        if not cls.available():
+            return None
+        path = cls.mirror_path()
+        if path is None:
+            return None
+        import duckdb
+
+        with _mirrors_lock:
+            conn = _mirrors.get(path)
+            if conn is None:
+                try:
+                    conn = duckdb.connect(str(path))
+                except duckdb.IOException:
+                    return None
+                for statement in _MIRROR_SCHEMA:
+                    conn.execute(statement)
+                _mirrors[path] = conn
+            return conn.cursor()
+
+    @classmethod
+    def add_run(cls, run_id: str) -> None:
+        """Write (or rewrite) a run to the mirror. Failures only delay it until the next sync."""
+        if cls.defer_writes:
+            Database.insert_analytics_pending(run_id)
+            return
+        try:
+            mirror = cls.mirror()
+            if mirror is not None:
+                with _writes_lock:
+                    _write_runs(mirror, [run_id])
+        except Exception as e:
+            logger.warning("Couldn't add run %s to the analytics mirror: %s", run_id, e)
+
+    @classmethod
+    def remove_run(cls, run_id: str) -> None:
+        if cls.defer_writes:
+            # the next sync drops the runs that are no longer in the database
+            return
+        try:
+            mirror = cls.mirror()
+            if mirror is not None:
+                with _writes_lock:
+                    _delete_run(mirror, run_id)
+        except Exception as e:
+            logger.warning("Couldn't remove run %s from the analytics mirror: %s", run_id, e)
+
+    @classmethod
+    def sync(cls, mirror: Any) -> None:
+        """Add the runs the mirror is missing, rewrite the pending ones (which may have been
+        replaced or appended to) and drop the ones that have been deleted."""
+        with _writes_lock:
+            # read first, so that runs marked while this syncs stay pending
+            pending = Database.get_analytics_pending()
+            run_ids = {row["run_id"] for row in Database.get_run_ids()}
+            mirrored = {row[0] for row in mirror.execute("SELECT run_id FROM runs").fetchall()}
+            for run_id in mirrored - run_ids:
+                _delete_run(mirror, run_id)
+            _write_runs(mirror, sorted({row["run_id"] for row in pending} & mirrored & run_ids))
+            _write_runs(mirror, sorted(run_ids - mirrored), replace=False)
+            if pending:
+                Database.delete_analytics_pending(pending[-1]["rowid"])
+
+    @classmethod
+    def group_by(cls, key: str, group_by: list[str], filters: dict) -> list[dict]:
+        """Aggregates of a metric over the samples of each group of runs."""
+        columns = _check_columns(group_by)
+        select = ", ".join(columns)
+        rows = cls._query(
+            key,
+            filters,
+            f""" SELECT {select}, COUNT(DISTINCT run_id) AS num_runs, COUNT(value) AS count,
+                        AVG(value) AS mean, MIN(value) AS min, MAX(value) AS max,
+                        AVG(value * value) AS mean_square
+                 FROM ({{values}}) AS metric_values {{where}}
+                 GROUP BY {select} ORDER BY {select} """,
+        )
+        groups = []
+        for row in rows:
+            group = dict(zip(columns, row[: len(columns)]))
+            num_runs, count, mean, minimum, maximum, mean_square = row[len(columns) :]
+            groups.append(
+                {
+                    "group": group,
+                    "num_runs": num_runs,
+                    "count": count,
+                    "mean": mean,
+                    "min": minimum,
+                    "max": maximum,
+                    # population standard deviation
+                    "std": None if mean is None else math.sqrt(max(mean_square - mean**2, 0.0)),
+                }
+            )
+        return groups
+
+    @classmethod
+    def pivot(cls, key: str, rows: str, columns: str, aggregate: str, filters: dict) -> dict:
+        """An aggregate of a metric with one row per value of `rows` and one column per value
+        of `columns`; cells without samples are None."""
+        row_column, column_column = _check_columns([rows, columns])
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate `{aggregate}`")
+        cells = cls._query(
+            key,
+            filters,
+            f""" SELECT {row_column}, {column_column}, {AGGREGATES[aggregate]}
+                 FROM ({{values}}) AS metric_values {{where}}
+                 GROUP BY {row_column}, {column_column} """,
+        )
+        row_labels = sorted({cell[0] for cell in cells}, key=_label_order)
+        column_labels = sorted({cell[1] for cell in cells}, key=_label_order)
+        row_index = {label: i for i, label in enumerate(row_labels)}
+        column_index = {label: i for i, label in enumerate(column_labels)}
+        values: list[list[Optional[float]]] = [[None] * len(column_labels) for _ in row_labels]
+        for row_label, column_label, value in cells:
+            values[row_index[row_label]][column_index[column_label]] = value
+        return {
+            "key": key,
+            "aggregate": aggregate,
+            "row_labels": row_labels,
+            "column_labels": column_labels,
+            "values": values,
+        }
+
+    @classmethod
+    def timeseries(
+        cls, key: str, interval: str, group_by: Optional[str], filters: dict
+    ) -> list[dict]:
+        """Aggregates of a metric over the samples that finished in each time interval (by
+        their metrics' created_at), optionally split by a run column."""
+        if interval not in INTERVALS:
+            raise ValueError(f"Unknown interval `{interval}`")
+        group = "NULL" if group_by is None else _check_columns([group_by])[0]
+        rows = cls._query(
+            key,
+            filters,
+            f""" SELECT bucket, grp, COUNT(value), AVG(value), MIN(value), MAX(value)
+                 FROM (
+                     SELECT {{bucket}} AS bucket, {group} AS grp, value
+                     FROM ({{values}}) AS metric_values {{where}}
+                 ) AS bucketed
+                 WHERE bucket IS NOT NULL
+                 GROUP BY bucket, grp ORDER BY grp, bucket """,
+            interval=interval,
+        )
+        return [
+            {"bucket": bucket, "group": grp, "count": count, "mean": mean, "min": lo, "max": hi}
+            for bucket, grp, count, mean, lo, hi in rows
+        ]
+
+    @classmethod
+    def _query(
+        cls, key: str, filters: dict, template: str, interval: Optional[str] = None
+    ) -> list[tuple]:
+        """Run a query over the values of a metric key, filtered by run columns; `template`
+        has `{values}`, `{where}` and `{bucket}` placeholders for the backend's pieces."""
+        where, parameters = _where(filters)
+        mirror = cls.mirror()
+        if mirror is not None:
+            cls.sync(mirror)
+            bucket = (
+                "NULL"
+                if interval is None
+                else f"strftime(date_trunc('{interval}', created_at), '%Y-%m-%dT%H:%M:%S')"
+            )
+            sql = template.format(values=_MIRROR_VALUES, where=where, bucket=bucket)
+            return [tuple(row) for row in mirror.execute(sql, [key, *parameters]).fetchall()]
+        bucket = "NULL" if interval is None else _SQLITE_BUCKETS[interval]
+        sql = template.format(values=_SQLITE_VALUES, where=where, bucket=bucket)
+        cursor = Database.get_connection().cursor()
+        return [tuple(row) for row in cursor.execute(sql, [key, *parameters]).fetchall()]
+
+
+def _check_columns(columns: list[str]) -> list[str]:
+    for column in columns:
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Can't group by `{column}`; use one of {', '.join(GROUP_COLUMNS)}")
+    return columns
+
+
+def _where(filters: dict) -> tuple[str, list]:
+    """A WHERE clause keeping runs whose columns take one of the given values, and whose range
+    columns fall in the given (since, before) range of normalised timestamps (either of which
+    may be None)."""
+    clauses = []
+    parameters: list = []
+    for column, values in filters.items():
+        if column not in RANGE_COLUMNS:
+            _check_columns([column])
+        if values is None:
+            continue
+        if column in RANGE_COLUMNS:
+            since, before = values
+            if since is not None:
+                clauses.append(f"{RANGE_COLUMNS[column]} >= ?")
+                parameters.append(since)
+            if before is not None:
+                clauses.append(f"{RANGE_COLUMNS[column]} < ?")
+                parameters.append(before)
+        else:
+            clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            parameters += values
+    return ("WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+
+def _label_order(label: Any) -> tuple[bool, str]:
+    # None (runs without the column) last
+    return (label is None, str(label))
+
+
+def _delete_run(mirror: Any, run_id: str) -> None:
+    for table in ("metrics", "samples", "runs"):
+        mirror.execute(f"DELETE FROM {table} WHERE run_id = ?", [run_id])
+
+
+def _write_runs(mirror: Any, run_ids: list[str], replace: bool = True) -> None:
+    """Write runs to the mirror in batches of `SYNC_BATCH_SIZE`, one insert per table each;
+    with `replace`, whatever the mirror already has for them is deleted first."""
+    import pyarrow as pa
+
+    metrics_schema = pa.schema(
+        [
+            ("run_id", pa.string()),
+            ("sample_id", pa.string()),
+            ("key", pa.string()),
+            ("value", pa.float64()),
+            ("created_at", pa.timestamp("us")),
+        ]
+    )
+    samples_schema = pa.schema(
+        [
+            ("run_id", pa.string()),
+            ("sample_id", pa.string()),
+            ("num_events", pa.int32()),
+            ("num_sampling", pa.int32()),
+            ("num_function_calls", pa.int32()),
+            ("first_created_at", pa.string()),
+            ("last_created_at", pa.string()),
+        ]
+    )
+    for batch_start in range(0, len(run_ids), SYNC_BATCH_SIZE):
+        runs: list[list] = []
+        metric_columns: dict[str, list] = {name: [] for name in metrics_schema.names}
+        samples: list[dict] = []
+        for run_id in run_ids[batch_start : batch_start + SYNC_BATCH_SIZE]:
+            metadata = Database.get_metadata_json_rows(run_id)
+            if not metadata:
+                continue
+            run, spec_json = metadata[0]
+            runs.append(_run_row(run, spec_json))
+            _add_metric_rows(metric_columns, run_id)
+            samples += Database.get_sample_event_summaries(run_id)
+
+        mirror.execute("BEGIN TRANSACTION")
+        try:
+            if replace:
+                for row in runs:
+                    _delete_run(mirror, row[0])
+            mirror.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", runs)
+            mirror.register("new_metrics", pa.table(metric_columns, schema=metrics_schema))
+            mirror.register("new_samples", pa.Table.from_pylist(samples, schema=samples_schema))
+            mirror.execute("INSERT INTO metrics SELECT * FROM new_metrics")
+            mirror.execute("INSERT INTO samples SELECT * FROM new_samples")
+            mirror.unregister("new_metrics")
+            mirror.unregister("new_samples")
+            mirror.execute("COMMIT")
+        except Exception:
+            mirror.execute("ROLLBACK")
+            raise
+
+
+def _run_row(run: dict, spec_json: dict) -> list:
+    spec = {key: json.loads(value) for key, value in spec_json.items()}
+    completion_fns = spec.get("completion_fns")
+    if isinstance(completion_fns, list):
+        completion_fns = ",".join(str(fn) for fn in completion_fns)
+    return [
+        run["run_id"],
+        spec.get("eval_name"),
+        spec.get("base_eval"),
+        spec.get("split"),
+        completion_fns,
+        _parse_timestamp(spec.get("created_at")),
+        run["uploaded_at"],
+    ]
+
+
+def _add_metric_rows(columns: dict[str, list], run_id: str) -> None:
+    """Append a run's metrics to `columns`, each value with its sample's created_at."""
+    rows = Database.iter_raw_metric_rows(run_id)
+    for sample_id, sample_rows in itertools.groupby(rows, key=lambda row: row["sample_id"]):
+        values = {row["key"]: json.loads(row["value"]) for row in sample_rows}
+        created_at = _parse_timestamp(values.pop("created_at", None))
+        for key, value in values.items():
+            columns["run_id"].append(run_id)
+            columns["sample_id"].append(sample_id)
+            columns["key"].append(key)
+            columns["value"].append(_numeric(value))
+            columns["created_at"].append(created_at)
+
+
+def _numeric(value: Any) -> Optional[float]:
+    """A metric value as a number to aggregate; booleans count as 0/1, NaN as missing."""
+    if isinstance(value, (bool, int, float)) and not (
+        isinstance(value, float) and math.isnan(value)
+    ):
+        return float(value)
+    return None
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime.datetime]:
+    """An evals created_at as a naive UTC datetime (times without an offset are taken as UTC)."""
+    if not isinstance(value, str):
+        return None
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
@@ -3,14 +3,31 @@ import json
 import sqlite3
 from pathlib import Path
 
-from flask import Flask, render_template, request
-from graphql_server.flask import GraphQLView
+from flask import Flask, Response, render_template, request, stream_with_context
 from werkzeug.utils import secure_filename
 
-from logviz.database import Database
-from logviz.graphql_queries import schema
+from logviz.compression import Compression
+from logviz.database import ON_DUPLICATE_MODES, Database, DuplicateRunError
+from logviz.export import MIMETYPES, RunNotFoundError, export_filename, iter_export
+from logviz.fast_path import (
+    metadata_json,
+    metadata_list_json,
+    run_page_bootstrap,
+    sample_page_json,
+    sample_page_window_json,
+    script_safe_json,
+)
+from logviz.instrumentation import Instrumentation
+from logviz.jsonl_index import forget_index
+from logviz.maintenance import Maintenance
+from logviz.profiling import Profiler
 
 app = Flask(__name__)
+Instrumentation.init_app(app)
+Profiler.init_app(app)
+Maintenance.init_app(app)
+# registered last so that it runs first, and the metrics above see the compressed sizes
+Compression.init_app(app)
 
 
 # @app.before_request
@@ -18,6 +35,7 @@ app = Flask(__name__)
 #     app.logger.debug('Headers: %s', request.headers)
 #     app.logger.debug('Body: %s', request.get_data())
 
+
 # Home page
 @app.route("/")
 def index() -> str:
@@ -35,25 +53,67 @@ def display_run() -> tuple[str, int]:
         return f"Invalid page_id {page_id}", 400
     view = request.args.get("view", "default")
 
-    # get the run name from the database before rendering the page
-    run_name = Database.get_run_name(run_id)
-
     rendered_template: str
     match view:
         case "default":
+            # embed everything needed for the first paint so the page's scripts don't have to
+            # make their own requests
+            bootstrap = run_page_bootstrap(run_id, int(page_id))
+            if bootstrap is None:
+                return f"Run {run_id} not found", 404
+            run_name, bootstrap_json = bootstrap
             rendered_template = render_template(
-                "default_page_view.html", run_id=run_id, page_id=page_id, run_name=run_name
+                "default_page_view.html",
+                run_id=run_id,
+                page_id=page_id,
+                run_name=run_name,
+                bootstrap=script_safe_json(bootstrap_json),
             )
             return rendered_template, 200
         case "task":
+            num_samples = Database.get_num_samples(run_id)
+            if num_samples is None:
+                return f"Run {run_id} not found", 404
+            # get the run name from the database before rendering the page
+            run_name = Database.get_run_name(run_id)
             rendered_template = render_template(
-                "timeline_view.html", run_id=run_id, page_id=page_id, run_name=run_name
+                "timeline_view.html",
+                run_id=run_id,
+                page_id=page_id,
+                run_name=run_name,
+                sample_id=Database.get_sample_id_for_page(run_id, int(page_id) - 1),
+                num_samples=num_samples,
             )
             return rendered_template, 200
         case _:
             raise ValueError(f"Unknown view {view}")
 
 
+@app.route("/metrics")
+def metrics() -> Response:
+    """Prometheus scrape endpoint for request, resolver and SQL metrics."""
+    return Instrumentation.render()
+
+
+@app.route("/admin/profiles")
+def list_profiles() -> tuple[dict, int]:
+    if not app.config["PROFILING"]:
+        return {"error": "Profiling is disabled (run with --profiling)"}, 404
+    return {"profiles": Profiler.list_captures()}, 200
+
+
+@app.route("/admin/profiles/<int:profile_id>")
+def get_profile(profile_id: int) -> tuple[dict, int] | Response:
+    if not app.config["PROFILING"]:
+        return {"error": "Profiling is disabled (run with --profiling)"}, 404
+    capture = Profiler.get_capture(profile_id)
+    if capture is None:
+        return {"error": f"Profile {profile_id} not found"}, 404
+    if request.args.get("format") == "text":
+        return Response(capture["profile"] or "No profile recorded.", content_type="text/plain")
+    return capture, 200
+
+
 @app.route("/api/delete", methods=["DELETE"])
 def delete_file() -> tuple[dict, int]:
     logviz_dir = app.config["LOGVIZ_DIR"]
@@ -89,6 +149,12 @@ def upload_files() -> tuple[dict, int]:
     logviz_dir.mkdir(parents=True, exist_ok=True)
 
     uploaded_files = request.files.getlist("files[]")
+    # with mode=index, logs are kept on disk and served from there instead of being ingested
+    index_only = request.form.get("mode", request.args.get("mode")) == "index"
+    # what to do with logs of runs that are already ingested: error (409), replace or append
+    on_duplicate = request.form.get("on_duplicate", request.args.get("on_duplicate", "error"))
+    if on_duplicate not in ON_DUPLICATE_MODES:
+        return {"error": f"Invalid on_duplicate mode `{on_duplicate}`."}, 400
 
     for uploaded_file in uploaded_files:
         if uploaded_file.filename == "":
@@ -107,12 +173,38 @@ def upload_files() -> tuple[dict, int]:
             return {"error": f"Invalid file type `{fname}`."}, 400
 
         uploaded_at = datetime.datetime.now().isoformat()
+        if index_only:
+            fpath = logviz_dir / fname
+            while fpath.exists():
+                fname = f"(1)_{fname}"
+                fpath = logviz_dir / fname
+            uploaded_file.save(fpath)
+            try:
+                Database.register_file(fpath, uploaded_at=uploaded_at)
+            except Exception as e:
+                forget_index(fpath.resolve())
+                fpath.unlink()
+                if isinstance(e, DuplicateRunError):
+                    return {"error": str(e), "run_id": e.run_id}, 409
+                if isinstance(e, sqlite3.IntegrityError):
+                    return {"error": str(e)}, 400
+                if isinstance(e, (KeyError, ValueError)):
+                    return {"error": "Invalid JSONL formatting"}, 400
+                return {"error": str(e)}, 500
+            continue
+
         try:
-            Database.process_file(uploaded_file, uploaded_at=uploaded_at)
+            Database.process_file(
+                uploaded_file.stream, uploaded_at=uploaded_at, on_duplicate=on_duplicate
+            )
+        except DuplicateRunError as e:
+            return {"error": str(e), "run_id": e.run_id}, 409
         except sqlite3.IntegrityError as e:
             return {"error": str(e)}, 400
         except KeyError:
             return {"error": "Invalid JSONL formatting"}, 400
+        except ValueError as e:
+            return {"error": str(e)}, 400
         except Exception as e:
             return {"error": str(e)}, 500
 
@@ -127,9 +219,91 @@ def upload_files() -> tuple[dict, int]:
     return {"message": "File(s) uploaded successfully."}, 200
 
 
+@app.route("/api/sample_page")
+def sample_page() -> tuple[dict, int] | Response:
+    """Fast path for the run page: `sample_page` and `metadata` in GraphQL response shape."""
+    run_id = request.args.get("run_id")
+    page_id = request.args.get("page_id", 1, type=int)
+    # cut message contents to previews of this many characters (see `message_content`)
+    max_chars = request.args.get("max_chars", None, type=int)
+    if run_id is None:
+        return {"error": "No run_id provided"}, 400
+    page = sample_page_json(run_id, page_id, max_chars)
+    metadata = metadata_json(run_id)
+    body = f'{{"data": {{"sample_page": {page or "null"}, "metadata": {metadata or "null"}}}}}'
+    return Response(body, content_type="application/json")
+
+
+@app.route("/api/sample_page_window")
+def sample_page_window() -> tuple[dict, int] | Response:
+    """Fast path for prefetching: `sample_page_window` and `metadata` in GraphQL response shape."""
+    run_id = request.args.get("run_id")
+    page_id = request.args.get("page_id", 1, type=int)
+    radius = request.args.get("radius", 1, type=int)
+    max_chars = request.args.get("max_chars", None, type=int)
+    if run_id is None:
+        return {"error": "No run_id provided"}, 400
+    pages = sample_page_window_json(run_id, page_id, radius, max_chars)
+    metadata = metadata_json(run_id)
+    body = f'{{"data": {{"sample_page_window": {pages}, "metadata": {metadata or "null"}}}}}'
+    return Response(body, content_type="application/json")
+
+
+@app.route("/api/metadata_list")
+def metadata_list() -> Response:
+    """Fast path for the index page: `metadata_list` in GraphQL response shape."""
+    body = f'{{"data": {{"metadata_list": {metadata_list_json()}}}}}'
+    return Response(body, content_type="application/json")
+
+
+@app.route("/api/export")
+def export_run() -> tuple[dict, int] | Response:
+    """Stream a run back out as JSONL, or its metrics/spec as Parquet or Arrow IPC."""
+    run_id = request.args.get("run_id")
+    export_format = request.args.get("format", "jsonl")
+    table = request.args.get("table", "metrics")
+    if run_id is None:
+        return {"error": "No run_id provided"}, 400
+    try:
+        chunks = iter_export(run_id, export_format, table)
+    except RunNotFoundError:
+        return {"error": f"Run {run_id} not found"}, 404
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except ImportError as e:
+        return {"error": str(e)}, 501
+    filename = export_filename(run_id, export_format, table)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=MIMETYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+def graphql_view(*args, **kwargs):
+    """Build the graphene schema and GraphQLView on the first request rather than at import."""
+    view = app.extensions.get("logviz_graphql_view")
+    if view is None:
+        from logviz.graphql_queries import schema
+        from logviz.persisted_queries import DocumentCache
+        from logviz.query_limits import LogvizGraphQLView, init_config
+        from logviz.readers import ReaderPool
+
+        init_config(app.config)
+        num_readers = app.config["GRAPHQL_READER_THREADS"]
+        # without reader threads, resolvers read on the request's own connection, one by one
+        readers = ReaderPool(app.config["DATABASE_URI"], num_readers) if num_readers > 0 else None
+        documents = DocumentCache(schema.graphql_schema, app.config["GRAPHQL_DOCUMENT_CACHE_SIZE"])
+        view = LogvizGraphQLView.as_view(
+            "graphql", schema=schema, graphiql=True, readers=readers, documents=documents
+        )
+        app.extensions["logviz_graphql_view"] = view
+    return view(*args, **kwargs)
+
+
 # Setup GraphQL route
 app.add_url_rule(
-    "/graphql", "graphql", view_func=GraphQLView.as_view("graphql", schema=schema, graphiql=True)
+    "/graphql", "graphql", view_func=graphql_view, methods=["GET", "POST", "PUT", "DELETE"]
 )
 
 
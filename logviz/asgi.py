@@ -0,0 +1,17 @@
+"""ASGI entry point, for serving logviz with an ASGI server such as uvicorn or hypercorn:
+
+    LOGVIZ_ARGS="--dir ~/.logviz" uvicorn logviz.asgi:application
+
+`LOGVIZ_ARGS` takes the same server options as the `logviz` command. The Flask app is served
+through asgiref's WSGI adapter, which handles each request on a worker thread; GraphQL
+resolvers still read from the database concurrently on the app's reader threads (see
+`logviz.readers`).
+"""
+import os
+import shlex
+
+from asgiref.wsgi import WsgiToAsgi
+
+from logviz.run import configure_app, parse_args
+
+application = WsgiToAsgi(configure_app(parse_args(shlex.split(os.environ.get("LOGVIZ_ARGS", "")))))
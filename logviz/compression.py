@@ -0,0 +1,195 @@
+"""Negotiated response compression.
+
+Responses with a compressible mimetype are encoded with the best encoding the client accepts,
+out of brotli and zstd (when the optional `brotli` / `zstandard` packages are installed) and
+gzip. Buffered responses are only compressed above `COMPRESSION_MIN_SIZE` bytes; streamed
+responses (exports) are compressed chunk by chunk as they are generated, so they are never
+held in memory in either form.
+
+Static files are not compressed per request. Instead, `scripts/precompress_static.py` writes
+`.br` / `.gz` variants next to them at build time, and those are served when the client
+accepts them.
+"""
+import mimetypes
+import zlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from flask import Flask, Response
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/jsonl",
+    "application/javascript",
+    "application/vnd.apache.arrow.stream",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+# levels for compressing on the fly, chosen for speed; precompressed files use the maximum
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+# file suffix of the precompressed variant of a static file, per encoding
+STATIC_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+class _GzipEncoder:
+    def __init__(self, level: int = GZIP_LEVEL) -> None:
+        # wbits 16 + 15 selects the gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int = BROTLI_QUALITY) -> None:
+        import brotli
+
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        compressed: bytes = self._compressor.process(data)
+        return compressed
+
+    def finish(self) -> bytes:
+        compressed: bytes = self._compressor.finish()
+        return compressed
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int = ZSTD_LEVEL) -> None:
+        import zstandard
+
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        compressed: bytes = self._compressor.compress(data)
+        return compressed
+
+    def finish(self) -> bytes:
+        compressed: bytes = self._compressor.flush()
+        return compressed
+
+
+def available_encoders() -> dict[str, Callable[[], Any]]:
+    """Encoder factories by Content-Encoding, most preferred first."""
+    encoders: dict[str, Callable[[], Any]] = {}
+    try:
+        import brotli  # noqa: F401
+
+        encoders["br"] = _BrotliEncoder
+    except ImportError:
+        pass
+    try:
+        import zstandard  # noqa: F401
+
+        encoders["zstd"] = _ZstdEncoder
+    except ImportError:
+        pass
+    encoders["gzip"] = _GzipEncoder
+    return encoders
+
+
+def negotiate(accept_encodings: Any, encodings: Iterable[str]) -> Optional[str]:
+    """The acceptable encoding with the highest q-value, ties going to the earliest one."""
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_stream(chunks: Iterable[Any], encoder: Any) -> Iterator[bytes]:
+    try:
+        for chunk in chunks:
+            compressed = encoder.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if compressed:
+                yield compressed
+        yield encoder.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class Compression:
+    @staticmethod
+    def init_app(app: "Flask") -> None:
+        # imported here to keep this module importable without Flask (see precompress_static)
+        from flask import request, send_from_directory
+
+        app.config.setdefault("COMPRESSION", True)
+        app.config.setdefault("COMPRESSION_MIN_SIZE", 1024)
+        encoders = available_encoders()
+
+        @app.after_request
+        def compress_response(response: "Response") -> "Response":
+            if (
+                not app.config["COMPRESSION"]
+                or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or not 200 <= response.status_code < 300
+                or response.status_code in (204, 206)
+                or "Content-Encoding" in response.headers
+            ):
+                return response
+            response.vary.add("Accept-Encoding")
+            encoding = negotiate(request.accept_encodings, encoders)
+            if encoding is None:
+                return response
+            encoder = encoders[encoding]()
+            if response.is_streamed:
+                response.response = compress_stream(response.response, encoder)
+                response.headers.pop("Content-Length", None)
+            else:
+                data = response.get_data()
+                if len(data) < app.config["COMPRESSION_MIN_SIZE"]:
+                    return response
+                response.set_data(encoder.compress(data) + encoder.finish())
+            response.headers["Content-Encoding"] = encoding
+            return response
+
+        static_folder = Path(app.static_folder or "static")
+
+        def static_precompressed(filename: str) -> "Response":
+            """Serve a precompressed variant of a static file if there is an acceptable one."""
+            variants = [
+                encoding
+                for encoding, suffix in STATIC_SUFFIXES.items()
+                if _is_fresh_variant(static_folder / filename, suffix)
+            ]
+            encoding = negotiate(request.accept_encodings, variants) if variants else None
+            if encoding is None or not app.config["COMPRESSION"]:
+                response = app.send_static_file(filename)
+            else:
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                response = send_from_directory(
+                    static_folder,
+                    filename + STATIC_SUFFIXES[encoding],
+                    mimetype=mimetype,
+                    max_age=app.get_send_file_max_age(filename),
+                )
+                response.headers["Content-Encoding"] = encoding
+            if variants:
+                response.vary.add("Accept-Encoding")
+            return response
+
+        app.view_functions["static"] = static_precompressed
+
+
+def _is_fresh_variant(path: Path, suffix: str) -> bool:
+    """Whether `path` has a precompressed variant that is at least as new as it is."""
+    variant = path.with_name(path.name + suffix)
+    try:
+        return variant.is_file() and variant.stat().st_mtime >= path.stat().st_mtime
+    except (OSError, ValueError):
+        return False
@@ -1,15 +1,253 @@
+import datetime
+import hashlib
+import itertools
 import json
 import sqlite3
+import threading
 from pathlib import Path
-from typing import Any, Optional
+from typing import IO, Any, Iterable, Iterator, Optional, Sequence
 
-from flask import current_app, g
-from werkzeug.datastructures import FileStorage
+from logviz.instrumentation import InstrumentedConnection
+from logviz.jsonl_index import JsonlIndex, forget_index, open_index
+from logviz.trajectory import TrajectoryAccumulator, build_trajectory
+
+# Copies the spec columns the run list filters and sorts by (see `get_run_page`) onto the runs
+# table, for every run or (with a WHERE clause appended) one. completion_fns are joined with ","
+# as in logviz.analytics, and created_at is normalised to the ISO 8601 form strftime gives
+# (evals writes "2024-01-01 12:00:00.123456", with or without an offset like "+0000"), or kept
+# as it is if it can't be parsed.
+_COPY_SPEC_COLUMNS = """
+    UPDATE runs SET
+        eval_name = (
+            SELECT json_extract(value, '$') FROM spec_data
+            WHERE spec_data.run_id = runs.run_id AND key = 'eval_name'
+        ),
+        base_eval = (
+            SELECT json_extract(value, '$') FROM spec_data
+            WHERE spec_data.run_id = runs.run_id AND key = 'base_eval'
+        ),
+        split = (
+            SELECT json_extract(value, '$') FROM spec_data
+            WHERE spec_data.run_id = runs.run_id AND key = 'split'
+        ),
+        completion_fns = (
+            SELECT group_concat(fns.value, ',') FROM spec_data, json_each(spec_data.value) AS fns
+            WHERE spec_data.run_id = runs.run_id AND spec_data.key = 'completion_fns'
+        ),
+        created_at = COALESCE((
+            SELECT COALESCE(
+                strftime(
+                    '%Y-%m-%dT%H:%M:%f',
+                    CASE WHEN json_extract(value, '$') GLOB '*[+-][0-9][0-9][0-9][0-9]'
+                        THEN substr(
+                            json_extract(value, '$'), 1, length(json_extract(value, '$')) - 2
+                        ) || ':' || substr(json_extract(value, '$'), -2)
+                        ELSE json_extract(value, '$')
+                    END
+                ),
+                json_extract(value, '$')
+            )
+            FROM spec_data WHERE spec_data.run_id = runs.run_id AND key = 'created_at'
+        ), '')
+"""
+# Counts the facet values of all runs into run_facet_counts, which starts empty.
+_COUNT_FACETS = """
+    INSERT INTO run_facet_counts (facet, value, count)
+    SELECT 'eval_name', json_quote(eval_name), COUNT(*) FROM runs GROUP BY eval_name
+    UNION ALL SELECT 'base_eval', json_quote(base_eval), COUNT(*) FROM runs GROUP BY base_eval
+    UNION ALL SELECT 'split', json_quote(split), COUNT(*) FROM runs GROUP BY split
+    UNION ALL SELECT 'completion_fns', json_quote(completion_fns), COUNT(*) FROM runs
+    GROUP BY completion_fns
+"""
+# Adds the facet values of a run (with `run_id = ?` once per facet column) to run_facet_counts,
+# or (with `SUBTRACT_FACETS`) takes them away. Values are JSON text, so that NULL has a row too.
+_ADD_FACETS = """
+    INSERT INTO run_facet_counts (facet, value, count)
+    SELECT 'eval_name', json_quote(eval_name), 1 FROM runs WHERE run_id = ?
+    UNION ALL SELECT 'base_eval', json_quote(base_eval), 1 FROM runs WHERE run_id = ?
+    UNION ALL SELECT 'split', json_quote(split), 1 FROM runs WHERE run_id = ?
+    UNION ALL SELECT 'completion_fns', json_quote(completion_fns), 1 FROM runs WHERE run_id = ?
+    ON CONFLICT (facet, value) DO UPDATE SET count = count + 1
+"""
+_SUBTRACT_FACETS = """
+    UPDATE run_facet_counts SET count = count - 1 WHERE (facet, value) IN (
+        SELECT 'eval_name', json_quote(eval_name) FROM runs WHERE run_id = ?
+        UNION ALL SELECT 'base_eval', json_quote(base_eval) FROM runs WHERE run_id = ?
+        UNION ALL SELECT 'split', json_quote(split) FROM runs WHERE run_id = ?
+        UNION ALL SELECT 'completion_fns', json_quote(completion_fns) FROM runs WHERE run_id = ?
+    )
+"""
+# The facets of all runs, as `get_run_facets` counts them for a filtered list. Runs without a
+# created_at have '' (and runs always have an uploaded_at, but older ones may have had NULL).
+_ALL_RUN_FACETS = """
+    SELECT facet, value, NULL AS max_value, count FROM run_facet_counts
+    UNION ALL SELECT 'uploaded_at',
+        (SELECT MIN(uploaded_at) FROM runs WHERE uploaded_at > ''),
+        (SELECT MAX(uploaded_at) FROM runs WHERE uploaded_at > ''), NULL
+    UNION ALL SELECT 'created_at',
+        (SELECT MIN(created_at) FROM runs WHERE created_at > ''),
+        (SELECT MAX(created_at) FROM runs WHERE created_at > ''), NULL
+"""
+# Bumped whenever a migration is appended to MIGRATIONS; stored in `PRAGMA user_version` so
+# that startup can skip schema checks on an up-to-date database.
+SCHEMA_VERSION = 9
+# MIGRATIONS[i] holds the statements that upgrade a version i + 1 database to version i + 2.
+# The CREATE TABLE statements in `initialize_db` describe version 1 and must not be changed.
+MIGRATIONS: list[list[str]] = [
+    # 2: runs served from their JSONL file (see logviz.jsonl_index)
+    [
+        """ CREATE TABLE IF NOT EXISTS external_logs (
+                run_id text PRIMARY KEY,
+                path text NOT NULL,
+                FOREIGN KEY (run_id) REFERENCES runs (run_id)
+            ); """,
+    ],
+    # 3: content hashes of ingested files, to recognise re-uploads before processing them
+    [
+        """ CREATE TABLE IF NOT EXISTS ingested_files (
+                content_hash text PRIMARY KEY,
+                run_id text NOT NULL,
+                uploaded_at text,
+                FOREIGN KEY (run_id) REFERENCES runs (run_id)
+            ); """,
+        "CREATE INDEX IF NOT EXISTS ingested_files_run_id ON ingested_files (run_id)",
+    ],
+    # 4: per-sample trajectories (see logviz.trajectory), built at ingest; runs ingested
+    # before this are filled in the first time their samples are viewed
+    [
+        """ CREATE TABLE IF NOT EXISTS trajectory_steps (
+                run_id text NOT NULL,
+                sample_id text NOT NULL,
+                step integer NOT NULL,
+                event_id integer NOT NULL,
+                kind text NOT NULL,
+                role text,
+                content text,
+                name text,
+                function_call text,
+                rewind_to integer,
+                PRIMARY KEY (run_id, sample_id, step),
+                FOREIGN KEY (run_id) REFERENCES runs (run_id)
+            ); """,
+        # the primary key of events starts with event_id, so it can't serve per-sample reads
+        "CREATE INDEX IF NOT EXISTS events_sample ON events (run_id, sample_id, event_id)",
+    ],
+    # 5: per-run reads of metric_data (exports, run stats, the analytics mirror), which its
+    # primary key can't serve either
+    [
+        "CREATE INDEX IF NOT EXISTS metric_data_run ON metric_data (run_id, sample_id, key)",
+    ],
+    # 6: per-run reads of samples (sample ids, pages, deletes) and single-event reads by id
+    # (message contents), which scanned the table or all of the run's events; see
+    # logviz.query_catalogue for the plans every statement is expected to get
+    [
+        "CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id, sample_id)",
+        "CREATE INDEX IF NOT EXISTS events_run_event ON events (run_id, event_id)",
+    ],
+    # 7: MinHash signatures of samples' prompts and their LSH band buckets (see
+    # logviz.similarity); samples of runs ingested before this get theirs when first looked up
+    [
+        """ CREATE TABLE IF NOT EXISTS sample_signatures (
+                run_id text NOT NULL,
+                sample_id text NOT NULL,
+                signature blob NOT NULL,
+                PRIMARY KEY (run_id, sample_id),
+                FOREIGN KEY (run_id) REFERENCES runs (run_id)
+            ); """,
+        """ CREATE TABLE IF NOT EXISTS sample_bands (
+                bucket integer NOT NULL,
+                run_id text NOT NULL,
+                sample_id text NOT NULL,
+                PRIMARY KEY (bucket, run_id, sample_id),
+                FOREIGN KEY (run_id) REFERENCES runs (run_id)
+            ); """,
+        "CREATE INDEX IF NOT EXISTS sample_bands_run ON sample_bands (run_id, sample_id)",
+    ],
+    # 8: the spec columns the run list filters by and counts facets of, and an index per sort
+    # column ending in run_id, so that a page of runs is read in order from a cursor onwards
+    [
+        "ALTER TABLE runs ADD COLUMN eval_name text",
+        "ALTER TABLE runs ADD COLUMN base_eval text",
+        "ALTER TABLE runs ADD COLUMN split text",
+        "ALTER TABLE runs ADD COLUMN completion_fns text",
+        # '' rather than NULL when the spec has none, so that cursors can compare it
+        "ALTER TABLE runs ADD COLUMN created_at text NOT NULL DEFAULT ''",
+        _COPY_SPEC_COLUMNS,
+        # the facets of all runs, which the run list shows unless it is filtered
+        """ CREATE TABLE IF NOT EXISTS run_facet_counts (
+                facet text NOT NULL,
+                value text NOT NULL,
+                count integer NOT NULL,
+                PRIMARY KEY (facet, value)
+            ); """,
+        _COUNT_FACETS,
+        "CREATE INDEX IF NOT EXISTS runs_uploaded_at ON runs (uploaded_at, run_id)",
+        "CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at, run_id)",
+        "CREATE INDEX IF NOT EXISTS runs_name ON runs (name, run_id)",
+        "CREATE INDEX IF NOT EXISTS runs_num_samples ON runs (num_samples, run_id)",
+        "CREATE INDEX IF NOT EXISTS runs_eval_name ON runs (eval_name)",
+        "CREATE INDEX IF NOT EXISTS runs_base_eval ON runs (base_eval)",
+        "CREATE INDEX IF NOT EXISTS runs_split ON runs (split)",
+        "CREATE INDEX IF NOT EXISTS runs_completion_fns ON runs (completion_fns)",
+    ],
+    # 9: runs written while the analytics mirror's writes were deferred (see
+    # `logviz.analytics.Analytics.defer_writes`), for the server to rewrite; not per-run data
+    # (see RUN_TABLES), as a deleted run must be dropped from the mirror too
+    [
+        "CREATE TABLE IF NOT EXISTS analytics_pending (run_id text NOT NULL)",
+    ],
+]
+# tables with rows per run, ordered so that deleting a run respects foreign key constraints
+RUN_TABLES = (
+    "events",
+    "spec_data",
+    "final_report_data",
+    "metric_data",
+    "run_stats",
+    "external_logs",
+    "ingested_files",
+    "trajectory_steps",
+    "sample_signatures",
+    "sample_bands",
+    "samples",
+    "runs",
+)
+# columns of runs the run list can be sorted by, each indexed together with run_id
+RUN_SORT_COLUMNS = ("uploaded_at", "created_at", "name", "num_samples")
+# columns of runs the run list can be filtered by value and counts the runs of each value of
+RUN_FACET_COLUMNS = ("eval_name", "base_eval", "split", "completion_fns")
+# columns of runs the run list can be filtered by range, and has the range of
+RUN_RANGE_COLUMNS = ("uploaded_at", "created_at")
+DEFAULT_RUN_PAGE_SIZE = 50
+MAX_RUN_PAGE_SIZE = 500
+# what `process_file` does with a log whose run is already in the database
+ON_DUPLICATE_MODES = ("error", "replace", "append")
+# how long a connection waits for another's write lock before raising "database is locked"; the
+# reader threads' lazy backfills (trajectory steps, run stats, signatures) write concurrently
+# with uploads and each other
+BUSY_TIMEOUT_SECONDS = 30.0
+# size of the chunks read when hashing a file
+HASH_CHUNK_SIZE = 1 << 20
+
+# connections opened with `Database.open`, used instead of Flask's `g` outside of requests
+_local = threading.local()
+
+
+class DuplicateRunError(sqlite3.IntegrityError):
+    """Raised before any work is done when a log's run (or the file itself) is already ingested."""
+
+    def __init__(self, run_id: str, same_file: bool = False) -> None:
+        what = "This file" if same_file else f"Run {run_id}"
+        super().__init__(f"{what} has already been ingested")
+        self.run_id = run_id
+        self.same_file = same_file
 
 
 class Database:
     @staticmethod
     def init_app(app):
+        from flask import g
+
         Path(app.config["DATABASE_URI"]).parent.mkdir(parents=True, exist_ok=True)
         with app.app_context():
             Database.initialize_db()
@@ -24,21 +262,60 @@ class Database:
             if db is not None:
                 db.close()
 
+    @staticmethod
+    def connect(database_uri) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database_uri,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=InstrumentedConnection,
+            timeout=BUSY_TIMEOUT_SECONDS,
+        )
+        conn.row_factory = sqlite3.Row
+        # readers don't block on a writer (or it on them) with the write-ahead log, so only
+        # writers wait, and only for each other; the mode is stored in the file, so this is a
+        # no-op after the first connection
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    @staticmethod
+    def open(database_uri) -> sqlite3.Connection:
+        """Use a connection on the current thread without Flask (CLI commands, worker threads)."""
+        Path(database_uri).parent.mkdir(parents=True, exist_ok=True)
+        conn: sqlite3.Connection = Database.connect(database_uri)
+        _local.connection = conn
+        Database.initialize_db()
+        return conn
+
+    @staticmethod
+    def close() -> None:
+        conn = getattr(_local, "connection", None)
+        if conn is not None:
+            conn.close()
+            _local.connection = None
+
     @staticmethod
     def get_connection():
+        conn = getattr(_local, "connection", None)
+        if conn is not None:
+            return conn
+        # deferred so that the CLI commands never import Flask
+        from flask import current_app, g
+
         if "db" not in g:
             # Assuming you have your database URI stored in app config
-            g.db = sqlite3.connect(
-                current_app.config["DATABASE_URI"], detect_types=sqlite3.PARSE_DECLTYPES
-            )
-            g.db.row_factory = sqlite3.Row
+            g.db = Database.connect(current_app.config["DATABASE_URI"])
         return g.db
 
     @classmethod
     def initialize_db(cls):
-        """Initializes the database, making sure the necessary tables are present."""
+        """Initializes the database, making sure the necessary tables are present.
+
+        Does nothing but read `PRAGMA user_version` if the schema is already up to date."""
         conn = cls.get_connection()
         cursor = conn.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
         tables = [
             """ CREATE TABLE IF NOT EXISTS runs (
                     run_id text PRIMARY KEY,
@@ -86,93 +363,250 @@ class Database:
                   FOREIGN KEY (run_id) REFERENCES runs (run_id),
                   FOREIGN KEY (sample_id) REFERENCES samples (sample_id)
               ); """,
+            """ CREATE TABLE IF NOT EXISTS run_stats (
+                    run_id text NOT NULL,
+                    key text NOT NULL,
+                    value text,
+                    PRIMARY KEY (run_id, key),
+                    FOREIGN KEY (run_id) REFERENCES runs (run_id)
+                ); """,
         ]
 
-        for table_sql in tables:
-            cursor.execute(table_sql)
+        # databases from before schema versioning are all at version 1
+        if version == 0:
+            # only takes effect before the first table is created (see `logviz.maintenance`)
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            for table_sql in tables:
+                cursor.execute(table_sql)
+            version = 1
+        for migration in MIGRATIONS[version - 1 :]:
+            for statement in migration:
+                cursor.execute(statement)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
 
     @classmethod
-    def process_file(cls, f: FileStorage, uploaded_at: str):
-        """Processes a log file and inserts the data into the database."""
-        lines = f.readlines()
+    def process_file(cls, f: IO[bytes], uploaded_at: str, on_duplicate: str = "error") -> str:
+        """Processes a log file and inserts the data into the database.
+
+        The file is hashed and its spec's run_id checked before anything is inserted, so
+        re-uploads are rejected with `DuplicateRunError` up front. With `on_duplicate="replace"`
+        an existing run is deleted and re-ingested instead; with `"append"` the file's samples
+        are added to it (re-appending an identical file is still an error)."""
+        from logviz.run_stats import RunStatsAccumulator
+        from logviz.similarity import SignatureAccumulator
+
+        if on_duplicate not in ON_DUPLICATE_MODES:
+            raise ValueError(f"Unknown on_duplicate mode `{on_duplicate}`")
+        content_hash = cls._hash_file(f)
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT run_id FROM ingested_files WHERE content_hash = ?", (content_hash,))
+        row = cursor.fetchone()
+        if row is not None and on_duplicate != "replace":
+            raise DuplicateRunError(row["run_id"], same_file=True)
+
         spec = None
         final_report = None
-        run_id = None
+        run_id: Optional[str] = None
         name = None
+        appending = False
+        existing_sample_ids: set[str] = set()
         sample_ids_to_write = set()
-        for line in lines:
-            line_data = json.loads(line)
-            if "spec" in line_data:
-                run_id = line_data["spec"]["run_id"]
-                spec = line_data["spec"]
-                for key, value in spec.items():
-                    cls.insert_spec_data(
-                        run_id=run_id,
-                        key=key,
-                        value=json.dumps(value),
-                        commit=False,
-                    )
-            elif "final_report" in line_data:
-                final_report = line_data["final_report"]
-                for key, value in final_report.items():
-                    cls.insert_final_report_data(
-                        run_id=run_id,
-                        key=key,
-                        value=json.dumps(value),
-                        commit=False,
-                    )
-            else:
-                try:
-                    event_type = line_data["type"]
-                    event_id = line_data["event_id"]
-                    sample_id = line_data["sample_id"]
-                    data = line_data["data"]
-                    created_at = line_data["created_at"]
-                    sample_ids_to_write.add(sample_id)
-                    if event_type == "metrics":
-                        # manually add created_at as a metric
-                        data["created_at"] = created_at
-                        for key, value in data.items():
-                            cls.insert_metric_data(
+        run_stats = RunStatsAccumulator()
+        trajectories = TrajectoryAccumulator()
+        signatures = SignatureAccumulator()
+        try:
+            # lines are processed as they are read rather than loading the whole file first
+            for line in f:
+                line_data = json.loads(line)
+                if "spec" in line_data:
+                    run_id = line_data["spec"]["run_id"]
+                    spec = line_data["spec"]
+                    if cls.get_num_samples(run_id) is not None:
+                        if on_duplicate == "error":
+                            raise DuplicateRunError(run_id)
+                        if on_duplicate == "replace":
+                            cls.delete_run(run_id, commit=False)
+                        elif cls.get_external_log(run_id) is not None:
+                            raise ValueError(f"Can't append to registered run {run_id}")
+                        else:
+                            appending = True
+                            existing_sample_ids = set(cls.get_sample_ids(run_id))
+                            # their prompts were signed when they were first ingested
+                            signatures.seen |= existing_sample_ids
+                    if appending:
+                        continue
+                    for key, value in spec.items():
+                        cls.insert_spec_data(
+                            run_id=run_id,
+                            key=key,
+                            value=json.dumps(value),
+                            commit=False,
+                        )
+                elif "final_report" in line_data:
+                    final_report = line_data["final_report"]
+                    if appending:
+                        cursor.execute("DELETE FROM final_report_data WHERE run_id = ?", (run_id,))
+                    for key, value in final_report.items():
+                        cls.insert_final_report_data(
+                            run_id=run_id,
+                            key=key,
+                            value=json.dumps(value),
+                            commit=False,
+                        )
+                else:
+                    try:
+                        event_type = line_data["type"]
+                        event_id = line_data["event_id"]
+                        sample_id = line_data["sample_id"]
+                        data = line_data["data"]
+                        created_at = line_data["created_at"]
+                        sample_ids_to_write.add(sample_id)
+                        if event_type == "metrics":
+                            run_stats.add_metrics(sample_id, data, created_at)
+                            # manually add created_at as a metric
+                            data["created_at"] = created_at
+                            for key, value in data.items():
+                                cls.insert_metric_data(
+                                    run_id=run_id,
+                                    sample_id=sample_id,
+                                    key=key,
+                                    value=json.dumps(value),
+                                    commit=False,
+                                )
+                        else:
+                            run_stats.add_event(sample_id, event_type, data, created_at)
+                            cls.insert_event(
                                 run_id=run_id,
                                 sample_id=sample_id,
-                                key=key,
-                                value=json.dumps(value),
+                                event_id=event_id,
+                                event_type=event_type,
+                                data=json.dumps(data),
+                                created_at=created_at,
                                 commit=False,
                             )
-                    else:
-                        cls.insert_event(
-                            run_id=run_id,
-                            sample_id=sample_id,
-                            event_id=event_id,
-                            event_type=event_type,
-                            data=json.dumps(data),
-                            created_at=created_at,
-                            commit=False,
-                        )
-                except KeyError as e:
-                    print(f"Error processing line: {e}")
-                    raise e
-        for sample_id in sample_ids_to_write:
-            cls.insert_sample(
-                run_id=run_id,
-                sample_id=sample_id,
+                            steps = trajectories.add_event(sample_id, event_id, event_type, data)
+                            # appended events of existing samples are rebuilt below instead
+                            if steps and sample_id not in existing_sample_ids:
+                                cls.insert_trajectory_steps(run_id, sample_id, steps, commit=False)
+                            signature = signatures.add_event(sample_id, event_type, data)
+                            if signature is not None:
+                                cls.insert_sample_signature(
+                                    run_id, sample_id, *signature, commit=False
+                                )
+                    except KeyError as e:
+                        print(f"Error processing line: {e}")
+                        raise e
+            assert run_id is not None
+            assert spec is not None
+            # stale trajectories are deleted, to be rebuilt from the stored events when viewed
+            cls.delete_trajectories(
+                run_id,
+                trajectories.out_of_order | (sample_ids_to_write & existing_sample_ids),
                 commit=False,
             )
-        assert run_id is not None
-        assert spec is not None
-        num_samples = len(sample_ids_to_write)
-        if name is None:
-            name = f"Run {run_id}"
-        # only commit once at the end, once the whole file has been processed
-        cls.insert_run(
-            run_id=run_id,
-            uploaded_at=uploaded_at,
-            name=name,
-            num_samples=num_samples,
-            commit=True,
-        )
+            # samples the run already has keep their row; the rest are new
+            sample_ids_to_write -= existing_sample_ids
+            for sample_id in sample_ids_to_write:
+                cls.insert_sample(
+                    run_id=run_id,
+                    sample_id=sample_id,
+                    commit=False,
+                )
+            if appending:
+                # the stored stats no longer cover the whole run; they are recomputed on demand
+                cursor.execute("DELETE FROM run_stats WHERE run_id = ?", (run_id,))
+                cursor.execute(
+                    "UPDATE runs SET num_samples = "
+                    "(SELECT COUNT(*) FROM samples WHERE run_id = ?) WHERE run_id = ?",
+                    (run_id, run_id),
+                )
+            else:
+                num_samples = len(sample_ids_to_write)
+                if name is None:
+                    name = f"Run {run_id}"
+                cls.insert_run_stats(run_id, run_stats.finalize(), commit=False)
+                cls.insert_run(
+                    run_id=run_id,
+                    uploaded_at=uploaded_at,
+                    name=name,
+                    num_samples=num_samples,
+                    commit=False,
+                )
+            cursor.execute(
+                "INSERT OR REPLACE INTO ingested_files (content_hash, run_id, uploaded_at) "
+                "VALUES (?, ?, ?)",
+                (content_hash, run_id, uploaded_at),
+            )
+            # only commit once at the end, once the whole file has been processed
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        from logviz.analytics import Analytics
+
+        Analytics.add_run(run_id)
+        return run_id
+
+    @staticmethod
+    def _hash_file(f: IO[bytes]) -> str:
+        """SHA-256 of the rest of a seekable file, leaving its position where it was."""
+        start = f.tell()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+        f.seek(start)
+        return digest.hexdigest()
+
+    @classmethod
+    def register_file(cls, path: Path, uploaded_at: str) -> str:
+        """Registers a log without ingesting it; reads are served from the file itself.
+
+        Only the spec, the sample ids and the run itself are written to the database."""
+        path = path.resolve()
+        index = open_index(path)
+        run_id = index.run_id
+        if cls.get_num_samples(run_id) is not None:
+            raise DuplicateRunError(run_id)
+        try:
+            for key, value in index.spec().items():
+                cls.insert_spec_data(run_id=run_id, key=key, value=json.dumps(value), commit=False)
+            for sample_id in index.sample_ids():
+                cls.insert_sample(run_id=run_id, sample_id=sample_id, commit=False)
+                # only each sample's first sampling event is read from the log
+                signature = _external_sample_signature(index, sample_id)
+                if signature is not None:
+                    cls.insert_sample_signature(run_id, sample_id, *signature, commit=False)
+            conn = cls.get_connection()
+            conn.execute(
+                "INSERT INTO external_logs (run_id, path) VALUES (?, ?)", (run_id, str(path))
+            )
+            cls.insert_run(
+                run_id=run_id,
+                uploaded_at=uploaded_at,
+                name=f"Run {run_id}",
+                num_samples=len(index.sample_ids()),
+                commit=True,
+            )
+        except Exception:
+            cls.get_connection().rollback()
+            raise
+        from logviz.analytics import Analytics
+
+        Analytics.add_run(run_id)
+        return run_id
+
+    @classmethod
+    def get_external_log(cls, run_id: str) -> Optional[JsonlIndex]:
+        """The index of a registered (not ingested) run, or None for ingested runs."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT path FROM external_logs WHERE run_id = ?", (run_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return open_index(Path(row["path"]))
 
     @classmethod
     def insert_run(cls, run_id, uploaded_at, name, num_samples, commit: bool = True):
@@ -182,6 +616,9 @@ class Database:
             "INSERT INTO runs (run_id, uploaded_at, name, num_samples) VALUES (?, ?, ?, ?)",  # noqa: E501
             (run_id, uploaded_at, name, num_samples),
         )
+        # the run list filters and sorts by the run's spec columns, inserted before it
+        cursor.execute(_COPY_SPEC_COLUMNS + " WHERE run_id = ?", (run_id,))
+        cursor.execute(_ADD_FACETS, (run_id,) * len(RUN_FACET_COLUMNS))
         if commit:
             conn.commit()
 
@@ -207,6 +644,17 @@ class Database:
         if commit:
             conn.commit()
 
+    @classmethod
+    def insert_run_stats(cls, run_id, stats: dict[str, Any], commit: bool = True):
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO run_stats (run_id, key, value) VALUES (?, ?, ?)",
+            [(run_id, key, json.dumps(value)) for key, value in stats.items()],
+        )
+        if commit:
+            conn.commit()
+
     @classmethod
     def insert_metric_data(cls, run_id, sample_id, key, value, commit: bool = True):
         conn = cls.get_connection()
@@ -242,6 +690,63 @@ class Database:
         if commit:
             conn.commit()
 
+    @classmethod
+    def insert_trajectory_steps(cls, run_id, sample_id, steps: list[dict], commit: bool = True):
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        # reader threads viewing the same sample may both rebuild its trajectory (see
+        # `get_timeline`); the steps are built from the same events, so either copy will do
+        cursor.executemany(
+            "INSERT OR IGNORE INTO trajectory_steps (run_id, sample_id, step, event_id, kind, role, content, name, function_call, rewind_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",  # noqa: E501
+            [
+                (
+                    run_id,
+                    sample_id,
+                    step["step"],
+                    step["event_id"],
+                    step["kind"],
+                    step["role"],
+                    step["content"],
+                    step["name"],
+                    None if step["function_call"] is None else json.dumps(step["function_call"]),
+                    step["rewind_to"],
+                )
+                for step in steps
+            ],
+        )
+        if commit:
+            conn.commit()
+
+    @classmethod
+    def delete_trajectories(cls, run_id: str, sample_ids: Iterable[str], commit: bool = True):
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "DELETE FROM trajectory_steps WHERE run_id = ? AND sample_id = ?",
+            [(run_id, sample_id) for sample_id in sample_ids],
+        )
+        if commit:
+            conn.commit()
+
+    @classmethod
+    def insert_sample_signature(
+        cls, run_id, sample_id, signature: bytes, buckets: list[int], commit: bool = True
+    ):
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO sample_signatures (run_id, sample_id, signature) "
+            "VALUES (?, ?, ?)",
+            (run_id, sample_id, signature),
+        )
+        # two bands of a signature can (very rarely) share a bucket
+        cursor.executemany(
+            "INSERT OR IGNORE INTO sample_bands (bucket, run_id, sample_id) VALUES (?, ?, ?)",
+            [(bucket, run_id, sample_id) for bucket in buckets],
+        )
+        if commit:
+            conn.commit()
+
     @classmethod
     def get_run_name(cls, run_id: str) -> str:
         conn = cls.get_connection()
@@ -259,6 +764,28 @@ class Database:
         cursor.execute("SELECT run_id FROM runs")
         return cursor.fetchall()
 
+    @classmethod
+    def insert_analytics_pending(cls, run_id: str, commit: bool = True) -> None:
+        conn = cls.get_connection()
+        conn.execute("INSERT INTO analytics_pending (run_id) VALUES (?)", (run_id,))
+        if commit:
+            conn.commit()
+
+    @classmethod
+    def get_analytics_pending(cls) -> list[sqlite3.Row]:
+        """(rowid, run_id) of the runs the analytics mirror has yet to rewrite, oldest first."""
+        cursor = cls.get_connection().cursor()
+        cursor.execute("SELECT rowid, run_id FROM analytics_pending ORDER BY rowid")
+        rows: list[sqlite3.Row] = cursor.fetchall()
+        return rows
+
+    @classmethod
+    def delete_analytics_pending(cls, last_rowid: int) -> None:
+        """Forget the pending runs up to `last_rowid`, keeping any added since they were read."""
+        conn = cls.get_connection()
+        conn.execute("DELETE FROM analytics_pending WHERE rowid <= ?", (last_rowid,))
+        conn.commit()
+
     @classmethod
     def get_sample_ids(cls, run_id) -> list[str]:
         conn = cls.get_connection()
@@ -267,8 +794,362 @@ class Database:
         rows = cursor.fetchall()
         return [row["sample_id"] for row in rows]
 
+    @classmethod
+    def get_num_samples(cls, run_id: str) -> Optional[int]:
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT num_samples FROM runs WHERE run_id = ?", (run_id,))
+        row = cursor.fetchone()
+        return None if row is None else int(row["num_samples"])
+
+    @classmethod
+    def get_run_size(cls, run_id: str) -> Optional[tuple[int, Optional[int]]]:
+        """(num_samples, num_events) of a run, or None if it doesn't exist.
+
+        num_events comes from the stored run stats, so it is None until they are computed."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """ SELECT runs.num_samples, run_stats.value AS num_events
+                FROM runs LEFT JOIN run_stats
+                ON run_stats.run_id = runs.run_id AND run_stats.key = 'num_events'
+                WHERE runs.run_id = ? """,
+            (run_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        num_events = None if row["num_events"] is None else int(json.loads(row["num_events"]))
+        return int(row["num_samples"]), num_events
+
+    @classmethod
+    def get_num_runs(cls) -> int:
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM runs")
+        num_runs: int = cursor.fetchone()[0]
+        return num_runs
+
+    @classmethod
+    def get_sample_id_for_page(cls, run_id: str, backend_page_id: int) -> Optional[str]:
+        """The sample shown on a (0-indexed) page, i.e. the page_id-th sample_id in sort order."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT sample_id FROM samples WHERE run_id = ? ORDER BY sample_id LIMIT 1 OFFSET ?",
+            (run_id, backend_page_id),
+        )
+        row = cursor.fetchone()
+        return None if row is None else str(row["sample_id"])
+
+    @classmethod
+    def get_sample_ids_for_pages(
+        cls, run_id: str, first_backend_page_id: int, num_pages: Optional[int] = None
+    ) -> list[str]:
+        """The samples shown on `num_pages` consecutive (0-indexed) pages (by default, every page
+        from the first on), in sort order."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT sample_id FROM samples WHERE run_id = ? ORDER BY sample_id LIMIT ? OFFSET ?",
+            # a negative LIMIT is no limit
+            (run_id, -1 if num_pages is None else num_pages, first_backend_page_id),
+        )
+        return [str(row["sample_id"]) for row in cursor.fetchall()]
+
+    @classmethod
+    def get_sampling_event_json(cls, run_id: str, sample_id: str) -> list[tuple[int, str]]:
+        """(event_id, data) for a sample's sampling events, with data as JSON text.
+
+        Chat prompts are returned exactly as stored; base-model (string) prompts are reshaped
+        by SQLite into a single {"role": "prompt"} message, matching `SamplingEventData`."""
+        if external_log := cls.get_external_log(run_id):
+            return [
+                (line["event_id"], json.dumps(_reshape_base_prompt(line["data"])))
+                for line in external_log.event_lines(sample_id, "sampling")
+            ]
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """ SELECT event_id, CASE WHEN json_valid(data) THEN (
+                    CASE json_type(data, '$.prompt') WHEN 'text' THEN json_object(
+                        'prompt', json_array(json_object(
+                            'role', 'prompt', 'content', json_extract(data, '$.prompt')
+                        )),
+                        'sampled', json_extract(data, '$.sampled')
+                    ) ELSE data END
+                ) ELSE data END AS data
+                FROM events
+                WHERE run_id = ? AND sample_id = ? AND event_type = 'sampling'
+                ORDER BY event_id """,
+            (run_id, sample_id),
+        )
+        return [(row["event_id"], row["data"]) for row in cursor.fetchall()]
+
+    @classmethod
+    def get_sampling_event_preview_json(
+        cls, run_id: str, sample_id: str, max_chars: int
+    ) -> list[tuple[int, str]]:
+        """Like `get_sampling_event_json`, but with message contents and sampled strings cut
+        to `max_chars` characters, and their full lengths in `content_length` (per message)
+        and `sampled_lengths`. The truncation happens in SQLite, so the full contents never
+        reach Python."""
+        if external_log := cls.get_external_log(run_id):
+            return [
+                (
+                    line["event_id"],
+                    json.dumps(_preview(_reshape_base_prompt(line["data"]), max_chars)),
+                )
+                for line in external_log.event_lines(sample_id, "sampling")
+            ]
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """ SELECT event_id, CASE WHEN json_valid(data) THEN json_object(
+                    'prompt', CASE json_type(data, '$.prompt') WHEN 'text' THEN json_array(
+                        json_object(
+                            'role', 'prompt',
+                            'content', substr(json_extract(data, '$.prompt'), 1, :max_chars),
+                            'name', NULL,
+                            'content_length', length(json_extract(data, '$.prompt'))
+                        )
+                    ) ELSE (
+                        SELECT json_group_array(json_object(
+                            'role', json_extract(message.value, '$.role'),
+                            'content',
+                            substr(json_extract(message.value, '$.content'), 1, :max_chars),
+                            'name', json_extract(message.value, '$.name'),
+                            'content_length', length(json_extract(message.value, '$.content'))
+                        )) FROM json_each(data, '$.prompt') AS message
+                    ) END,
+                    'sampled', (
+                        SELECT json_group_array(substr(sampled.value, 1, :max_chars))
+                        FROM json_each(data, '$.sampled') AS sampled
+                    ),
+                    'sampled_lengths', (
+                        SELECT json_group_array(length(sampled.value))
+                        FROM json_each(data, '$.sampled') AS sampled
+                    )
+                ) ELSE data END AS data
+                FROM events
+                WHERE run_id = :run_id AND sample_id = :sample_id AND event_type = 'sampling'
+                ORDER BY event_id """,
+            {"run_id": run_id, "sample_id": sample_id, "max_chars": max_chars},
+        )
+        return [(row["event_id"], row["data"]) for row in cursor.fetchall()]
+
+    @classmethod
+    def get_message_content(
+        cls,
+        run_id: str,
+        event_id: int,
+        index: int,
+        offset: int = 0,
+        length: Optional[int] = None,
+        sampled: bool = False,
+    ) -> Optional[str]:
+        """A slice of one message's content (or of one sampled string, if `sampled`), in
+        characters, or None if there is no such message."""
+        if index < 0 or offset < 0 or (length is not None and length < 0):
+            return None
+        if external_log := cls.get_external_log(run_id):
+            line = external_log.event_line(event_id)
+            if line is None:
+                return None
+            data = _reshape_base_prompt(line["data"])
+            try:
+                content = data["sampled"][index] if sampled else data["prompt"][index]["content"]
+            except (IndexError, KeyError, TypeError):
+                return None
+            if not isinstance(content, str):
+                content = json.dumps(content)
+            return content[offset : None if length is None else offset + length]
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        if sampled:
+            content_sql = "json_extract(data, '$.sampled[' || :index || ']')"
+        else:
+            content_sql = """ CASE json_type(data, '$.prompt') WHEN 'text'
+                              THEN CASE :index WHEN 0 THEN json_extract(data, '$.prompt') END
+                              ELSE json_extract(data, '$.prompt[' || :index || '].content') END """
+        cursor.execute(
+            f""" SELECT substr(content, :offset + 1, coalesce(:length, length(content))) AS content
+                 FROM (
+                    SELECT CASE WHEN json_valid(data) THEN {content_sql} END AS content
+                    FROM events WHERE run_id = :run_id AND event_id = :event_id
+                 ) """,
+            {
+                "run_id": run_id,
+                "event_id": event_id,
+                "index": index,
+                "offset": offset,
+                "length": length,
+            },
+        )
+        row = cursor.fetchone()
+        return None if row is None else row["content"]
+
+    @classmethod
+    def get_sample_metrics_json(cls, run_id: str, sample_id: str) -> Optional[str]:
+        """A sample's metrics as a JSON object string, spliced from the stored values."""
+        if external_log := cls.get_external_log(run_id):
+            metrics = external_log.metric_values(sample_id)
+            return None if metrics is None else json.dumps(metrics)
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT key, value FROM metric_data WHERE run_id = ? AND sample_id = ?",
+            (run_id, sample_id),
+        )
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            return None
+        return "{" + ", ".join(f'{json.dumps(row["key"])}: {row["value"]}' for row in rows) + "}"
+
+    @classmethod
+    def get_final_report_json(cls, run_id: str) -> str:
+        """A run's final report as a JSON object string, spliced from the stored values."""
+        if external_log := cls.get_external_log(run_id):
+            return json.dumps(external_log.final_report() or {})
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, value FROM final_report_data WHERE run_id = ?", (run_id,))
+        rows = cursor.fetchall()
+        return "{" + ", ".join(f'{json.dumps(row["key"])}: {row["value"]}' for row in rows) + "}"
+
+    @classmethod
+    def get_metadata_json_rows(
+        cls, run_id: Optional[str] = None, run_ids: Optional[Sequence[str]] = None
+    ) -> list[tuple[dict, dict]]:
+        """(runs row, {spec key: JSON text}) pairs for one run, the given runs or all runs, in a
+        single query."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        query = """ SELECT runs.*, spec_data.key AS spec_key, spec_data.value AS spec_value
+                    FROM runs LEFT JOIN spec_data ON spec_data.run_id = runs.run_id
+                    AND spec_data.key IN ('completion_fns', 'eval_name', 'base_eval', 'split',
+                                          'created_at') """
+        if run_id is not None:
+            cursor.execute(query + " WHERE runs.run_id = ?", (run_id,))
+        elif run_ids is not None:
+            placeholders = ", ".join("?" for _ in run_ids)
+            cursor.execute(query + f" WHERE runs.run_id IN ({placeholders})", tuple(run_ids))
+        else:
+            cursor.execute(query)
+        metadata: dict[str, tuple[dict, dict]] = {}
+        for row in cursor.fetchall():
+            if row["run_id"] not in metadata:
+                run = {key: row[key] for key in ("run_id", "name", "uploaded_at", "num_samples")}
+                metadata[row["run_id"]] = (run, {})
+            if row["spec_key"] is not None:
+                metadata[row["run_id"]][1][row["spec_key"]] = row["spec_value"]
+        return list(metadata.values())
+
+    @classmethod
+    def get_run_page(
+        cls,
+        filters: dict[str, Any],
+        sort: str,
+        descending: bool,
+        first: int,
+        after: Optional[tuple[Any, str]] = None,
+    ) -> tuple[list[tuple[dict, dict]], Optional[tuple[Any, str]], bool]:
+        """Up to `first` runs matching `filters` (see `_run_list_where`), as in
+        `get_metadata_json_rows`, ordered by the `sort` column and then run_id and starting
+        after the run whose (sort value, run_id) is `after`; with the last one's (sort value,
+        run_id) and whether there are more.
+
+        The runs are read from the sort column's index from `after` onwards, so a page costs
+        the same however deep into the list it is."""
+        if sort not in RUN_SORT_COLUMNS:
+            raise ValueError(
+                f"Can't sort runs by `{sort}`; use one of {', '.join(RUN_SORT_COLUMNS)}"
+            )
+        clauses, parameters = _run_list_where(filters)
+        direction = "DESC" if descending else "ASC"
+        if after is not None:
+            clauses.append(f"({sort}, run_id) {'<' if descending else '>'} (?, ?)")
+            parameters += after
+        cursor = cls.get_connection().cursor()
+        cursor.execute(
+            f"SELECT run_id, {sort} FROM runs{_where(clauses)} "
+            f"ORDER BY {sort} {direction}, run_id {direction} LIMIT ?",
+            (*parameters, first + 1),
+        )
+        keys = [(row[sort], row["run_id"]) for row in cursor.fetchall()]
+        has_next_page = len(keys) > first
+        keys = keys[:first]
+        if not keys:
+            return [], None, has_next_page
+        metadata = {
+            run["run_id"]: (run, spec)
+            for run, spec in cls.get_metadata_json_rows(run_ids=[run_id for _, run_id in keys])
+        }
+        # (runs deleted in between are left out)
+        runs = [metadata[run_id] for _, run_id in keys if run_id in metadata]
+        return runs, keys[-1], has_next_page
+
+    @classmethod
+    def get_run_facets(cls, filters: dict[str, Any]) -> dict[str, Any]:
+        """The number of runs matching `filters`, and for each facet column the number of runs
+        with each of its values, or for each range column the range of its values.
+
+        Each facet leaves out the filter on its own column, so that it also counts the values
+        that the filter excludes. Everything is counted in one statement: without filters, from
+        the counts kept in run_facet_counts and the ends of the range columns' indexes, so in
+        the same time however many runs there are; with them, from the matching runs."""
+        if all(values is None for values in filters.values()):
+            sql = _ALL_RUN_FACETS
+            parameters: list = []
+        else:
+            parts = []
+            parameters = []
+            for column in RUN_FACET_COLUMNS:
+                clauses, column_parameters = _run_list_where(filters, skip=column)
+                parts.append(
+                    f"SELECT '{column}' AS facet, json_quote({column}) AS value, "
+                    f"NULL AS max_value, COUNT(*) AS count FROM runs{_where(clauses)} "
+                    f"GROUP BY {column}"
+                )
+                parameters += column_parameters
+            for column in RUN_RANGE_COLUMNS:
+                clauses, column_parameters = _run_list_where(filters, skip=column)
+                clauses.append(f"{column} > ''")
+                parts.append(
+                    f"SELECT '{column}', MIN({column}), MAX({column}), NULL "
+                    f"FROM runs{_where(clauses)}"
+                )
+                parameters += column_parameters
+            sql = " UNION ALL ".join(parts)
+        cursor = cls.get_connection().cursor()
+        cursor.execute(sql, parameters)
+        facets: dict[str, Any] = {column: [] for column in RUN_FACET_COLUMNS}
+        for row in cursor.fetchall():
+            facet = row["facet"]
+            if facet in RUN_RANGE_COLUMNS:
+                facets[facet] = {"min": row["value"], "max": row["max_value"]}
+            else:
+                facets[facet].append({"value": json.loads(row["value"]), "count": row["count"]})
+        for column in RUN_FACET_COLUMNS:
+            facets[column].sort(
+                key=lambda value: (-value["count"], value["value"] is None, str(value["value"]))
+            )
+        # every matching run has one value of each facet, and the first isn't filtered by
+        # any other
+        first_facet = facets[RUN_FACET_COLUMNS[0]]
+        if filters.get(RUN_FACET_COLUMNS[0]) is None:
+            facets["total_count"] = sum(value["count"] for value in first_facet)
+        else:
+            selected = set(filters[RUN_FACET_COLUMNS[0]])
+            facets["total_count"] = sum(
+                value["count"] for value in first_facet if value["value"] in selected
+            )
+        return facets
+
     @classmethod
     def get_raw_sampling_events(cls, run_id, sample_id) -> list[dict]:
+        if external_log := cls.get_external_log(run_id):
+            return list(external_log.event_rows(sample_id, "sampling"))
         conn = cls.get_connection()
         cursor = conn.cursor()
         cursor.execute(
@@ -278,6 +1159,162 @@ class Database:
         rows = cursor.fetchall()
         return [dict(row) for row in rows]
 
+    @classmethod
+    def get_timeline(
+        cls,
+        run_id: str,
+        sample_id: str,
+        after: int,
+        first: int,
+        preview_chars: Optional[int] = None,
+    ) -> Optional[tuple[list[dict], int]]:
+        """Up to `first` steps of a sample's trajectory after step `after`, and its total number
+        of steps, or None if there is no such sample.
+
+        With `preview_chars`, steps have their contents cut to that many characters in SQLite,
+        as `content_preview`, and their full lengths in `content_length`, instead of `content`."""
+        if external_log := cls.get_external_log(run_id):
+            if sample_id not in external_log.index["samples"]:
+                return None
+            steps = build_trajectory(
+                (line["event_id"], line["type"], line["data"])
+                for line in external_log.event_lines(sample_id)
+            )
+            page = steps[after + 1 : after + 1 + first]
+            if preview_chars is not None:
+                page = [_step_preview(step, preview_chars) for step in page]
+            return page, len(steps)
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM trajectory_steps WHERE run_id = ? AND sample_id = ?",
+            (run_id, sample_id),
+        )
+        num_steps: int = cursor.fetchone()[0]
+        if num_steps == 0:
+            # ingested before trajectories were stored, or rebuilt after an append
+            cursor.execute(
+                """ SELECT event_id, event_type, data FROM events
+                    WHERE run_id = ? AND sample_id = ?
+                    AND event_type IN ('sampling', 'function_call') """,
+                (run_id, sample_id),
+            )
+            steps = build_trajectory(
+                (row["event_id"], row["event_type"], json.loads(row["data"]))
+                for row in cursor.fetchall()
+            )
+            if not steps:
+                if sample_id not in cls.get_sample_ids(run_id):
+                    return None
+                return [], 0
+            cls.insert_trajectory_steps(run_id, sample_id, steps)
+            num_steps = len(steps)
+        if preview_chars is None:
+            cursor.execute(
+                """ SELECT step, event_id, kind, role, content, name, function_call, rewind_to
+                    FROM trajectory_steps
+                    WHERE run_id = ? AND sample_id = ? AND step > ?
+                    ORDER BY step LIMIT ? """,
+                (run_id, sample_id, after, first),
+            )
+        else:
+            cursor.execute(
+                """ SELECT step, event_id, kind, role,
+                        substr(content, 1, ?) AS content_preview, length(content) AS content_length,
+                        name, function_call, rewind_to
+                    FROM trajectory_steps
+                    WHERE run_id = ? AND sample_id = ? AND step > ?
+                    ORDER BY step LIMIT ? """,
+                (preview_chars, run_id, sample_id, after, first),
+            )
+        steps = []
+        for row in cursor.fetchall():
+            step = dict(row)
+            if step["function_call"] is not None:
+                step["function_call"] = json.loads(step["function_call"])
+            steps.append(step)
+        return steps, num_steps
+
+    @classmethod
+    def get_similar_samples(
+        cls, run_id: str, sample_id: str, threshold: float, first: int
+    ) -> Optional[list[dict]]:
+        """Up to `first` samples, of any run, whose prompts have an estimated Jaccard similarity
+        of at least `threshold` to this sample's, most similar first; None if the sample has no
+        prompt (or doesn't exist)."""
+        import numpy as np
+
+        from logviz.similarity import MAX_SIMILARITY_CANDIDATES, band_buckets, similarities
+
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT signature FROM sample_signatures WHERE run_id = ? AND sample_id = ?",
+            (run_id, sample_id),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            signature: bytes = row["signature"]
+        else:
+            # ingested before signatures were stored
+            signed = cls._sign_sample(run_id, sample_id)
+            if signed is None:
+                return None
+            signature = signed[0]
+        buckets = band_buckets(np.frombuffer(signature, dtype="<u4"))
+        # candidates sharing the most bands are the likeliest to be similar
+        cursor.execute(
+            f""" SELECT signature.run_id, signature.sample_id, signature.signature
+                 FROM (
+                     SELECT run_id, sample_id, COUNT(*) AS shared_bands FROM sample_bands
+                     WHERE bucket IN ({", ".join("?" for _ in buckets)})
+                     GROUP BY run_id, sample_id ORDER BY shared_bands DESC LIMIT ?
+                 ) AS candidate
+                 JOIN sample_signatures AS signature
+                 ON signature.run_id = candidate.run_id
+                 AND signature.sample_id = candidate.sample_id """,
+            (*buckets, MAX_SIMILARITY_CANDIDATES),
+        )
+        candidates = [
+            row
+            for row in cursor.fetchall()
+            if (row["run_id"], row["sample_id"]) != (run_id, sample_id)
+        ]
+        scores = similarities(signature, [row["signature"] for row in candidates])
+        matches = sorted(
+            (
+                (-float(score), row["run_id"], row["sample_id"])
+                for row, score in zip(candidates, scores)
+                if score >= threshold
+            )
+        )
+        return [
+            {"run_id": other_run_id, "sample_id": other_sample_id, "similarity": -score}
+            for score, other_run_id, other_sample_id in matches[:first]
+        ]
+
+    @classmethod
+    def _sign_sample(cls, run_id: str, sample_id: str) -> Optional[tuple[bytes, list[int]]]:
+        """Compute and store the signature of a sample that doesn't have one yet."""
+        from logviz.similarity import sample_signature
+
+        if external_log := cls.get_external_log(run_id):
+            signed = _external_sample_signature(external_log, sample_id)
+        else:
+            cursor = cls.get_connection().cursor()
+            cursor.execute(
+                """ SELECT data FROM events
+                    WHERE run_id = ? AND sample_id = ? AND event_type = 'sampling'
+                    ORDER BY event_id LIMIT 1 """,
+                (run_id, sample_id),
+            )
+            row = cursor.fetchone()
+            data = None if row is None else json.loads(row["data"])
+            signed = sample_signature(data.get("prompt")) if isinstance(data, dict) else None
+        if signed is not None:
+            cls.insert_sample_signature(run_id, sample_id, *signed)
+        return signed
+
     @classmethod
     def get_raw_specs(cls) -> dict:
         conn = cls.get_connection()
@@ -303,6 +1340,8 @@ class Database:
 
     @classmethod
     def get_raw_final_report(cls, run_id: str) -> dict:
+        if external_log := cls.get_external_log(run_id):
+            return {"run_id": run_id, "data": external_log.final_report() or {}}
         conn = cls.get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM final_report_data WHERE run_id = ?", (run_id,))
@@ -314,6 +1353,8 @@ class Database:
 
     @classmethod
     def get_raw_sample_metrics(cls, run_id: str, sample_id: str) -> Optional[dict]:
+        if external_log := cls.get_external_log(run_id):
+            return external_log.metric_values(sample_id)
         conn = cls.get_connection()
         cursor = conn.cursor()
         cursor.execute(
@@ -327,17 +1368,152 @@ class Database:
         return {row["key"]: json.loads(row["value"]) for row in rows}
 
     @classmethod
-    def delete_run(cls, run_id: str) -> int:
+    def get_raw_run_stats(cls, run_id: str) -> Optional[dict]:
+        """The aggregates stored for a run at ingest, computing them first for older runs."""
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, value FROM run_stats WHERE run_id = ?", (run_id,))
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            if cls.get_num_samples(run_id) is None:
+                return None
+            stats = cls.compute_run_stats(run_id)
+            cls.insert_run_stats(run_id, stats)
+            return stats
+        return {row["key"]: json.loads(row["value"]) for row in rows}
+
+    @classmethod
+    def compute_run_stats(cls, run_id: str) -> dict:
+        """Rebuild a run's aggregates from its stored rows (for runs ingested before run_stats)."""
+        from logviz.run_stats import RunStatsAccumulator
+
+        run_stats = RunStatsAccumulator()
+        for row in cls.iter_raw_events(run_id):
+            data = json.loads(row["data"])
+            run_stats.add_event(row["sample_id"], row["event_type"], data, row["created_at"])
+        for sample_id, rows in itertools.groupby(
+            cls.iter_raw_metric_rows(run_id), key=lambda row: row["sample_id"]
+        ):
+            metrics = {row["key"]: json.loads(row["value"]) for row in rows}
+            created_at = metrics.pop("created_at", "")
+            run_stats.add_metrics(sample_id, metrics, created_at)
+        return run_stats.finalize()
+
+    @classmethod
+    def iter_raw_events(cls, run_id: str) -> Iterator[Any]:
+        """Cursor over all of a run's events, ordered by sample and then event id.
+
+        Rows are read lazily, so callers can stream a run of any size."""
+        if external_log := cls.get_external_log(run_id):
+            return (
+                row
+                for sample_id in sorted(external_log.sample_ids())
+                for row in external_log.event_rows(sample_id)
+            )
+        conn = cls.get_connection()
+        cursor: sqlite3.Cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM events WHERE run_id = ? ORDER BY sample_id, event_id",
+            (run_id,),
+        )
+        return cursor
+
+    @classmethod
+    def iter_raw_metric_rows(cls, run_id: str) -> Iterator[Any]:
+        """Cursor over a run's (sample_id, key, value) metric rows, ordered by sample."""
+        if external_log := cls.get_external_log(run_id):
+            return (
+                {"sample_id": sample_id, "key": key, "value": json.dumps(value)}
+                for sample_id in sorted(external_log.sample_ids())
+                for key, value in sorted((external_log.metric_values(sample_id) or {}).items())
+            )
+        conn = cls.get_connection()
+        cursor: sqlite3.Cursor = conn.cursor()
+        cursor.execute(
+            "SELECT sample_id, key, value FROM metric_data WHERE run_id = ? "
+            "ORDER BY sample_id, key",
+            (run_id,),
+        )
+        return cursor
+
+    @classmethod
+    def get_sample_event_summaries(cls, run_id: str) -> list[dict]:
+        """Per-sample event counts and times; registered runs' times aren't indexed (None)."""
+        if external_log := cls.get_external_log(run_id):
+            summaries = []
+            for sample_id, sample in sorted(external_log.index["samples"].items()):
+                event_types = [event[1] for event in sample["events"]]
+                summaries.append(
+                    {
+                        "run_id": run_id,
+                        "sample_id": sample_id,
+                        "num_events": len(event_types),
+                        "num_sampling": event_types.count("sampling"),
+                        "num_function_calls": event_types.count("function_call"),
+                        "first_created_at": None,
+                        "last_created_at": None,
+                    }
+                )
+            return summaries
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """ SELECT run_id, sample_id, COUNT(*) AS num_events,
+                       SUM(event_type = 'sampling') AS num_sampling,
+                       SUM(event_type = 'function_call') AS num_function_calls,
+                       MIN(created_at) AS first_created_at, MAX(created_at) AS last_created_at
+                FROM events WHERE run_id = ? GROUP BY sample_id ORDER BY sample_id """,
+            (run_id,),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    @classmethod
+    def get_metric_key_types(cls, run_id: str) -> dict[str, bool]:
+        """Map each metric key of a run to whether all of its values are numeric (or null)."""
+        if external_log := cls.get_external_log(run_id):
+            key_types: dict[str, bool] = {}
+            for sample_id in external_log.sample_ids():
+                for key, value in (external_log.metric_values(sample_id) or {}).items():
+                    numeric = value is None or isinstance(value, (bool, int, float))
+                    key_types[key] = key_types.get(key, True) and numeric
+            return dict(sorted(key_types.items()))
         conn = cls.get_connection()
         cursor = conn.cursor()
+        # NaN/Infinity are written by json.dumps but aren't valid JSON for SQLite
+        cursor.execute(
+            """ SELECT key, MIN(
+                    CASE WHEN json_valid(value)
+                    THEN json_type(value) IN ('integer', 'real', 'true', 'false', 'null')
+                    ELSE value IN ('NaN', 'Infinity', '-Infinity') END
+                ) AS is_numeric
+                FROM metric_data WHERE run_id = ? GROUP BY key ORDER BY key """,
+            (run_id,),
+        )
+        return {row["key"]: bool(row["is_numeric"]) for row in cursor.fetchall()}
 
-        # List of tables to delete from, ordered to respect foreign key constraints
-        tables = ["events", "spec_data", "final_report_data", "metric_data", "samples", "runs"]
+    @classmethod
+    def delete_run(cls, run_id: str, commit: bool = True) -> int:
+        conn = cls.get_connection()
+        cursor = conn.cursor()
+
+        # registered runs leave the log itself in place, but drop its index
+        cursor.execute("SELECT path FROM external_logs WHERE run_id = ?", (run_id,))
+        external_log = cursor.fetchone()
+        if external_log is not None:
+            forget_index(Path(external_log["path"]))
 
-        for table in tables:
+        cursor.execute(_SUBTRACT_FACETS, (run_id,) * len(RUN_FACET_COLUMNS))
+        cursor.execute("DELETE FROM run_facet_counts WHERE count = 0")
+        for table in RUN_TABLES:
             cursor.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
 
-        conn.commit()
+        if commit:
+            conn.commit()
+            # without a commit, the caller rewrites the run (see `process_file`), and that
+            # rewrites its mirror too
+            from logviz.analytics import Analytics
+
+            Analytics.remove_run(run_id)
         rows_deleted: int = cursor.rowcount
         return rows_deleted
 
@@ -381,3 +1557,108 @@ class Database:
             for row in rows:
                 data[run_id][row["key"]] = json.loads(row["value"])
         return data
+
+
+def _run_list_where(filters: dict[str, Any], skip: Optional[str] = None) -> tuple[list[str], list]:
+    """WHERE clauses keeping the runs whose facet columns take one of the given values and
+    whose range columns fall in the given (since, before) range, with their parameters.
+
+    `filters` maps "run_id" and the facet columns to lists of values, and the range columns to
+    (since, before) pairs of normalised timestamps (see `normalise_timestamp`), either of which
+    may be None; columns mapped to None, and `skip`, aren't filtered on."""
+    clauses = []
+    parameters: list = []
+    for column, values in filters.items():
+        if column == skip or values is None:
+            continue
+        if column in RUN_RANGE_COLUMNS:
+            since, before = values
+            if since is not None:
+                clauses.append(f"{column} >= ?")
+                parameters.append(since)
+            if before is not None:
+                clauses.append(f"{column} < ?")
+                parameters.append(before)
+        elif column == "run_id" or column in RUN_FACET_COLUMNS:
+            clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            parameters += values
+        else:
+            raise ValueError(f"Can't filter runs by `{column}`")
+    return clauses, parameters
+
+
+def _where(clauses: list[str]) -> str:
+    return " WHERE " + " AND ".join(clauses) if clauses else ""
+
+
+def normalise_timestamp(text: str) -> str:
+    """An ISO 8601 date or time in the form runs' timestamps are compared in (UTC if it has
+    an offset, to the millisecond, as SQLite's strftime gives them)."""
+    try:
+        timestamp = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp `{text}`; use an ISO 8601 date or time")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp.isoformat(timespec="milliseconds")
+
+
+def _external_sample_signature(
+    external_log: JsonlIndex, sample_id: str
+) -> Optional[tuple[bytes, list[int]]]:
+    from logviz.similarity import sample_signature
+
+    line = next(external_log.event_lines(sample_id, "sampling"), None)
+    if line is None or not isinstance(line["data"], dict):
+        return None
+    return sample_signature(line["data"].get("prompt"))
+
+
+def _reshape_base_prompt(data: dict) -> dict:
+    """Python equivalent of the base-prompt reshaping in `get_sampling_event_json`."""
+    if isinstance(data.get("prompt"), str):
+        return {
+            "prompt": [{"role": "prompt", "content": data["prompt"]}],
+            "sampled": data.get("sampled"),
+        }
+    return data
+
+
+def _preview(data: dict, max_chars: int) -> dict:
+    """Python equivalent of the truncation in `get_sampling_event_preview_json`."""
+    sampled = data.get("sampled")
+    if sampled is None:
+        sampled = []
+    elif not isinstance(sampled, list):
+        sampled = [sampled]
+    prompt = []
+    for message in data.get("prompt") or []:
+        content = _as_text(message.get("content"))
+        prompt.append(
+            {
+                "role": message.get("role"),
+                "content": None if content is None else content[:max_chars],
+                "name": message.get("name"),
+                "content_length": None if content is None else len(content),
+            }
+        )
+    sampled_text = [_as_text(s) or "" for s in sampled]
+    return {
+        "prompt": prompt,
+        "sampled": [s[:max_chars] for s in sampled_text],
+        "sampled_lengths": [len(s) for s in sampled_text],
+    }
+
+
+def _step_preview(step: dict, max_chars: int) -> dict:
+    """Python equivalent of the truncation in `get_timeline`."""
+    preview = {key: value for key, value in step.items() if key != "content"}
+    content = step.get("content")
+    preview["content_preview"] = None if content is None else content[:max_chars]
+    preview["content_length"] = None if content is None else len(content)
+    return preview
+
+
+def _as_text(value: Any) -> Optional[str]:
+    """Message contents as SQLite's json_extract returns them: strings as-is, else JSON."""
+    return value if value is None or isinstance(value, str) else json.dumps(value)
@@ -0,0 +1,193 @@
+"""Streaming export of ingested runs.
+
+Everything here is generator-based and reads rows lazily from SQLite, so memory use stays
+constant regardless of run size:
+- `iter_jsonl` reconstructs the original evals log (spec, events, metrics, final report);
+- `iter_columnar` writes a run's metrics (one row per sample, one column per metric) or its
+  spec as Parquet or Arrow IPC, in record batches of `BATCH_SIZE` rows.
+
+Parquet and Arrow output need the optional `pyarrow` dependency.
+"""
+import heapq
+import io
+import itertools
+import json
+from typing import Any, Iterable, Iterator
+
+from logviz.database import Database
+
+EXPORT_FORMATS = ("jsonl", "parquet", "arrow")
+COLUMNAR_TABLES = ("metrics", "spec")
+BATCH_SIZE = 1000
+
+MIMETYPES = {
+    "jsonl": "application/jsonl",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+class RunNotFoundError(KeyError):
+    pass
+
+
+def export_filename(run_id: str, export_format: str, table: str = "metrics") -> str:
+    if export_format == "jsonl":
+        return f"{run_id}.jsonl"
+    return f"{run_id}_{table}.{export_format}"
+
+
+def iter_export(run_id: str, export_format: str, table: str = "metrics") -> Iterator[bytes]:
+    """Dispatch to the right exporter; raises before yielding if the request is invalid."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format `{export_format}`")
+    spec = Database.get_raw_spec(run_id)
+    if not spec:
+        raise RunNotFoundError(run_id)
+    if export_format == "jsonl":
+        return (line.encode() for line in iter_jsonl(run_id, spec))
+    if table not in COLUMNAR_TABLES:
+        raise ValueError(f"Unknown export table `{table}`")
+    _import_pyarrow()
+    return iter_columnar(run_id, spec, export_format, table)
+
+
+def iter_jsonl(run_id: str, spec: dict) -> Iterator[str]:
+    """Yield the lines of the original log for a run.
+
+    Event data is spliced in as stored, without decoding. `created_by` and the event ids of
+    metrics events aren't stored, so they come back as "" and null."""
+    yield json.dumps({"spec": spec}) + "\n"
+
+    events = (
+        (row["sample_id"], 0, row["event_id"], row) for row in Database.iter_raw_events(run_id)
+    )
+    metrics = (
+        (sample_id, 1, 0, rows)
+        for sample_id, rows in itertools.groupby(
+            Database.iter_raw_metric_rows(run_id), key=lambda row: row["sample_id"]
+        )
+    )
+    # both streams are sorted by sample_id, so this emits each sample's metrics after its events
+    for sample_id, is_metrics, _, item in heapq.merge(events, metrics, key=lambda x: x[:3]):
+        if is_metrics:
+            yield _metrics_line(run_id, sample_id, item)
+        else:
+            yield (
+                f'{{"run_id": {json.dumps(run_id)}, "event_id": {item["event_id"]}, '
+                f'"sample_id": {json.dumps(sample_id)}, "type": {json.dumps(item["event_type"])}, '
+                f'"data": {item["data"]}, "created_by": "", '
+                f'"created_at": {json.dumps(item["created_at"])}}}\n'
+            )
+
+    final_report = Database.get_raw_final_report(run_id)["data"]
+    if final_report:
+        yield json.dumps({"final_report": final_report}) + "\n"
+
+
+def _metrics_line(run_id: str, sample_id: str, rows: Iterable[Any]) -> str:
+    values = {row["key"]: row["value"] for row in rows}
+    # created_at is added to the metrics at ingest, so move it back to the event
+    created_at = json.loads(values.pop("created_at", "null"))
+    data = ", ".join(f"{json.dumps(key)}: {value}" for key, value in values.items())
+    return (
+        f'{{"run_id": {json.dumps(run_id)}, "event_id": null, '
+        f'"sample_id": {json.dumps(sample_id)}, "type": "metrics", "data": {{{data}}}, '
+        f'"created_by": "", "created_at": {json.dumps(created_at)}}}\n'
+    )
+
+
+def iter_columnar(run_id: str, spec: dict, export_format: str, table: str) -> Iterator[bytes]:
+    pa = _import_pyarrow()
+    if table == "spec":
+        schema = pa.schema([(key, pa.string()) for key in spec])
+        record = {k: v if isinstance(v, str) else json.dumps(v) for k, v in spec.items()}
+        batches: Iterator[list[dict]] = iter([[record]])
+    else:
+        key_types = Database.get_metric_key_types(run_id)
+        key_types.pop("created_at", None)
+        fields = [("sample_id", pa.string()), ("created_at", pa.string())]
+        fields += [
+            (key, pa.float64() if numeric else pa.string()) for key, numeric in key_types.items()
+        ]
+        schema = pa.schema(fields)
+        batches = _metric_record_batches(run_id, key_types)
+
+    sink = _ChunkSink()
+    writer = _open_writer(pa, export_format, sink, schema)
+    for records in batches:
+        writer.write_batch(pa.RecordBatch.from_pylist(records, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _metric_record_batches(run_id: str, key_types: dict[str, bool]) -> Iterator[list[dict]]:
+    """Pivot the metric rows of a run into one record per sample, in batches."""
+    rows = Database.iter_raw_metric_rows(run_id)
+    records = (
+        _metric_record(sample_id, sample_rows, key_types)
+        for sample_id, sample_rows in itertools.groupby(rows, key=lambda row: row["sample_id"])
+    )
+    while batch := list(itertools.islice(records, BATCH_SIZE)):
+        yield batch
+
+
+def _metric_record(sample_id: str, rows: Iterable[Any], key_types: dict[str, bool]) -> dict:
+    record: dict[str, Any] = {"sample_id": sample_id}
+    for row in rows:
+        if row["key"] == "created_at":
+            record["created_at"] = json.loads(row["value"])
+        elif key_types.get(row["key"]):
+            value = json.loads(row["value"])
+            record[row["key"]] = None if value is None else float(value)
+        else:
+            # plain strings are unwrapped, anything structured is kept as JSON text
+            value = json.loads(row["value"])
+            record[row["key"]] = value if isinstance(value, str) else row["value"]
+    return record
+
+
+def _open_writer(pa: Any, export_format: str, sink: "_ChunkSink", schema: Any) -> Any:
+    if export_format == "arrow":
+        return pa.ipc.new_stream(sink, schema)
+    import pyarrow.parquet as pq
+
+    return pq.ParquetWriter(sink, schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are handed out (and dropped) chunk by chunk."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:  # type: ignore[override]
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _import_pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "Parquet and Arrow exports need pyarrow: `pip install pyarrow` "
+            "(or `pip install logviz[export]`)"
+        ) from e
+    return pyarrow
@@ -0,0 +1,124 @@
+"""Graphene-free read paths for the queries the frontend makes on every page view.
+
+These build the exact response bodies of the GraphQL documents in `defaultSampleSection.js`
+and `index.html` directly from SQLite rows, splicing the stored JSON text into the output
+instead of decoding it into graphene objects and re-serialising. The GraphQL endpoint is
+unchanged and remains the way to make ad-hoc queries.
+"""
+import json
+from typing import Optional
+
+from logviz.database import Database
+
+METADATA_SPEC_KEYS = ("completion_fns", "eval_name", "base_eval", "split", "created_at")
+# the `spec` fields queried by spec.js, all of which are among METADATA_SPEC_KEYS
+BOOTSTRAP_SPEC_KEYS = ("completion_fns", "base_eval", "split", "created_at")
+# largest `radius` served by sample_page_window, so a single request stays bounded
+MAX_PAGE_WINDOW_RADIUS = 10
+# message contents are cut to this many characters unless the client asks for a different
+# limit; matches PREVIEW_CHARS in defaultSampleSection.js
+DEFAULT_PREVIEW_CHARS = 2000
+
+
+def sample_page_json(run_id: str, page_id: int, max_chars: Optional[int] = None) -> Optional[str]:
+    """`sample_page(run_id, page_id)` as JSON, or None if there is no such page.
+
+    With `max_chars`, message contents are previews (see `_sample_page_object`)."""
+    # NOTE: subtracting 1 from page id before passing to backend
+    backend_page_id = page_id - 1
+    if backend_page_id < 0:
+        return None
+    sample_id = Database.get_sample_id_for_page(run_id, backend_page_id)
+    if sample_id is None:
+        return None
+    return _sample_page_object(run_id, sample_id, backend_page_id, max_chars)
+
+
+def sample_page_window_json(
+    run_id: str, page_id: int, radius: int, max_chars: Optional[int] = None
+) -> str:
+    """`sample_page_window(run_id, page_id, radius)` as JSON: the existing pages within
+    `radius` of `page_id`, in order."""
+    radius = min(max(radius, 0), MAX_PAGE_WINDOW_RADIUS)
+    # NOTE: subtracting 1 from page id before passing to backend
+    first_backend_page_id = max(page_id - 1 - radius, 0)
+    last_backend_page_id = page_id - 1 + radius
+    if last_backend_page_id < first_backend_page_id:
+        return "[]"
+    sample_ids = Database.get_sample_ids_for_pages(
+        run_id, first_backend_page_id, last_backend_page_id - first_backend_page_id + 1
+    )
+    pages = (
+        _sample_page_object(run_id, sample_id, backend_page_id, max_chars)
+        for backend_page_id, sample_id in enumerate(sample_ids, start=first_backend_page_id)
+    )
+    return "[" + ", ".join(pages) + "]"
+
+
+def _sample_page_object(
+    run_id: str, sample_id: str, backend_page_id: int, max_chars: Optional[int] = None
+) -> str:
+    """With `max_chars`, messages' `content` and events' `sampled` hold the `content_preview`
+    and `sampled_preview` values instead, alongside `content_length` and `sampled_lengths`."""
+    if max_chars is None:
+        event_rows = Database.get_sampling_event_json(run_id, sample_id)
+    else:
+        event_rows = Database.get_sampling_event_preview_json(run_id, sample_id, max_chars)
+    events = ", ".join(
+        f'{{"event_id": {event_id}, "data": {data}}}' for event_id, data in event_rows
+    )
+    raw_metrics = Database.get_sample_metrics_json(run_id, sample_id)
+    # SampleMetrics.data is a JSONString, i.e. the metrics object encoded as a string
+    metrics = "null" if raw_metrics is None else f'{{"data": {json.dumps(raw_metrics)}}}'
+    return (
+        f'{{"run_id": {json.dumps(run_id)}, "sample_id": {json.dumps(sample_id)}, '
+        f'"page_id": {backend_page_id}, "sample_metrics": {metrics}, '
+        f'"sampling_events": [{events}]}}'
+    )
+
+
+def metadata_json(run_id: str) -> Optional[str]:
+    """`metadata(run_id)` as JSON, or None if the run doesn't exist."""
+    rows = Database.get_metadata_json_rows(run_id)
+    if len(rows) == 0:
+        return None
+    return _metadata_object(*rows[0])
+
+
+def metadata_list_json() -> str:
+    """`metadata_list` as JSON."""
+    return (
+        "[" + ", ".join(_metadata_object(*row) for row in Database.get_metadata_json_rows()) + "]"
+    )
+
+
+def run_page_bootstrap(run_id: str, page_id: int) -> Optional[tuple[str, str]]:
+    """(run name, bootstrap JSON) for the first paint of the run page, or None if no such run.
+
+    The bootstrap holds the `metadata`, `spec`, `final_report` and `sample_page` fields that
+    the page's scripts would otherwise each fetch from /graphql, in the same shapes."""
+    rows = Database.get_metadata_json_rows(run_id)
+    if len(rows) == 0:
+        return None
+    run, spec_values = rows[0]
+    spec = ", ".join(f'"{key}": {spec_values.get(key, "null")}' for key in BOOTSTRAP_SPEC_KEYS)
+    # FinalReport.data is a JSONString, like SampleMetrics.data
+    final_report = json.dumps(Database.get_final_report_json(run_id))
+    page = sample_page_json(run_id, page_id, DEFAULT_PREVIEW_CHARS)
+    bootstrap = (
+        f'{{"metadata": {_metadata_object(run, spec_values)}, "spec": {{{spec}}}, '
+        f'"final_report": {{"data": {final_report}}}, "sample_page": {page or "null"}}}'
+    )
+    return run["name"], bootstrap
+
+
+def script_safe_json(text: str) -> str:
+    """Escape JSON text so that it can be embedded verbatim in a <script> element."""
+    # these characters can only occur inside JSON strings, where the escapes are equivalent
+    return text.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+
+
+def _metadata_object(run: dict, spec_values: dict) -> str:
+    fields = [f"{json.dumps(key)}: {json.dumps(value)}" for key, value in run.items()]
+    fields += [f'"{key}": {spec_values.get(key, "null")}' for key in METADATA_SPEC_KEYS]
+    return "{" + ", ".join(fields) + "}"
@@ -1,27 +1,43 @@
+import asyncio
+import base64
+import binascii
 import json
-from functools import wraps
-from time import time
-from typing import Callable, Optional, ParamSpec, TypeVar
+from typing import Any, Callable, Iterator, Optional, TypeVar
 
 import graphene
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    SelectionSetNode,
+    Undefined,
+    value_from_ast_untyped,
+)
+
+from logviz.analytics import Analytics
+from logviz.database import (
+    DEFAULT_RUN_PAGE_SIZE,
+    MAX_RUN_PAGE_SIZE,
+    RUN_FACET_COLUMNS,
+    Database,
+    normalise_timestamp,
+)
+from logviz.fast_path import DEFAULT_PREVIEW_CHARS, MAX_PAGE_WINDOW_RADIUS, METADATA_SPEC_KEYS
+from logviz.instrumentation import timed
+from logviz.readers import ReaderPool
+from logviz.run_stats import METRIC_KEY_PREFIX
+from logviz.similarity import (
+    DEFAULT_SIMILAR_SAMPLES,
+    DEFAULT_SIMILARITY_THRESHOLD,
+    MAX_SIMILAR_SAMPLES,
+)
+from logviz.trajectory import DEFAULT_TIMELINE_PAGE_SIZE, MAX_TIMELINE_PAGE_SIZE
 
-from logviz.database import Database
-
-# generic types for function
-Param = ParamSpec("Param")
 RetType = TypeVar("RetType")
 
-
-def timing(f: Callable[Param, RetType]) -> Callable[Param, RetType]:
-    @wraps(f)
-    def wrap(*args, **kw):
-        ts = time()
-        result = f(*args, **kw)
-        te = time()
-        print("func:%r took: %2.4f sec" % (f.__name__, te - ts))
-        return result
-
-    return wrap  # type: ignore  # (I think the typing works out)
+# fields with full message contents, and with previews of them (see `_preview_chars`)
+CONTENT_FIELDS = ("content", "sampled")
+PREVIEW_FIELDS = ("content_preview", "sampled_preview")
 
 
 class RunConfig(graphene.ObjectType):
@@ -60,11 +76,39 @@ class ChatMessage(graphene.ObjectType):
     role = graphene.String(required=True)
     content = graphene.String()
     name = graphene.String()
+    content_preview = graphene.String(max_chars=graphene.Int(default_value=DEFAULT_PREVIEW_CHARS))
+    content_length = graphene.Int()
+
+    # read with their contents already cut in SQL (see `_preview_chars`), messages only have
+    # `content_preview` and `content_length`
+    def resolve_content_preview(self, info, max_chars: int) -> Optional[str]:
+        content = self.content_preview if self.content is None else self.content
+        return None if content is None else content[:max_chars]
+
+    def resolve_content_length(self, info) -> Optional[int]:
+        content_length: Optional[int] = self.content_length
+        if content_length is not None or self.content is None:
+            return content_length
+        return len(self.content)
 
 
 class SamplingEventData(graphene.ObjectType):
     prompt = graphene.List(ChatMessage)
     sampled = graphene.List(graphene.String)
+    sampled_preview = graphene.List(
+        graphene.String, max_chars=graphene.Int(default_value=DEFAULT_PREVIEW_CHARS)
+    )
+    sampled_lengths = graphene.List(graphene.Int)
+
+    def resolve_sampled_preview(self, info, max_chars: int) -> list[str]:
+        sampled = self.sampled_preview if self.sampled is None else self.sampled
+        return [str(s)[:max_chars] for s in sampled or []]
+
+    def resolve_sampled_lengths(self, info) -> list[int]:
+        sampled_lengths: Optional[list[int]] = self.sampled_lengths
+        if sampled_lengths is not None:
+            return sampled_lengths
+        return [len(str(s)) for s in self.sampled or []]
 
 
 class SamplingEvent(graphene.ObjectType):
@@ -91,11 +135,185 @@ class SamplePage(graphene.ObjectType):
     sample_metrics = graphene.Field(SampleMetrics)
 
 
+class Distribution(graphene.ObjectType):
+    """Summary of a numeric quantity over a run; NaNs are counted but otherwise ignored."""
+
+    count = graphene.Int()
+    nan_count = graphene.Int()
+    mean = graphene.Float()
+    std = graphene.Float()
+    min = graphene.Float()
+    max = graphene.Float()
+    p5 = graphene.Float()
+    p25 = graphene.Float()
+    p50 = graphene.Float()
+    p75 = graphene.Float()
+    p95 = graphene.Float()
+    histogram_counts = graphene.List(graphene.Int)
+    histogram_edges = graphene.List(graphene.Float)
+
+
+class MetricStats(graphene.ObjectType):
+    key = graphene.String(required=True)
+    kind = graphene.String(required=True)  # "numeric" or "categorical"
+    count = graphene.Int()
+    distribution = graphene.Field(Distribution)
+    value_counts = graphene.JSONString()
+
+
+class RunStats(graphene.ObjectType):
+    """Aggregates over a whole run, computed once at ingest."""
+
+    run_id = graphene.String(required=True)
+    num_events = graphene.Int()
+    event_types = graphene.JSONString()
+    events_per_sample = graphene.Field(Distribution)
+    prompt_chars = graphene.Field(Distribution)
+    completion_chars = graphene.Field(Distribution)
+    first_created_at = graphene.String()
+    last_created_at = graphene.String()
+    wall_clock_seconds = graphene.Float()
+    metrics = graphene.List(MetricStats)
+
+
+class TimelineStep(graphene.ObjectType):
+    """A message, sampled completion or function call in a sample's trajectory."""
+
+    step = graphene.Int(required=True)
+    event_id = graphene.Int(required=True)
+    kind = graphene.String(required=True)  # "message", "sampled" or "function_call"
+    role = graphene.String()
+    content = graphene.String()
+    name = graphene.String()
+    function_call = graphene.JSONString()
+    rewind_to = graphene.Int()
+    content_preview = graphene.String(max_chars=graphene.Int(default_value=DEFAULT_PREVIEW_CHARS))
+    content_length = graphene.Int()
+
+    # read with their contents already cut in SQL (see `_preview_chars`), messages only have
+    # `content_preview` and `content_length`
+    def resolve_content_preview(self, info, max_chars: int) -> Optional[str]:
+        content = self.content_preview if self.content is None else self.content
+        return None if content is None else content[:max_chars]
+
+    def resolve_content_length(self, info) -> Optional[int]:
+        content_length: Optional[int] = self.content_length
+        if content_length is not None or self.content is None:
+            return content_length
+        return len(self.content)
+
+
+class Timeline(graphene.ObjectType):
+    """A page of a sample's trajectory; pass `end_cursor` as `after` for the next one."""
+
+    run_id = graphene.String(required=True)
+    sample_id = graphene.String(required=True)
+    total_count = graphene.Int()
+    steps = graphene.List(TimelineStep)
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+
+
+class SimilarSample(graphene.ObjectType):
+    """A sample whose prompt is a near-duplicate of another's, by estimated Jaccard similarity
+    of their shingles."""
+
+    run_id = graphene.String(required=True)
+    sample_id = graphene.String(required=True)
+    similarity = graphene.Float(required=True)
+
+
+class RunFilter(graphene.InputObjectType):
+    """Runs to list or aggregate over; each list given keeps only runs with one of its values,
+    and each bound only runs uploaded or created in its range, an ISO 8601 date or time
+    (inclusive of `*_since`, exclusive of `*_before`). A run's completion_fns are matched as a
+    single comma-joined string, as in groups."""
+
+    run_ids = graphene.List(graphene.NonNull(graphene.String))
+    eval_names = graphene.List(graphene.NonNull(graphene.String))
+    base_evals = graphene.List(graphene.NonNull(graphene.String))
+    splits = graphene.List(graphene.NonNull(graphene.String))
+    completion_fns = graphene.List(graphene.NonNull(graphene.String))
+    uploaded_since = graphene.String()
+    uploaded_before = graphene.String()
+    created_since = graphene.String()
+    created_before = graphene.String()
+
+
+class FacetCount(graphene.ObjectType):
+    value = graphene.String()
+    count = graphene.Int(required=True)
+
+
+class TimeRange(graphene.ObjectType):
+    min = graphene.String()
+    max = graphene.String()
+
+
+class RunFacets(graphene.ObjectType):
+    """The listed runs' values of each spec column, with how many runs have each (most first),
+    and the ranges of their timestamps. Each facet ignores the filter on its own column, so it
+    also has the values that filter leaves out."""
+
+    eval_name = graphene.List(FacetCount)
+    base_eval = graphene.List(FacetCount)
+    split = graphene.List(FacetCount)
+    completion_fns = graphene.List(FacetCount)
+    uploaded_at = graphene.Field(TimeRange)
+    created_at = graphene.Field(TimeRange)
+
+
+class RunPage(graphene.ObjectType):
+    """A page of the run list; pass `end_cursor` as `after` for the next one."""
+
+    total_count = graphene.Int()
+    runs = graphene.List(Metadata)
+    facets = graphene.Field(RunFacets)
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+
+
+class MetricGroup(graphene.ObjectType):
+    """A metric's numeric values (booleans as 0/1) over the samples of a group of runs."""
+
+    group = graphene.JSONString()
+    num_runs = graphene.Int()
+    count = graphene.Int()
+    mean = graphene.Float()
+    min = graphene.Float()
+    max = graphene.Float()
+    std = graphene.Float()
+
+
+class MetricPivot(graphene.ObjectType):
+    key = graphene.String(required=True)
+    aggregate = graphene.String(required=True)
+    row_labels = graphene.List(graphene.String)
+    column_labels = graphene.List(graphene.String)
+    values = graphene.List(graphene.List(graphene.Float))
+
+
+class MetricTimeseriesPoint(graphene.ObjectType):
+    bucket = graphene.String(required=True)
+    group = graphene.String()
+    count = graphene.Int()
+    mean = graphene.Float()
+    min = graphene.Float()
+    max = graphene.Float()
+
+
 class Query(graphene.ObjectType):
     spec = graphene.Field(Spec, run_id=graphene.String(required=True))
     specs = graphene.List(Spec)
     metadata = graphene.Field(Metadata, run_id=graphene.String(required=True))
     metadata_list = graphene.List(Metadata)
+    runs = graphene.Field(
+        RunPage,
+        filter=RunFilter(),
+        sort=graphene.String(default_value="-uploaded_at"),
+        first=graphene.Int(default_value=DEFAULT_RUN_PAGE_SIZE),
+        after=graphene.String(),
+    )
     sample_ids = graphene.List(graphene.String, run_id=graphene.String(required=True))
     sampling_event = graphene.Field(
         SamplingEvent,
@@ -121,72 +339,354 @@ class Query(graphene.ObjectType):
         page_id=graphene.Int(required=True),
     )
     sample_pages = graphene.List(SamplePage, run_id=graphene.String(required=True))
+    sample_page_window = graphene.List(
+        SamplePage,
+        run_id=graphene.String(required=True),
+        page_id=graphene.Int(required=True),
+        radius=graphene.Int(default_value=1),
+    )
+    message_content = graphene.String(
+        run_id=graphene.String(required=True),
+        event_id=graphene.Int(required=True),
+        index=graphene.Int(required=True),
+        offset=graphene.Int(default_value=0),
+        length=graphene.Int(),
+        sampled=graphene.Boolean(default_value=False),
+    )
     final_report = graphene.Field(FinalReport, run_id=graphene.String(required=True))
     final_reports = graphene.List(FinalReport)
+    run_stats = graphene.Field(RunStats, run_id=graphene.String(required=True))
+    timeline = graphene.Field(
+        Timeline,
+        run_id=graphene.String(required=True),
+        sample_id=graphene.String(required=True),
+        first=graphene.Int(default_value=DEFAULT_TIMELINE_PAGE_SIZE),
+        after=graphene.String(),
+    )
+    similar_samples = graphene.List(
+        SimilarSample,
+        run_id=graphene.String(required=True),
+        sample_id=graphene.String(required=True),
+        threshold=graphene.Float(default_value=DEFAULT_SIMILARITY_THRESHOLD),
+        first=graphene.Int(default_value=DEFAULT_SIMILAR_SAMPLES),
+    )
+    metric_group_by = graphene.List(
+        MetricGroup,
+        key=graphene.String(required=True),
+        group_by=graphene.List(graphene.NonNull(graphene.String), default_value=["eval_name"]),
+        filter=RunFilter(),
+    )
+    metric_pivot = graphene.Field(
+        MetricPivot,
+        key=graphene.String(required=True),
+        rows=graphene.String(default_value="eval_name"),
+        columns=graphene.String(default_value="completion_fns"),
+        aggregate=graphene.String(default_value="mean"),
+        filter=RunFilter(),
+    )
+    metric_timeseries = graphene.List(
+        MetricTimeseriesPoint,
+        key=graphene.String(required=True),
+        interval=graphene.String(default_value="day"),
+        group_by=graphene.String(),
+        filter=RunFilter(),
+    )
 
-    @timing
-    def resolve_spec(self, info, run_id: str) -> Optional[Spec]:
-        raw_spec = Database.get_raw_spec(run_id)
+    @timed
+    async def resolve_spec(self, info, run_id: str) -> Optional[Spec]:
+        raw_spec = await _read(info, Database.get_raw_spec, run_id)
         return _from_raw_spec(raw_spec)
 
-    @timing
-    def resolve_metadata(self, info, run_id: str) -> Optional[Metadata]:
-        raw_metadata = Database.get_raw_metadata(run_id)
+    @timed
+    async def resolve_metadata(self, info, run_id: str) -> Optional[Metadata]:
+        raw_metadata = await _read(info, Database.get_raw_metadata, run_id)
         return _from_raw_metadata(raw_metadata)
 
-    @timing
-    def resolve_metadata_list(self, info) -> list[Metadata]:
-        raw_metadata_list = Database.get_raw_metadata_list()
+    @timed
+    async def resolve_metadata_list(self, info) -> list[Metadata]:
+        raw_metadata_list = await _read(info, Database.get_raw_metadata_list)
         return [_from_raw_metadata(rm) for rm in raw_metadata_list.values()]
 
-    @timing
-    def resolve_specs(self, info) -> list[Spec]:
-        raw_specs = Database.get_raw_specs()
+    @timed
+    async def resolve_runs(
+        self,
+        info,
+        sort: str,
+        first: int,
+        filter: Optional[dict] = None,
+        after: Optional[str] = None,
+    ) -> RunPage:
+        """A page of the runs matching `filter`, sorted by `sort` (a column of
+        `RUN_SORT_COLUMNS`, descending with a leading "-"), with the facets of all of them."""
+        first = min(max(first, 0), MAX_RUN_PAGE_SIZE)
+        column = sort.removeprefix("-")
+        filters = _run_filters(filter)
+        (runs, last_key, has_next_page), facets = await asyncio.gather(
+            _read(
+                info,
+                Database.get_run_page,
+                filters,
+                column,
+                sort.startswith("-"),
+                first,
+                None if after is None else _decode_run_cursor(after, sort),
+            ),
+            _read(info, Database.get_run_facets, filters),
+        )
+        return RunPage(
+            total_count=facets["total_count"],
+            runs=[_from_metadata_json_row(*run) for run in runs],
+            facets=RunFacets(
+                **{
+                    column: [
+                        FacetCount(**count)  # type: ignore  # (pylance doesn't understand graphene)
+                        for count in facets[column]
+                    ]
+                    for column in RUN_FACET_COLUMNS
+                },
+                uploaded_at=TimeRange(**facets["uploaded_at"]),
+                created_at=TimeRange(**facets["created_at"]),
+            ),  # type: ignore  # (pylance doesn't understand graphene)
+            end_cursor=None if last_key is None else _encode_run_cursor(sort, last_key),
+            has_next_page=has_next_page,
+        )  # type: ignore  # (pylance doesn't understand graphene)
+
+    @timed
+    async def resolve_specs(self, info) -> list[Spec]:
+        raw_specs = await _read(info, Database.get_raw_specs)
         specs = [_from_raw_spec(s) for s in raw_specs.values()]
         return specs
 
-    @timing
-    def resolve_sample_ids(self, info, run_id: str) -> list[str]:
-        return Database.get_sample_ids(run_id)
-
-    @timing
-    def resolve_sampling_events(self, info, run_id: str, sample_id: str) -> list[SamplingEvent]:
-        return _get_sampling_events(run_id, sample_id)
-
-    @timing
-    def resolve_sample_metrics(self, info, run_id: str, sample_id: str) -> Optional[SampleMetrics]:
-        return _get_sample_metrics(run_id, sample_id)
-
-    @timing
-    def resolve_sample_page(self, info, run_id: str, page_id: int) -> Optional[SamplePage]:
+    @timed
+    async def resolve_sample_ids(self, info, run_id: str) -> list[str]:
+        return await _read(info, Database.get_sample_ids, run_id)
+
+    @timed
+    async def resolve_sampling_events(
+        self, info, run_id: str, sample_id: str
+    ) -> list[SamplingEvent]:
+        preview_chars = _preview_chars(info)
+        return await _read(info, _get_sampling_events, run_id, sample_id, preview_chars)
+
+    @timed
+    async def resolve_sample_metrics(
+        self, info, run_id: str, sample_id: str
+    ) -> Optional[SampleMetrics]:
+        return await _read(info, _get_sample_metrics, run_id, sample_id)
+
+    @timed
+    async def resolve_sample_page(self, info, run_id: str, page_id: int) -> Optional[SamplePage]:
         # NOTE: subtracting 1 from page id before passing to backend
         backend_page_id = page_id - 1
-        sample_ids = Database.get_sample_ids(run_id)
-        target_sample_id = sorted(sample_ids)[backend_page_id]
-
-        sample_page = _get_sample_page_from_sample_id(run_id, target_sample_id, backend_page_id)
-        assert sample_page.page_id == backend_page_id
-        return sample_page
-
-    @timing
-    def resolve_sample_pages(self, info, run_id: str) -> list[SamplePage]:
-        sample_ids = Database.get_sample_ids(run_id)
-        pages = []
-        for page_id, sample_id in enumerate(sorted(sample_ids)):
-            page = _get_sample_page_from_sample_id(run_id, sample_id, page_id)
-            pages.append(page)
-        return pages
-
-    @timing
-    def resolve_final_report(self, info, run_id: str) -> Optional[FinalReport]:
-        raw_final_report = Database.get_raw_final_report(run_id)
+        if backend_page_id < 0:
+            return None
+        sample_id = await _read(info, Database.get_sample_id_for_page, run_id, backend_page_id)
+        if sample_id is None:
+            return None
+        return await _get_sample_page_from_sample_id(info, run_id, sample_id, backend_page_id)
+
+    @timed
+    async def resolve_sample_page_window(
+        self, info, run_id: str, page_id: int, radius: int
+    ) -> list[SamplePage]:
+        """The pages from page_id - radius to page_id + radius that exist, for prefetching."""
+        radius = min(max(radius, 0), MAX_PAGE_WINDOW_RADIUS)
+        # NOTE: subtracting 1 from page id before passing to backend
+        first_backend_page_id = max(page_id - 1 - radius, 0)
+        last_backend_page_id = page_id - 1 + radius
+        if last_backend_page_id < first_backend_page_id:
+            return []
+        sample_ids = await _read(
+            info,
+            Database.get_sample_ids_for_pages,
+            run_id,
+            first_backend_page_id,
+            last_backend_page_id - first_backend_page_id + 1,
+        )
+        return await asyncio.gather(
+            *(
+                _get_sample_page_from_sample_id(info, run_id, sample_id, backend_page_id)
+                for backend_page_id, sample_id in enumerate(sample_ids, start=first_backend_page_id)
+            )
+        )
+
+    @timed
+    async def resolve_sample_pages(self, info, run_id: str) -> list[SamplePage]:
+        sample_ids = await _read(info, Database.get_sample_ids_for_pages, run_id, 0)
+        return await asyncio.gather(
+            *(
+                _get_sample_page_from_sample_id(info, run_id, sample_id, page_id)
+                for page_id, sample_id in enumerate(sample_ids)
+            )
+        )
+
+    @timed
+    async def resolve_message_content(
+        self,
+        info,
+        run_id: str,
+        event_id: int,
+        index: int,
+        offset: int,
+        sampled: bool,
+        length: Optional[int] = None,
+    ) -> Optional[str]:
+        """Characters [offset, offset + length) of a prompt message's content, or of a sampled
+        string if `sampled`, for loading the rest of a truncated preview."""
+        return await _read(
+            info, Database.get_message_content, run_id, event_id, index, offset, length, sampled
+        )
+
+    @timed
+    async def resolve_final_report(self, info, run_id: str) -> Optional[FinalReport]:
+        raw_final_report = await _read(info, Database.get_raw_final_report, run_id)
         return _from_raw_final_report(raw_final_report)
 
+    @timed
+    async def resolve_run_stats(self, info, run_id: str) -> Optional[RunStats]:
+        raw_run_stats = await _read(info, Database.get_raw_run_stats, run_id)
+        if raw_run_stats is None:
+            return None
+        return _from_raw_run_stats(run_id, raw_run_stats)
+
+    @timed
+    async def resolve_timeline(
+        self, info, run_id: str, sample_id: str, first: int, after: Optional[str] = None
+    ) -> Optional[Timeline]:
+        first = min(max(first, 0), MAX_TIMELINE_PAGE_SIZE)
+        try:
+            after_step = -1 if after is None else int(after)
+        except ValueError:
+            raise ValueError(f"Invalid cursor `{after}`")
+        timeline = await _read(
+            info, Database.get_timeline, run_id, sample_id, after_step, first, _preview_chars(info)
+        )
+        if timeline is None:
+            return None
+        raw_steps, total_count = timeline
+        # steps are numbered from 0 without gaps
+        last_step = raw_steps[-1]["step"] if raw_steps else after_step
+        return Timeline(
+            run_id=run_id,
+            sample_id=sample_id,
+            total_count=total_count,
+            steps=[
+                TimelineStep(**raw_step)  # type: ignore  # (pylance doesn't understand graphene)
+                for raw_step in raw_steps
+            ],
+            end_cursor=str(last_step) if last_step >= 0 else None,
+            has_next_page=last_step + 1 < total_count,
+        )  # type: ignore  # (pylance doesn't understand graphene)
+
+    @timed
+    async def resolve_similar_samples(
+        self, info, run_id: str, sample_id: str, threshold: float, first: int
+    ) -> Optional[list[SimilarSample]]:
+        """Samples of any run (including this one) with near-duplicate prompts."""
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be in (0, 1]")
+        first = min(max(first, 0), MAX_SIMILAR_SAMPLES)
+        similar = await _read(
+            info, Database.get_similar_samples, run_id, sample_id, threshold, first
+        )
+        if similar is None:
+            return None
+        return [
+            SimilarSample(**sample)  # type: ignore  # (pylance doesn't understand graphene)
+            for sample in similar
+        ]
+
+    @timed
+    async def resolve_metric_group_by(
+        self, info, key: str, group_by: list[str], filter: Optional[dict] = None
+    ) -> list[MetricGroup]:
+        groups = await _read(info, Analytics.group_by, key, group_by, _run_filters(filter))
+        return [
+            MetricGroup(**group)  # type: ignore  # (pylance doesn't understand graphene)
+            for group in groups
+        ]
+
+    @timed
+    async def resolve_metric_pivot(
+        self,
+        info,
+        key: str,
+        rows: str,
+        columns: str,
+        aggregate: str,
+        filter: Optional[dict] = None,
+    ) -> MetricPivot:
+        pivot = await _read(
+            info, Analytics.pivot, key, rows, columns, aggregate, _run_filters(filter)
+        )
+        return MetricPivot(**pivot)  # type: ignore  # (pylance doesn't understand graphene)
+
+    @timed
+    async def resolve_metric_timeseries(
+        self,
+        info,
+        key: str,
+        interval: str,
+        group_by: Optional[str] = None,
+        filter: Optional[dict] = None,
+    ) -> list[MetricTimeseriesPoint]:
+        points = await _read(
+            info, Analytics.timeseries, key, interval, group_by, _run_filters(filter)
+        )
+        return [
+            MetricTimeseriesPoint(**point)  # type: ignore  # (pylance doesn't understand graphene)
+            for point in points
+        ]
+
 
 schema = graphene.Schema(query=Query, auto_camelcase=False)
 
 
-def _get_sampling_events(run_id: str, sample_id: str) -> list[SamplingEvent]:
+def _run_filters(run_filter: Optional[dict]) -> dict[str, Any]:
+    """A `RunFilter` as `Database.get_run_page` and `Analytics` take it: {run column: allowed
+    values} and {range column: (since, before)}."""
+    run_filter = run_filter or {}
+    filters: dict[str, Any] = {
+        "run_id": run_filter.get("run_ids"),
+        "eval_name": run_filter.get("eval_names"),
+        "base_eval": run_filter.get("base_evals"),
+        "split": run_filter.get("splits"),
+        "completion_fns": run_filter.get("completion_fns"),
+    }
+    for column, prefix in (("uploaded_at", "uploaded"), ("created_at", "created")):
+        since, before = (run_filter.get(f"{prefix}_{bound}") for bound in ("since", "before"))
+        filters[column] = (
+            None if since is None else normalise_timestamp(since),
+            None if before is None else normalise_timestamp(before),
+        )
+    return filters
+
+
+def _encode_run_cursor(sort: str, key: tuple[Any, str]) -> str:
+    """An opaque cursor for the run after which the next page starts, in a given sort order."""
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode()).decode()
+
+
+def _decode_run_cursor(cursor: str, sort: str) -> tuple[Any, str]:
+    try:
+        cursor_sort, value, run_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError(f"Invalid cursor `{cursor}`")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor `{cursor}` is for a list sorted by `{cursor_sort}`")
+    return value, run_id
+
+
+def _get_sampling_events(
+    run_id: str, sample_id: str, preview_chars: Optional[int] = None
+) -> list[SamplingEvent]:
+    if preview_chars is not None:
+        return [
+            _from_sampling_event_preview(run_id, sample_id, event_id, data)
+            for event_id, data in Database.get_sampling_event_preview_json(
+                run_id, sample_id, preview_chars
+            )
+        ]
     raw_sampling_events = Database.get_raw_sampling_events(run_id, sample_id)
     events = [_from_raw_sampling_event(e) for e in raw_sampling_events]
     return events
@@ -204,20 +704,71 @@ def _get_sample_metrics(run_id: str, sample_id: str) -> Optional[SampleMetrics]:
     return metrics
 
 
-def _get_sample_page_from_sample_id(run_id: str, sample_id: str, page_id: int) -> SamplePage:
+def _preview_chars(info) -> Optional[int]:
+    """The most characters the query's content previews ask for, or None if it asks for full
+    contents too. Without full contents, they can be cut to their previews in SQLite rather
+    than loaded and decoded whole."""
+    max_chars = 0
+    for field_node in info.field_nodes:
+        for field in _selected_fields(info, field_node.selection_set):
+            name = field.name.value
+            if name in CONTENT_FIELDS:
+                return None
+            if name not in PREVIEW_FIELDS:
+                continue
+            field_chars = DEFAULT_PREVIEW_CHARS
+            for argument in field.arguments:
+                if argument.name.value == "max_chars":
+                    value = value_from_ast_untyped(argument.value, info.variable_values)
+                    # an unset variable leaves the default
+                    if value is not Undefined:
+                        field_chars = value
+            if not isinstance(field_chars, int) or field_chars < 0:
+                return None
+            max_chars = max(max_chars, field_chars)
+    return max_chars
+
+
+def _selected_fields(info, selection_set: Optional[SelectionSetNode]) -> Iterator[FieldNode]:
+    """The fields of a selection set, at every depth and through fragments."""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+            yield from _selected_fields(info, selection.selection_set)
+        elif isinstance(selection, FragmentSpreadNode):
+            yield from _selected_fields(info, info.fragments[selection.name.value].selection_set)
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _selected_fields(info, selection.selection_set)
+
+
+async def _read(info, f: Callable[..., RetType], *args: Any) -> RetType:
+    """`f(*args)` on one of the view's reader threads, or right away if it has none."""
+    readers: Optional[ReaderPool] = info.context.get("readers")
+    if readers is None:
+        return f(*args)
+    return await readers.run(f, *args)
+
+
+async def _get_sample_page_from_sample_id(
+    info, run_id: str, sample_id: str, page_id: int
+) -> SamplePage:
     """Get the samples that correspond to a given sample_id, along with the metrics."""
-    sampling_events = _get_sampling_events(run_id, sample_id)
+    sampling_events, sample_metrics = await asyncio.gather(
+        _read(info, _get_sampling_events, run_id, sample_id, _preview_chars(info)),
+        _read(info, _get_sample_metrics, run_id, sample_id),
+    )
     sample_page = SamplePage(
         run_id=run_id,
         sample_id=sample_id,
         page_id=page_id,
         sampling_events=sampling_events,
-        sample_metrics=_get_sample_metrics(run_id, sample_id),
+        sample_metrics=sample_metrics,
     )  # type: ignore  # (pylance doesn't understand graphene)
     return sample_page
 
 
-@timing
 def _from_raw_final_report(raw_final_report: dict) -> FinalReport:
     return FinalReport(
         run_id=raw_final_report["run_id"],
@@ -225,7 +776,6 @@ def _from_raw_final_report(raw_final_report: dict) -> FinalReport:
     )  # type: ignore  # (pylance doesn't understand graphene)
 
 
-@timing
 def _from_raw_spec(raw_spec: dict) -> Spec:
     run_config = RunConfig(
         completion_fns=raw_spec["run_config"]["completion_fns"],
@@ -245,7 +795,6 @@ def _from_raw_spec(raw_spec: dict) -> Spec:
     return spec
 
 
-@timing
 def _from_raw_sampling_event(raw_event: dict) -> SamplingEvent:
     raw_data = json.loads(raw_event["data"])
     # TODO (ian): make a cleaner distinction between chat and base models
@@ -279,7 +828,35 @@ def _from_raw_sampling_event(raw_event: dict) -> SamplingEvent:
     return event
 
 
-@timing
+def _from_sampling_event_preview(
+    run_id: str, sample_id: str, event_id: int, preview_json: str
+) -> SamplingEvent:
+    """A sampling event from `Database.get_sampling_event_preview_json`, which has only the
+    previews of its contents and sampled strings, and their lengths."""
+    preview = json.loads(preview_json)
+    prompt = [
+        ChatMessage(
+            role=message["role"],
+            name=message["name"],
+            content_preview=message["content"],
+            content_length=message["content_length"],
+        )  # type: ignore  # (pylance doesn't understand graphene)
+        for message in preview["prompt"]
+    ]
+    data = SamplingEventData(
+        prompt=prompt,
+        sampled_preview=preview["sampled"],
+        sampled_lengths=preview["sampled_lengths"],
+    )  # type: ignore  # (pylance doesn't understand graphene)
+    return SamplingEvent(
+        run_id=run_id,
+        sample_id=sample_id,
+        event_id=event_id,
+        type="sampling",
+        data=data,
+    )  # type: ignore  # (pylance doesn't understand graphene)
+
+
 def _from_raw_metadata(raw_metadata: dict) -> Metadata:
     return Metadata(
         run_id=raw_metadata["run_id"],
@@ -292,3 +869,48 @@ def _from_raw_metadata(raw_metadata: dict) -> Metadata:
         created_at=raw_metadata["created_at"],
         num_samples=raw_metadata["num_samples"],
     )  # type: ignore  # (pylance doesn't understand graphene)
+
+
+def _from_metadata_json_row(run: dict, spec_json: dict) -> Metadata:
+    """A `Database.get_metadata_json_rows` row as Metadata."""
+    spec = {key: json.loads(value) for key, value in spec_json.items()}
+    return Metadata(
+        **{key: run[key] for key in ("run_id", "name", "uploaded_at", "num_samples")},
+        **{key: spec.get(key) for key in METADATA_SPEC_KEYS},
+    )  # type: ignore  # (pylance doesn't understand graphene)
+
+
+def _from_raw_distribution(raw_distribution: dict) -> Distribution:
+    return Distribution(
+        **{key: raw_distribution.get(key) for key in Distribution._meta.fields}
+    )  # type: ignore  # (pylance doesn't understand graphene)
+
+
+def _from_raw_run_stats(run_id: str, raw_run_stats: dict) -> RunStats:
+    metrics = []
+    for key, raw_metric in sorted(raw_run_stats.items()):
+        if not key.startswith(METRIC_KEY_PREFIX):
+            continue
+        metrics.append(
+            MetricStats(
+                key=key.removeprefix(METRIC_KEY_PREFIX),
+                kind=raw_metric["kind"],
+                count=raw_metric["count"],
+                distribution=(
+                    _from_raw_distribution(raw_metric) if raw_metric["kind"] == "numeric" else None
+                ),
+                value_counts=raw_metric.get("value_counts"),
+            )  # type: ignore  # (pylance doesn't understand graphene)
+        )
+    return RunStats(
+        run_id=run_id,
+        num_events=raw_run_stats["num_events"],
+        event_types=raw_run_stats["event_types"],
+        events_per_sample=_from_raw_distribution(raw_run_stats["events_per_sample"]),
+        prompt_chars=_from_raw_distribution(raw_run_stats["prompt_chars"]),
+        completion_chars=_from_raw_distribution(raw_run_stats["completion_chars"]),
+        first_created_at=raw_run_stats["first_created_at"],
+        last_created_at=raw_run_stats["last_created_at"],
+        wall_clock_seconds=raw_run_stats["wall_clock_seconds"],
+        metrics=metrics,
+    )  # type: ignore  # (pylance doesn't understand graphene)
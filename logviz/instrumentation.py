@@ -0,0 +1,411 @@
+"""Cheap always-on instrumentation for the DB-backed app.
+
+Metrics are kept in-process and exposed on `/metrics` in the Prometheus text format, so
+latency percentiles and per-request SQL counts (N+1 regressions) can be read off a dashboard
+without attaching a profiler.
+"""
+import bisect
+import inspect
+import sqlite3
+import threading
+from functools import wraps
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Optional, ParamSpec, TypeVar
+
+if TYPE_CHECKING:
+    from flask import Flask, Response
+
+# generic types for function
+Param = ParamSpec("Param")
+RetType = TypeVar("RetType")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 3e7, 1e8)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# statements kept per connection for slow-request capture (see `logviz.profiling`)
+MAX_RECORDED_STATEMENTS = 200
+
+# called with the text of every statement before it runs, as written rather than with its
+# parameters expanded (see `logviz.query_catalogue`)
+_statement_hook: Optional[Callable[[str], None]] = None
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _label_str(self, labelvalues: tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._label_str(labelvalues)} {_fmt(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._label_str(labelvalues)} {_fmt(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # per label set: (bucket counts incl. +Inf, sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[labelvalues] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            snapshot = [
+                (lv, list(counts), total[0]) for lv, (counts, total) in self._values.items()
+            ]
+        for labelvalues, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = self._label_str(labelvalues, f'le="{_fmt(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = self._label_str(labelvalues, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(labelvalues)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(labelvalues)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = Histogram("logviz_request_seconds", "Request latency by endpoint.", ("endpoint",))
+RESOLVER_SECONDS = Histogram("logviz_resolver_seconds", "GraphQL resolver latency.", ("resolver",))
+REQUEST_SQL_QUERIES = Histogram(
+    "logviz_request_sql_queries",
+    "SQL statements executed per request.",
+    ("endpoint",),
+    buckets=COUNT_BUCKETS,
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "logviz_request_sql_seconds", "Time spent in SQL per request.", ("endpoint",)
+)
+REQUEST_ROWS = Histogram(
+    "logviz_request_rows_decoded",
+    "Rows fetched from SQLite per request.",
+    ("endpoint",),
+    buckets=COUNT_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "logviz_response_bytes", "Response body size by endpoint.", ("endpoint",), BYTES_BUCKETS
+)
+SQL_QUERIES_TOTAL = Counter("logviz_sql_queries_total", "SQL statements executed.", ("endpoint",))
+ROWS_DECODED_TOTAL = Counter(
+    "logviz_rows_decoded_total", "Rows fetched from SQLite.", ("endpoint",)
+)
+GRAPHQL_DOCUMENTS_TOTAL = Counter(
+    "logviz_graphql_documents_total",
+    "GraphQL documents looked up in the parsed document cache, by result.",
+    ("result",),
+)
+MAINTENANCE_SECONDS = Histogram(
+    "logviz_maintenance_seconds", "Duration of database maintenance steps.", ("task",)
+)
+MAINTENANCE_ERRORS_TOTAL = Counter(
+    "logviz_maintenance_errors_total", "Database maintenance steps that failed.", ("task",)
+)
+MAINTENANCE_PAGES_FREED_TOTAL = Counter(
+    "logviz_maintenance_pages_freed_total", "Free pages returned to the file system by vacuuming."
+)
+DATABASE_PAGES = Gauge(
+    "logviz_database_pages", "Pages in the database file, and how many of them are free.", ("kind",)
+)
+for _metric in (
+    REQUEST_SECONDS,
+    RESOLVER_SECONDS,
+    REQUEST_SQL_QUERIES,
+    REQUEST_SQL_SECONDS,
+    REQUEST_ROWS,
+    RESPONSE_BYTES,
+    SQL_QUERIES_TOTAL,
+    ROWS_DECODED_TOTAL,
+    GRAPHQL_DOCUMENTS_TOTAL,
+    MAINTENANCE_SECONDS,
+    MAINTENANCE_ERRORS_TOTAL,
+    MAINTENANCE_PAGES_FREED_TOTAL,
+    DATABASE_PAGES,
+):
+    REGISTRY.register(_metric)
+
+
+class SQLStats:
+    """Per-connection (and so per-request) SQL counters."""
+
+    __slots__ = ("queries", "seconds", "rows", "statements")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        # (sql, params, seconds) for the first MAX_RECORDED_STATEMENTS executes
+        self.statements: list[tuple[str, Any, float]] = []
+
+    def record(self, sql: str, params: Any, seconds: float) -> int:
+        """Record a statement's execution; returns its index in `statements`, or -1 if it wasn't
+        kept."""
+        self.seconds += seconds
+        if len(self.statements) >= MAX_RECORDED_STATEMENTS:
+            return -1
+        self.statements.append((sql, params, seconds))
+        return len(self.statements) - 1
+
+    def record_fetch(self, statement: int, rows: int, seconds: float) -> None:
+        """Add rows fetched from the statement at index `statement`, and the time it took."""
+        self.rows += rows
+        self.seconds += seconds
+        if statement >= 0:
+            sql, params, executed = self.statements[statement]
+            self.statements[statement] = (sql, params, executed + seconds)
+
+    def trace(self, statement: str) -> None:
+        self.queries += 1
+
+    def merge(self, other: "SQLStats") -> None:
+        """Add the counters of statements run on another connection for the same request."""
+        self.queries += other.queries
+        self.seconds += other.seconds
+        self.rows += other.rows
+        self.statements += other.statements[: MAX_RECORDED_STATEMENTS - len(self.statements)]
+
+
+def set_statement_hook(hook: Optional[Callable[[str], None]]) -> None:
+    """Call `hook` with each statement run on an instrumented connection (None removes it)."""
+    global _statement_hook
+    _statement_hook = hook
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times statements and counts the rows fetched through it.
+
+    SQLite does most of a query's work while its rows are stepped through, so the time spent
+    fetching them is added to the statement's."""
+
+    # the statistics and index in them of the statement last executed
+    _stats: Optional[SQLStats] = None
+    _statement = -1
+
+    def execute(self, sql, parameters=(), /):  # type: ignore[override]
+        if _statement_hook is not None:
+            _statement_hook(sql)
+        ts = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._executed(sql, parameters, ts)
+
+    def executemany(self, sql, seq_of_parameters, /):  # type: ignore[override]
+        if _statement_hook is not None:
+            _statement_hook(sql)
+        ts = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._executed(sql, None, ts)
+
+    def fetchone(self):
+        ts = perf_counter()
+        row = super().fetchone()
+        self._fetched(0 if row is None else 1, ts)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        ts = perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._fetched(len(rows), ts)
+        return rows
+
+    def fetchall(self):
+        ts = perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), ts)
+        return rows
+
+    def __next__(self):
+        ts = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, ts)
+            raise
+        self._fetched(1, ts)
+        return row
+
+    def _executed(self, sql: str, parameters: Any, ts: float) -> None:
+        # kept for the fetches, as the connection's statistics are swapped per reader call
+        self._stats = self.connection.stats  # type: ignore[attr-defined]
+        self._statement = self._stats.record(sql, parameters, perf_counter() - ts)
+
+    def _fetched(self, rows: int, ts: float) -> None:
+        if self._stats is not None:
+            self._stats.record_fetch(self._statement, rows, perf_counter() - ts)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection factory for `sqlite3.connect` that keeps `SQLStats` for its lifetime."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = SQLStats()
+        self.set_trace_callback(self.stats.trace)
+
+    def cursor(self, factory=InstrumentedCursor):  # type: ignore[override]
+        return super().cursor(factory)
+
+    # sqlite3's own shortcuts run the statement without going through `cursor().execute`
+    def execute(self, sql, parameters=(), /):  # type: ignore[override]
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):  # type: ignore[override]
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed(f: Callable[Param, RetType]) -> Callable[Param, RetType]:
+    """Record the latency of a GraphQL resolver in `logviz_resolver_seconds`."""
+    name = f.__name__
+
+    if inspect.iscoroutinefunction(f):
+
+        @wraps(f)
+        async def wrap_async(*args, **kw):
+            ts = perf_counter()
+            try:
+                return await f(*args, **kw)
+            finally:
+                RESOLVER_SECONDS.observe(perf_counter() - ts, name)
+
+        return wrap_async  # type: ignore  # (I think the typing works out)
+
+    @wraps(f)
+    def wrap(*args, **kw):
+        ts = perf_counter()
+        try:
+            return f(*args, **kw)
+        finally:
+            RESOLVER_SECONDS.observe(perf_counter() - ts, name)
+
+    return wrap  # type: ignore  # (I think the typing works out)
+
+
+class Instrumentation:
+    @staticmethod
+    def render() -> "Response":
+        from flask import Response
+
+        return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @staticmethod
+    def init_app(app: "Flask") -> None:
+        # imported here so that the SQL instrumentation above can be used without Flask
+        from flask import g, request
+
+        @app.before_request
+        def start_timer():
+            g.request_started_at = perf_counter()
+
+        @app.after_request
+        def record_request(response: "Response") -> "Response":
+            started_at: Optional[float] = g.get("request_started_at")
+            if started_at is None:
+                return response
+            endpoint = request.endpoint or "unknown"
+            REQUEST_SECONDS.observe(perf_counter() - started_at, endpoint)
+            if response.content_length is not None:
+                RESPONSE_BYTES.observe(response.content_length, endpoint)
+            db = g.get("db")
+            stats: Optional[SQLStats] = getattr(db, "stats", None)
+            if stats is not None:
+                REQUEST_SQL_QUERIES.observe(stats.queries, endpoint)
+                REQUEST_SQL_SECONDS.observe(stats.seconds, endpoint)
+                REQUEST_ROWS.observe(stats.rows, endpoint)
+                SQL_QUERIES_TOTAL.inc(stats.queries, endpoint)
+                ROWS_DECODED_TOTAL.inc(stats.rows, endpoint)
+            return response
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
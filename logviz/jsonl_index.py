@@ -0,0 +1,216 @@
+"""Serve a log straight from its JSONL file, without ingesting it into SQLite.
+
+Registering a log (`logviz register`, or uploading with `mode=index`) only builds a compact
+sidecar offset index next to the file: for every sample, the byte range, event id and type of
+each of its event lines plus its metrics line, the byte range of every event line by its event
+id, and the byte ranges of the spec and final report. Reads then seek into a memory-mapped copy
+of the file and decode just the lines they need. `Database` dispatches to this backend for
+registered runs, so the GraphQL resolvers and fast paths work unchanged.
+"""
+import json
+import mmap
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+INDEX_SUFFIX = ".idx.json"
+INDEX_VERSION = 2
+
+# evals writes event lines with the identifying keys before "data", so these usually match in
+# the line head; anything else falls back to a full json.loads of the line
+_EVENT_ID = re.compile(rb'"event_id":\s*(-?\d+)')
+_SAMPLE_ID = re.compile(rb'"sample_id":\s*"((?:[^"\\]|\\.)*)"')
+_TYPE = re.compile(rb'"type":\s*"((?:[^"\\]|\\.)*)"')
+_DATA_KEY = b'"data":'
+
+
+class JsonlIndex:
+    def __init__(self, path: Path, index: dict):
+        self.path = path
+        self.index = index
+        self._file = path.open("rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def load_or_build(cls, path: Path) -> "JsonlIndex":
+        """Open a log, reusing its sidecar index if it is still valid for the file."""
+        index_path = index_path_for(path)
+        stat = path.stat()
+        if index_path.exists():
+            with index_path.open() as f:
+                index = json.load(f)
+            if (
+                index.get("version") == INDEX_VERSION
+                and index["size"] == stat.st_size
+                and index["mtime_ns"] == stat.st_mtime_ns
+            ):
+                return cls(path, index)
+        index = build_index(path)
+        tmp_path = index_path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+        return cls(path, index)
+
+    @property
+    def run_id(self) -> str:
+        run_id: str = self.spec()["run_id"]
+        return run_id
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def _read(self, span: list[int]) -> dict:
+        offset, length = span
+        line: dict = json.loads(self._mmap[offset : offset + length])
+        return line
+
+    def spec(self) -> dict:
+        spec: dict = self._read(self.index["spec"])["spec"]
+        return spec
+
+    def final_report(self) -> Optional[dict]:
+        if self.index["final_report"] is None:
+            return None
+        final_report: dict = self._read(self.index["final_report"])["final_report"]
+        return final_report
+
+    def sample_ids(self) -> list[str]:
+        return list(self.index["samples"])
+
+    def event_lines(self, sample_id: str, event_type: Optional[str] = None) -> Iterator[dict]:
+        """The parsed event lines of a sample (metrics excluded), in event id order."""
+        sample = self.index["samples"].get(sample_id)
+        if sample is None:
+            return
+        for _, line_type, offset, length in sample["events"]:
+            if event_type is None or line_type == event_type:
+                yield self._read([offset, length])
+
+    def event_line(self, event_id: int) -> Optional[dict]:
+        """The parsed line of an event, looked up by its (run-wide) event id."""
+        span = self.index["events"].get(str(event_id))
+        return None if span is None else self._read(span)
+
+    def metrics_line(self, sample_id: str) -> Optional[dict]:
+        sample = self.index["samples"].get(sample_id)
+        if sample is None or sample["metrics"] is None:
+            return None
+        return self._read(sample["metrics"])
+
+    # the methods below return data shaped like the corresponding `Database` rows
+
+    def event_rows(self, sample_id: str, event_type: Optional[str] = None) -> Iterator[dict]:
+        for line in self.event_lines(sample_id, event_type):
+            yield {
+                "event_id": line["event_id"],
+                "sample_id": line["sample_id"],
+                "run_id": line["run_id"],
+                "event_type": line["type"],
+                "data": json.dumps(line["data"]),
+                "created_at": line["created_at"],
+            }
+
+    def metric_values(self, sample_id: str) -> Optional[dict]:
+        """A sample's metrics, with created_at added as a metric as it is at ingest."""
+        line = self.metrics_line(sample_id)
+        if line is None:
+            return None
+        return {**line["data"], "created_at": line["created_at"]}
+
+
+def index_path_for(path: Path) -> Path:
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+def build_index(path: Path) -> dict:
+    """Scan a log once and record where each sample's lines are."""
+    stat = path.stat()
+    index: dict[str, Any] = {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "spec": None,
+        "final_report": None,
+        "samples": {},
+        # event id (as a string, as JSON has it) -> [offset, length], metrics lines excluded
+        "events": {},
+    }
+    samples: dict[str, dict] = index["samples"]
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = 0
+        size = len(mm)
+        while offset < size:
+            end = mm.find(b"\n", offset)
+            if end == -1:
+                end = size
+            length = end - offset
+            if length > 0 and not mm[offset : offset + 1].isspace():
+                _index_line(mm, offset, length, index, samples)
+            offset = end + 1
+    if index["spec"] is None:
+        raise KeyError("spec")
+    for sample in samples.values():
+        sample["events"].sort()
+    return index
+
+
+def _index_line(mm: mmap.mmap, offset: int, length: int, index: dict, samples: dict) -> None:
+    head_end = mm.find(_DATA_KEY, offset, offset + length)
+    head = mm[offset : head_end if head_end != -1 else offset + min(length, 512)]
+    if head.startswith(b'{"spec"'):
+        index["spec"] = [offset, length]
+        return
+    if head.startswith(b'{"final_report"'):
+        index["final_report"] = [offset, length]
+        return
+    event_id = _EVENT_ID.search(head)
+    sample_id = _SAMPLE_ID.search(head)
+    line_type = _TYPE.search(head)
+    if head_end != -1 and event_id and sample_id and line_type:
+        event = (
+            int(event_id.group(1)),
+            json.loads(b'"' + sample_id.group(1) + b'"'),
+            json.loads(b'"' + line_type.group(1) + b'"'),
+        )
+    else:
+        line = json.loads(mm[offset : offset + length])
+        if "spec" in line:
+            index["spec"] = [offset, length]
+            return
+        if "final_report" in line:
+            index["final_report"] = [offset, length]
+            return
+        event = (line["event_id"], line["sample_id"], line["type"])
+    sample = samples.setdefault(event[1], {"events": [], "metrics": None})
+    if event[2] == "metrics":
+        sample["metrics"] = [offset, length]
+    else:
+        sample["events"].append([event[0], event[2], offset, length])
+        index["events"][str(event[0])] = [offset, length]
+
+
+_open_indexes: dict[Path, JsonlIndex] = {}
+_open_indexes_lock = threading.Lock()
+
+
+def open_index(path: Path) -> JsonlIndex:
+    """A shared, memory-mapped index for a registered log."""
+    with _open_indexes_lock:
+        index = _open_indexes.get(path)
+        if index is None:
+            index = JsonlIndex.load_or_build(path)
+            _open_indexes[path] = index
+        return index
+
+
+def forget_index(path: Path, delete_sidecar: bool = True) -> None:
+    with _open_indexes_lock:
+        index = _open_indexes.pop(path, None)
+    if index is not None:
+        index.close()
+    if delete_sidecar:
+        index_path_for(path).unlink(missing_ok=True)
@@ -1,12 +1,8 @@
+from urllib.parse import urlencode
+
 from flask import Flask, redirect, render_template, request
 
-from logviz.logviz_old.utils import (
-    build_pages,
-    build_trajectories,
-    filter_pages,
-    load_jsonl,
-    parse_log_lines,
-)
+from logviz.logviz_old.utils import build_trajectory, load_pages
 
 app = Flask(__name__)
 
@@ -33,8 +29,9 @@ def search():
 def metric_search():
     """Redirect to the main log url but with the search metrics added to the URL.
 
-    Metric search is currently pretty hacky. It works by passing a dictionary of metrics
-    and target values as a string that is then parsed with ast.literal_eval.
+    Metric search takes either a dictionary of metrics and target values, parsed with
+    ast.literal_eval, or comma-separated comparisons such as `accuracy >= 0.5, CR_correct == True`
+    (see logviz.logviz_old.filters).
 
     Example:
         If Sample Metrics looks like this:
@@ -42,6 +39,8 @@ def metric_search():
         and I want samples where CR_correct is True and IR_correct is False,
         I would enter the following string in the 'Search metrics' box:
             {'CR_correct': True, 'IR_correct': False}
+        or, equivalently:
+            CR_correct == True, IR_correct == False
     """
     referrer = request.args.get("referrer")
     search_metrics = request.args.get("search_metrics")
@@ -49,7 +48,7 @@ def metric_search():
     # TODO: fix this parsing
     assert referrer is not None
     base_url = referrer.split("?")[0]
-    redirect_url = f"{base_url}?search_metrics={search_metrics}"
+    redirect_url = f"{base_url}?{urlencode({'search_metrics': search_metrics})}"
     print(f"{redirect_url = }")
     return redirect(redirect_url)
 
@@ -76,10 +75,7 @@ def view_sampling(
     search_metrics = request.args.get("search_metrics", None)
     keywords = request.args.get("keywords", None)
     try:
-        jsonl_dicts = load_jsonl(path_to_jsonl)
-        log_lines = parse_log_lines(jsonl_dicts)
-        all_pages = build_pages(log_lines)
-        pages = filter_pages(all_pages, search_metrics=search_metrics, keywords=keywords)
+        pages = load_pages(path_to_jsonl, search_metrics=search_metrics, keywords=keywords)
         print(f"Loaded {len(pages)} pages with sample ids {', '.join(p.sample_id for p in pages)}")
     except Exception as e:
         raise e
@@ -123,9 +119,7 @@ def view_task_v1(path_to_jsonl: str):
     path_to_jsonl = "/" + path_to_jsonl
     page_idx = int(request.args.get("page", 1)) - 1
     try:
-        jsonl_dicts = load_jsonl(path_to_jsonl)
-        log_lines = parse_log_lines(jsonl_dicts)
-        pages = build_pages(log_lines, sort_descending=False)
+        pages = load_pages(path_to_jsonl, sort_descending=False)
 
         print(f"Loaded {len(pages)} pages with sample ids {', '.join(p.sample_id for p in pages)}")
     except Exception as e:
@@ -149,13 +143,12 @@ def view_task(path_to_jsonl: str):
     path_to_jsonl = "/" + path_to_jsonl
     page_idx = int(request.args.get("page", 1)) - 1
     try:
-        jsonl_dicts = load_jsonl(path_to_jsonl)
-        log_lines = parse_log_lines(jsonl_dicts)
-        pages = build_trajectories(log_lines)
+        pages = load_pages(path_to_jsonl, sort_descending=False)
         print(f"Loaded {len(pages)} pages with sample ids {', '.join(p.sample_id for p in pages)}")
     except Exception as e:
         raise e
-    page = pages[page_idx] if 0 <= page_idx < len(pages) else None
+    # only the page shown needs its prompts decoded into a trajectory
+    page = build_trajectory(pages[page_idx]) if 0 <= page_idx < len(pages) else None
     return render_template(
         "task.html",
         page_content=page,
@@ -0,0 +1,100 @@
+"""The legacy viewer's page filters, compiled once per search.
+
+A keyword search (`keywords`, comma-separated) keeps the pages where every keyword is in the
+prompt of at least one sample. `KeywordMatcher` decodes each sample's prompt once for all the
+keywords, rather than once per keyword, and stops as soon as it has found them all.
+
+A metric search (`search_metrics`) keeps the pages whose sample metrics match every condition.
+It is either a dict of expected values, as it has always been:
+    {'CR_correct': True, 'IR_correct': False}
+or comma-separated comparisons, with values (which can't contain commas) written as Python
+literals or bare strings:
+    accuracy >= 0.5, CR_correct == True, answer != B
+Conditions on metrics a sample doesn't have are ignored, and comparisons between values that
+can't be ordered (such as a string and a number) fail.
+"""
+import ast
+import operator
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+CONDITION = re.compile(r"\s*(?P<key>[^=!<>]+?)\s*(?P<op>==|!=|>=|<=|>|<)\s*(?P<value>.+?)\s*")
+
+
+class KeywordMatcher:
+    """Finds which of a set of keywords occur in some texts."""
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        # an empty keyword is in every text, so it can't exclude anything
+        self.keywords = frozenset(keyword for keyword in keywords if keyword)
+
+    def matches_all(self, texts: Iterable[str]) -> bool:
+        """Whether every keyword is in at least one of the texts, which are only consumed until
+        they are all found."""
+        missing = self.keywords
+        for text in texts:
+            # for the few keywords of a search, a substring search per keyword is several times
+            # faster than one pass of a regular expression that matches any of them
+            missing = frozenset(keyword for keyword in missing if keyword not in text)
+            if not missing:
+                return True
+        return not missing
+
+
+@dataclass(frozen=True, slots=True)
+class MetricPredicate:
+    """A condition on one of a sample's metrics."""
+
+    key: str
+    op: str
+    value: Any
+
+    def __call__(self, metrics: dict) -> Optional[bool]:
+        """Whether the metrics satisfy the condition, or None if they don't have the metric."""
+        if self.key not in metrics:
+            return None
+        try:
+            return bool(OPERATORS[self.op](metrics[self.key], self.value))
+        except TypeError:
+            return False
+
+
+def compile_keywords(keywords: Optional[str]) -> Optional[KeywordMatcher]:
+    """The matcher for a comma-separated keyword search, or None if there's nothing to match."""
+    matcher = KeywordMatcher(keywords.split(",")) if keywords else None
+    return matcher if matcher is not None and matcher.keywords else None
+
+
+def compile_metric_predicates(search_metrics: Optional[str]) -> list[MetricPredicate]:
+    """The conditions of a metric search (see the module docstring)."""
+    if not search_metrics or not search_metrics.strip():
+        return []
+    if search_metrics.lstrip().startswith("{"):
+        expected = ast.literal_eval(search_metrics)
+        if not isinstance(expected, dict):
+            raise ValueError(f"Expected a dict of metric values, got {search_metrics!r}")
+        return [MetricPredicate(key, "==", value) for key, value in expected.items()]
+
+    predicates = []
+    for condition in search_metrics.split(","):
+        match = CONDITION.fullmatch(condition)
+        if match is None:
+            raise ValueError(f"Can't parse metric condition {condition.strip()!r}")
+        predicates.append(MetricPredicate(match["key"], match["op"], _literal(match["value"])))
+    return predicates
+
+
+def _literal(value: str) -> Any:
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
@@ -1,87 +1,127 @@
-import ast
+"""The legacy viewer's model of a log: one object per line, grouped into a page per sample.
+
+Logs are read a line at a time and parsed into frozen, slotted dataclasses, so that opening a
+large log takes little more memory than the file itself. Sampling lines keep their raw bytes
+instead of their prompts, which are decoded when a page is rendered or searched; strings that
+repeat across lines (run ids, sample ids, roles and metric names) are interned.
+"""
+import json
 import os
+import sys
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Iterable, Iterator
 
 import jsonlines
 
+from logviz.logviz_old.filters import compile_keywords, compile_metric_predicates
+from logviz.trajectory import TrajectoryBuilder
+
+# logs (sorted one way or the other, and filtered) whose pages are kept between requests
+PAGE_CACHE_SIZE = 8
+
 
 class Prompt(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def render_prompt(self) -> Iterable[dict[str, str]]:
         pass
 
     @abstractmethod
+    def text(self) -> str:
+        """The text that keyword searches look in"""
+
     def contains(self, keyword: str) -> bool:
-        pass
+        return keyword in self.text()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ChatPrompt(Prompt):
     data: list[dict[str, str]]
 
     def render_prompt(self) -> Iterable[dict[str, str]]:
         return self.data
 
-    def contains(self, keyword: str) -> bool:
-        combined_prompt = "".join([prompt["content"] for prompt in self.data])
-        return keyword in combined_prompt
+    def text(self) -> str:
+        return "".join([prompt["content"] for prompt in self.data])
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BasePrompt(Prompt):
     data: str
 
     def render_prompt(self) -> Iterable[dict[str, str]]:
         return [{"role": "base-prompt", "content": self.data}]
 
-    def contains(self, keyword: str) -> bool:
-        return keyword in self.data
+    def text(self) -> str:
+        return self.data
+
+
+def decode_prompt(prompt: Any) -> Prompt:
+    """A sampling event's prompt, as a ChatPrompt or BasePrompt depending on its type."""
+    if isinstance(prompt, str):
+        return BasePrompt(data=prompt)
+    if isinstance(prompt, list):
+        return ChatPrompt(data=[_intern_role(message) for message in prompt])
+    raise ValueError(f"Unknown type for prompt type: {type(prompt)}")
+
+
+def _intern_role(message: dict[str, str]) -> dict[str, str]:
+    role = message.get("role")
+    return {**message, "role": sys.intern(role)} if isinstance(role, str) else message
 
 
 class AbstractLogLine(ABC):
     """Abstract class for log lines"""
 
+    __slots__ = ()
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class LogLine(AbstractLogLine):
     run_id: str
     created_by: str
     created_at: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LogFinalReport(AbstractLogLine):
     final_report: dict
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LogSpec(LogLine):
     spec: dict
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LogSampling(LogLine):
     event_id: int
     sample_id: str
-    prompt: Prompt
     sampled: str | list[str]
+    # the line the event was read from, which the prompt is decoded from when it is needed
+    raw: bytes
+
+    @property
+    def prompt(self) -> Prompt:
+        return decode_prompt(json.loads(self.raw)["data"]["prompt"])
 
     def render_prompt(self):
         return self.prompt.render_prompt()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LogMetrics(LogLine):
     event_id: int
     sample_id: str
     data: dict  # we don't know what each eval will record
 
 
-@dataclass
+@dataclass(slots=True)
 class LogPage:
     sample_id: str  # each page will correspond to a sample
     samples: list[LogSampling]
@@ -90,19 +130,21 @@ class LogPage:
     log_spec: LogSpec | None = None
 
 
-def load_jsonl(path_to_jsonl: str) -> list[dict]:
-    """Load a jsonl file into a list of dicts
-    Making a separate function so we can catch errors with the jsonl loading"""
+def read_jsonl_lines(path_to_jsonl: str) -> Iterator[bytes]:
+    """The non-empty lines of a jsonl file, read one at a time."""
     path = Path(path_to_jsonl)
     assert path.exists(), f"Path {path_to_jsonl} does not exist"
-    with jsonlines.open(path_to_jsonl) as reader:
-        return list(reader)
+    with path.open("rb") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
 
 
-def parse_log_lines(jsonl_dicts: list[dict]) -> list[AbstractLogLine]:
-    """Parse jsonl dicts into LogLine objects"""
-    log_lines = []
-    for line in jsonl_dicts:
+def parse_log_lines(lines: Iterable[bytes]) -> Iterator[AbstractLogLine]:
+    """Parse jsonl lines into LogLine objects, one line at a time"""
+    for raw in lines:
+        line = json.loads(raw)
         assert isinstance(line, dict), f"Expected dict, got {type(line)}"
         log_line: AbstractLogLine
         if "final_report" in line:
@@ -112,42 +154,36 @@ def parse_log_lines(jsonl_dicts: list[dict]) -> list[AbstractLogLine]:
 
         elif "spec" in line:
             log_line = LogSpec(
-                run_id=line["spec"]["run_id"],
-                created_by=line["spec"]["created_by"],
+                run_id=sys.intern(line["spec"]["run_id"]),
+                created_by=sys.intern(line["spec"]["created_by"]),
                 created_at=line["spec"]["created_at"],
                 spec=line["spec"],
             )
 
         elif "type" in line:
             if line["type"] == "sampling":
-                # parse prompt into ChatPrompt or BasePrompt depending on datatype
-                prompt: Prompt
-                if isinstance(line["data"]["prompt"], str):
-                    prompt = BasePrompt(data=line["data"]["prompt"])
-                elif isinstance(line["data"]["prompt"], list):
-                    prompt = ChatPrompt(data=line["data"]["prompt"])
-                else:
-                    raise ValueError(
-                        f"Unknown type for prompt type: {type(line['data']['prompt'])}"
-                    )
+                # fail on a bad prompt now rather than when its page is rendered
+                prompt = line["data"]["prompt"]
+                if not isinstance(prompt, (str, list)):
+                    raise ValueError(f"Unknown type for prompt type: {type(prompt)}")
 
                 log_line = LogSampling(
-                    run_id=line["run_id"],
-                    created_by=line["created_by"],
+                    run_id=sys.intern(line["run_id"]),
+                    created_by=sys.intern(line["created_by"]),
                     created_at=line["created_at"],
                     event_id=line["event_id"],
-                    sample_id=line["sample_id"],
-                    prompt=prompt,
+                    sample_id=sys.intern(line["sample_id"]),
                     sampled=line["data"]["sampled"],
+                    raw=raw,
                 )
             elif line["type"] in ["metrics", "match"]:
                 log_line = LogMetrics(
-                    run_id=line["run_id"],
-                    created_by=line["created_by"],
+                    run_id=sys.intern(line["run_id"]),
+                    created_by=sys.intern(line["created_by"]),
                     created_at=line["created_at"],
                     event_id=line["event_id"],
-                    sample_id=line["sample_id"],
-                    data=line["data"],
+                    sample_id=sys.intern(line["sample_id"]),
+                    data={sys.intern(key): value for key, value in line["data"].items()},
                 )
             else:
                 print(f"Unknown line type: {line['type']}")
@@ -156,48 +192,41 @@ def parse_log_lines(jsonl_dicts: list[dict]) -> list[AbstractLogLine]:
         else:
             print(f"Unknown line type: {line}")
             continue
-        log_lines.append(log_line)
-    return log_lines
-
-
-def build_trajectories(log_lines: list[AbstractLogLine]):
-    """Starting with pages, modify the sorted_samples to
-    build a single trajectory for each sample_id"""
-    pages = build_pages(log_lines)
-    for page in pages:
-        seen_texts: dict[str, str] = dict()
-        samples = page.samples
-        combined_sample_messages = []
-        message_index = 0
-        for sample in reversed(samples):
-            # adding non-duplicate sample messages
-            assert isinstance(sample.prompt, ChatPrompt)
-            for message in sample.prompt.data:
-                role_with_i = f"{message_index} | {message['role']}"
-                if message["content"] in seen_texts:
-                    duplicate_message = seen_texts[message["content"]]
-                    combined_sample_messages.append(
-                        {"role": role_with_i, "content": f"[duplicate of {duplicate_message}]"}
-                    )
-                else:
-                    combined_sample_messages.append(
-                        {"role": role_with_i, "content": message["content"]}
-                    )
-                    seen_texts[message["content"]] = role_with_i
-                message_index += 1
-            # adding the sampled text as an 'assistant' message
-            assert len(sample.sampled) == 1, f"Expected 1 sampled text, got {len(sample.sampled)}"
+        yield log_line
+
+
+def build_trajectories(log_lines: Iterable[AbstractLogLine]) -> list[LogPage]:
+    """Build a single trajectory for each sample_id (see `build_trajectory`)"""
+    return [build_trajectory(page) for page in build_pages(log_lines, sort_descending=False)]
+
+
+def build_trajectory(page: LogPage) -> LogPage:
+    """Replace a page's samples, in ascending order, with a single trajectory
+
+    Each sampling event only contributes the messages after the prompt prefix it shares with
+    the previous one, plus its sampled text (see logviz.trajectory)."""
+    builder = TrajectoryBuilder()
+    combined_sample_messages = []
+    for sample in page.samples:
+        data = {"prompt": list(sample.render_prompt()), "sampled": sample.sampled}
+        for step in builder.add_event(sample.event_id, "sampling", data):
+            if step["rewind_to"] is not None:
+                combined_sample_messages.append(
+                    {
+                        "role": "note",
+                        "content": f"[context rewound to its first {step['rewind_to']} "
+                        "messages]",
+                    }
+                )
             combined_sample_messages.append(
-                {"role": f"{message_index} | assistant", "content": sample.sampled[0]}
+                {"role": f"{step['step']} | {step['role']}", "content": step["content"]}
             )
-            message_index += 1
-        # TODO (ian): work out why this is a type error
-        page.samples = [ChatPrompt(data=combined_sample_messages)]  # type: ignore
-    return pages
+    # TODO (ian): work out why this is a type error
+    return replace(page, samples=[ChatPrompt(data=combined_sample_messages)])  # type: ignore
 
 
 def build_pages(
-    log_lines: list[AbstractLogLine],
+    log_lines: Iterable[AbstractLogLine],
     sort_descending: bool = True,
 ) -> list[LogPage]:
     """Take the individual jsonl lines and group them by sample_id, then
@@ -262,33 +291,57 @@ def filter_pages(
     search_metrics: str | None = None,
     keywords: str | None = None,
 ) -> list[LogPage]:
-    target_metrics = ast.literal_eval(search_metrics) if search_metrics else None
-    target_keywords = keywords.split(",") if keywords else None
+    """The pages that match a metric and keyword search (see logviz.logviz_old.filters)"""
+    predicates = compile_metric_predicates(search_metrics)
+    matcher = compile_keywords(keywords)
     filtered_pages = []
     for page in pages:
-        include_page = True
         # check for matching metrics
-        metrics = page.metrics
-        sorted_samples = page.samples
-        if target_metrics:
-            for key in target_metrics:
-                if key not in metrics.data:
-                    print(f"Warning: {key} not in metrics")
-                else:
-                    # Only add pages that match the metric search
-                    if metrics.data[key] != target_metrics[key]:
-                        include_page = False
-        # check for matching keywords
-        if target_keywords:
-            for keyword in target_keywords:
-                if all(not sample.prompt.contains(keyword) for sample in sorted_samples):
-                    include_page = False
-
-        if include_page:
-            filtered_pages.append(page)
+        results = [predicate(page.metrics.data) for predicate in predicates]
+        if any(result is False for result in results):
+            continue
+        for predicate, result in zip(predicates, results):
+            if result is None:
+                print(f"Warning: {predicate.key} not in metrics")
+        # check for matching keywords, decoding prompts only until all of them are found
+        if matcher and not matcher.matches_all(sample.prompt.text() for sample in page.samples):
+            continue
+        filtered_pages.append(page)
     return filtered_pages
 
 
+def load_pages(
+    path_to_jsonl: str,
+    sort_descending: bool = True,
+    search_metrics: str | None = None,
+    keywords: str | None = None,
+) -> list[LogPage]:
+    """A log's pages, filtered; the result is shared between requests, so don't modify it
+
+    Pages are cached by file (and its size and modification time) and filter, so that paging
+    through a log, filtered or not, doesn't read and filter the whole file on every click."""
+    stat = os.stat(path_to_jsonl)
+    return _load_pages(
+        path_to_jsonl, stat.st_mtime_ns, stat.st_size, sort_descending, search_metrics, keywords
+    )
+
+
+@lru_cache(maxsize=PAGE_CACHE_SIZE)
+def _load_pages(
+    path_to_jsonl: str,
+    mtime_ns: int,
+    size: int,
+    sort_descending: bool,
+    search_metrics: str | None,
+    keywords: str | None,
+) -> list[LogPage]:
+    if search_metrics or keywords:
+        # a new filter on the same log reuses its unfiltered pages
+        pages = _load_pages(path_to_jsonl, mtime_ns, size, sort_descending, None, None)
+        return filter_pages(pages, search_metrics=search_metrics, keywords=keywords)
+    return build_pages(parse_log_lines(read_jsonl_lines(path_to_jsonl)), sort_descending)
+
+
 def get_lines(path: str) -> list[dict]:
     # pre-conditions
     assert os.path.exists(path)
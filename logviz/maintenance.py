@@ -0,0 +1,236 @@
+"""Database maintenance: the query planner's statistics, free pages and WAL checkpoints.
+
+Ingesting and deleting runs leaves the planner's statistics (`sqlite_stat1`) stale, or missing
+altogether, and leaves the pages of deleted rows on the freelist, where they stay part of the
+file. The maintenance tasks are:
+- `analyze`: `ANALYZE`, sampling at most `ANALYSIS_LIMIT` rows of each index
+  (`PRAGMA analysis_limit`) so that it takes about the same time however large the database;
+- `vacuum`: `PRAGMA incremental_vacuum`, which returns free pages to the file system a batch at
+  a time. Databases are created with `auto_vacuum = INCREMENTAL`; older ones are converted (and
+  defragmented) once by the full `VACUUM` of `logviz maintain`;
+- `checkpoint`: copying the write-ahead log back into the database, if it is in WAL mode.
+
+`logviz maintain` runs them all to completion. In the server, `MaintenanceScheduler` runs them
+on a thread of its own, one step at a time, and only once no request has been in flight for
+`MAINTENANCE_IDLE_SECONDS`: statistics are refreshed and the log checkpointed after the database
+has changed (`PRAGMA data_version`), and at most `MAINTENANCE_VACUUM_PAGES` pages are freed per
+step, once at least `MAINTENANCE_MIN_FREE_PAGES` are free. Steps are logged and timed in
+`/metrics`.
+"""
+import logging
+import sqlite3
+import threading
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING, Any, Optional
+
+from logviz.database import Database
+from logviz.instrumentation import (
+    DATABASE_PAGES,
+    MAINTENANCE_ERRORS_TOTAL,
+    MAINTENANCE_PAGES_FREED_TOTAL,
+    MAINTENANCE_SECONDS,
+)
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+ANALYSIS_LIMIT = 1000
+DEFAULT_IDLE_SECONDS = 10.0
+DEFAULT_VACUUM_PAGES = 1000
+DEFAULT_MIN_FREE_PAGES = 1000
+# how often the scheduler checks whether the server is idle
+POLL_SECONDS = 1.0
+# `PRAGMA auto_vacuum` value
+AUTO_VACUUM_INCREMENTAL = 2
+
+logger = logging.getLogger(__name__)
+
+
+def page_counts(conn: sqlite3.Connection) -> tuple[int, int]:
+    """The number of pages in the database file, and how many of them are free."""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    DATABASE_PAGES.set(page_count, "total")
+    DATABASE_PAGES.set(free_pages, "free")
+    return page_count, free_pages
+
+
+def analyze(conn: sqlite3.Connection, limit: int = ANALYSIS_LIMIT) -> None:
+    """Refresh the planner's statistics, from at most `limit` rows per index (0 for all)."""
+    conn.execute(f"PRAGMA analysis_limit = {int(limit)}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def incremental_vacuum(conn: sqlite3.Connection, max_pages: Optional[int] = None) -> int:
+    """Return up to `max_pages` free pages (all of them if None) to the file system; returns how
+    many were freed, which is none unless the database has incremental auto-vacuum."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return 0
+    _, free_before = page_counts(conn)
+    pages = "" if max_pages is None else f"({int(max_pages)})"
+    # each step of the statement frees a page, and `execute` would only take the first
+    conn.executescript(f"PRAGMA incremental_vacuum{pages}")
+    _, free_after = page_counts(conn)
+    MAINTENANCE_PAGES_FREED_TOTAL.inc(free_before - free_after)
+    return free_before - free_after
+
+
+def checkpoint(conn: sqlite3.Connection, mode: str = "PASSIVE") -> Optional[tuple[int, int]]:
+    """Checkpoint the write-ahead log; returns (frames in the log, frames checkpointed), or None
+    if the database isn't in WAL mode."""
+    if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+        return None
+    _, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return log_frames, checkpointed
+
+
+def vacuum(conn: sqlite3.Connection) -> None:
+    """Rebuild the database file without free pages, with incremental auto-vacuum from then on.
+
+    This rewrites the whole file (which needs as much free disk space again), and other
+    connections can't write until it has finished."""
+    conn.execute(f"PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}")
+    conn.execute("VACUUM")
+
+
+class MaintenanceScheduler:
+    """Runs maintenance steps on a background thread while the server is idle."""
+
+    def __init__(
+        self, database_uri: Any, idle_seconds: float, vacuum_pages: int, min_free_pages: int
+    ) -> None:
+        self.database_uri = database_uri
+        self.idle_seconds = idle_seconds
+        self.vacuum_pages = vacuum_pages
+        self.min_free_pages = min_free_pages
+        self._active_requests = 0
+        self._last_request = monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # `PRAGMA data_version` when statistics were last refreshed and the log checkpointed;
+        # it changes whenever another connection commits
+        self._analyzed_version: Optional[int] = None
+        self._checkpointed_version: Optional[int] = None
+
+    def request_started(self) -> None:
+        with self._lock:
+            self._active_requests += 1
+            self._last_request = monotonic()
+
+    def request_finished(self) -> None:
+        with self._lock:
+            self._active_requests -= 1
+            self._last_request = monotonic()
+
+    def is_idle(self) -> bool:
+        with self._lock:
+            return (
+                self._active_requests == 0 and monotonic() - self._last_request >= self.idle_seconds
+            )
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="logviz-maintenance", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        Database.open(self.database_uri)
+        try:
+            page_counts(Database.get_connection())
+            while not self._stopped.wait(POLL_SECONDS):
+                # one step at a time, so that a request never waits for more than one
+                while self.is_idle() and not self._stopped.is_set() and self.step():
+                    pass
+        finally:
+            Database.close()
+
+    def step(self) -> bool:
+        """Run the next maintenance task that is due, if any; returns whether one was."""
+        conn = Database.get_connection()
+        task = "status"
+        started = perf_counter()
+        try:
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._analyzed_version:
+                task = "analyze"
+                analyze(conn)
+                self._analyzed_version = data_version
+                logger.info("Refreshed the database's statistics in %.2f s", _since(started))
+            elif data_version != self._checkpointed_version:
+                task = "checkpoint"
+                result = checkpoint(conn)
+                self._checkpointed_version = data_version
+                if result is None:
+                    return False
+                logger.info("Checkpointed %d of %d WAL frames", result[1], result[0])
+            else:
+                _, free_pages = page_counts(conn)
+                if free_pages < self.min_free_pages:
+                    return False
+                task = "vacuum"
+                freed = incremental_vacuum(conn, self.vacuum_pages)
+                if freed == 0:
+                    return False
+                logger.info(
+                    "Freed %d database pages in %.2f s (%d left)",
+                    freed,
+                    _since(started),
+                    free_pages - freed,
+                )
+        except sqlite3.Error as e:
+            # most likely a long write from another process; tried again once idle
+            MAINTENANCE_ERRORS_TOTAL.inc(1, task)
+            logger.warning("Database maintenance (%s) failed: %s", task, e)
+            return False
+        MAINTENANCE_SECONDS.observe(_since(started), task)
+        return True
+
+
+class Maintenance:
+    @staticmethod
+    def init_app(app: "Flask") -> None:
+        """Track requests so that maintenance can wait for the server to be idle; the scheduler
+        itself is started by `start`, when the server is."""
+        app.config.setdefault("MAINTENANCE", True)
+        app.config.setdefault("MAINTENANCE_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)
+        app.config.setdefault("MAINTENANCE_VACUUM_PAGES", DEFAULT_VACUUM_PAGES)
+        app.config.setdefault("MAINTENANCE_MIN_FREE_PAGES", DEFAULT_MIN_FREE_PAGES)
+
+        @app.before_request
+        def track_request_start():
+            scheduler = app.extensions.get("logviz_maintenance")
+            if scheduler is not None:
+                scheduler.request_started()
+
+        @app.teardown_request
+        def track_request_end(exception=None):
+            scheduler = app.extensions.get("logviz_maintenance")
+            if scheduler is not None:
+                scheduler.request_finished()
+
+    @staticmethod
+    def start(app: "Flask") -> None:
+        if not app.config["MAINTENANCE"] or "logviz_maintenance" in app.extensions:
+            return
+        scheduler = MaintenanceScheduler(
+            app.config["DATABASE_URI"],
+            app.config["MAINTENANCE_IDLE_SECONDS"],
+            app.config["MAINTENANCE_VACUUM_PAGES"],
+            app.config["MAINTENANCE_MIN_FREE_PAGES"],
+        )
+        app.extensions["logviz_maintenance"] = scheduler
+        scheduler.start()
+
+
+def _since(started: float) -> float:
+    return perf_counter() - started
@@ -0,0 +1,89 @@
+"""Parsed and validated GraphQL documents, cached so that repeated queries skip both steps.
+
+The frontend sends the same handful of documents over and over, with run and page ids passed as
+variables, so `DocumentCache` keeps the most recently used `GRAPHQL_DOCUMENT_CACHE_SIZE`
+documents that passed the schema's validation rules, keyed by the SHA-256 of their text. Only
+the query cost rule (which depends on the variables and the runs they name) runs per request.
+
+The cache doubles as the registry of persisted queries, following Apollo's automatic persisted
+queries protocol: a client may send only a document's hash, as
+`extensions.persistedQuery.sha256Hash`, and if the document isn't registered (or has been
+evicted) it gets a `PersistedQueryNotFound` error and sends the hash again with the text, which
+registers it.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from graphql import DocumentNode, GraphQLError, GraphQLSchema, parse, validate
+from graphql_server import HttpQueryError
+
+from logviz.instrumentation import GRAPHQL_DOCUMENTS_TOTAL
+
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+
+
+class DocumentCache:
+    """An LRU cache of the documents that passed validation against a schema, by hash."""
+
+    def __init__(self, schema: GraphQLSchema, max_size: int) -> None:
+        self.schema = schema
+        self.max_size = max_size
+        self._documents: OrderedDict[str, DocumentNode] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, query: Optional[str], extensions: Any
+    ) -> tuple[Optional[DocumentNode], list[GraphQLError]]:
+        """The parsed document of a request's query or persisted query hash, or its errors."""
+        query_hash = persisted_query_hash(extensions)
+        if query is not None and not isinstance(query, str):
+            raise HttpQueryError(400, "Unexpected query type.")
+        if query_hash is None:
+            if not query:
+                raise HttpQueryError(400, "Must provide query string.")
+            query_hash = hashlib.sha256(query.encode()).hexdigest()
+        elif query and hashlib.sha256(query.encode()).hexdigest() != query_hash:
+            raise HttpQueryError(400, "The query doesn't match its persisted query hash.")
+
+        with self._lock:
+            document = self._documents.get(query_hash)
+            if document is not None:
+                self._documents.move_to_end(query_hash)
+        if document is not None:
+            GRAPHQL_DOCUMENTS_TOTAL.inc(1, "hit")
+            return document, []
+        if not query:
+            GRAPHQL_DOCUMENTS_TOTAL.inc(1, "not_found")
+            error = GraphQLError(
+                PERSISTED_QUERY_NOT_FOUND, extensions={"code": "PERSISTED_QUERY_NOT_FOUND"}
+            )
+            return None, [error]
+
+        GRAPHQL_DOCUMENTS_TOTAL.inc(1, "miss")
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+        errors = validate(self.schema, document)
+        if errors:
+            return None, errors
+        with self._lock:
+            self._documents[query_hash] = document
+            if len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document, []
+
+
+def persisted_query_hash(extensions: Any) -> Optional[str]:
+    """The document hash of a request's `persistedQuery` extension, if it has one."""
+    persisted = extensions.get("persistedQuery") if isinstance(extensions, dict) else None
+    if persisted is None:
+        return None
+    if not isinstance(persisted, dict) or persisted.get("version") != 1:
+        raise HttpQueryError(400, "Unsupported persisted query version.")
+    query_hash = persisted.get("sha256Hash")
+    if not isinstance(query_hash, str):
+        raise HttpQueryError(400, "A persisted query needs a `sha256Hash`.")
+    return query_hash.lower()
@@ -0,0 +1,187 @@
+"""Opt-in request profiling and slow-request capture.
+
+When `PROFILING` is set in the app config:
+- a request to a profiled endpoint carrying the `X-Logviz-Profile: 1` header or a `profile=1`
+  query argument is run under cProfile and its profile is stored;
+- a fraction (`PROFILE_SAMPLE_RATE`) of the remaining requests is profiled speculatively, and
+  any request slower than `SLOW_REQUEST_SECONDS` is stored whether or not it was profiled.
+
+Stored captures include the SQL statements the request executed together with the
+`EXPLAIN QUERY PLAN` output for each distinct statement. They are kept in a bounded ring
+buffer (`PROFILE_BUFFER_SIZE`) and served from `/admin/profiles`.
+"""
+import cProfile
+import datetime
+import io
+import itertools
+import pstats
+import random
+import sqlite3
+import threading
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Optional
+
+from flask import Flask, Response, current_app, g, request
+
+PROFILE_HEADER = "X-Logviz-Profile"
+PROFILED_ENDPOINTS = {"graphql", "display_run"}
+DEFAULT_SLOW_REQUEST_SECONDS = 2.0
+DEFAULT_BUFFER_SIZE = 50
+# number of distinct statements to run EXPLAIN QUERY PLAN on per capture
+MAX_EXPLAINED_STATEMENTS = 20
+PROFILE_LINES = 60
+
+# the profiles of the reader calls made for a profiled request (see `logviz.readers`), as
+# cProfile only profiles the thread that enabled it; None while the request isn't profiled
+READER_PROFILES: ContextVar[Optional[list[cProfile.Profile]]] = ContextVar(
+    "logviz_reader_profiles", default=None
+)
+
+
+class Profiler:
+    _captures: deque[dict[str, Any]] = deque(maxlen=DEFAULT_BUFFER_SIZE)
+    _lock = threading.Lock()
+    _ids = itertools.count(1)
+
+    @classmethod
+    def init_app(cls, app: Flask) -> None:
+        app.config.setdefault("PROFILING", False)
+        app.config.setdefault("SLOW_REQUEST_SECONDS", DEFAULT_SLOW_REQUEST_SECONDS)
+        app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+        app.config.setdefault("PROFILE_BUFFER_SIZE", DEFAULT_BUFFER_SIZE)
+
+        @app.before_request
+        def maybe_start_profile():
+            if not current_app.config["PROFILING"] or request.endpoint not in PROFILED_ENDPOINTS:
+                return
+            g.profile_requested = _profile_requested()
+            g.profile_started_at = perf_counter()
+            if g.profile_requested or random.random() < current_app.config["PROFILE_SAMPLE_RATE"]:
+                g.profiler = cProfile.Profile()
+                # resolvers run on reader threads, which the request's profiler doesn't see
+                g.reader_profiles = []
+                READER_PROFILES.set(g.reader_profiles)
+                g.profiler.enable()
+
+        @app.after_request
+        def maybe_capture(response: Response) -> Response:
+            started_at: Optional[float] = g.get("profile_started_at")
+            if started_at is None:
+                return response
+            duration = perf_counter() - started_at
+            profiler: Optional[cProfile.Profile] = g.pop("profiler", None)
+            if profiler is not None:
+                profiler.disable()
+                READER_PROFILES.set(None)
+            threshold = current_app.config["SLOW_REQUEST_SECONDS"]
+            if g.get("profile_requested"):
+                reason = "requested"
+            elif threshold is not None and duration >= threshold:
+                reason = "slow"
+            else:
+                return response
+            capture = _build_capture(
+                reason, duration, response, profiler, g.get("reader_profiles", [])
+            )
+            capture_id = cls._store(capture)
+            response.headers["X-Logviz-Profile-Id"] = str(capture_id)
+            return response
+
+    @classmethod
+    def _store(cls, capture: dict[str, Any]) -> int:
+        with cls._lock:
+            maxlen = current_app.config["PROFILE_BUFFER_SIZE"]
+            if cls._captures.maxlen != maxlen:
+                cls._captures = deque(cls._captures, maxlen=maxlen)
+            capture["id"] = next(cls._ids)
+            cls._captures.append(capture)
+        return int(capture["id"])
+
+    @classmethod
+    def list_captures(cls) -> list[dict[str, Any]]:
+        """Summaries of the stored captures, newest first."""
+        with cls._lock:
+            captures = list(cls._captures)
+        summary_keys = ["id", "reason", "method", "path", "endpoint", "status", "captured_at"]
+        return [
+            {
+                **{key: c[key] for key in summary_keys},
+                "duration_seconds": c["duration_seconds"],
+                "sql_queries": len(c["sql"]),
+                "has_profile": c["profile"] is not None,
+            }
+            for c in reversed(captures)
+        ]
+
+    @classmethod
+    def get_capture(cls, capture_id: int) -> Optional[dict[str, Any]]:
+        with cls._lock:
+            for capture in cls._captures:
+                if capture["id"] == capture_id:
+                    return capture
+        return None
+
+
+def _profile_requested() -> bool:
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+
+def _build_capture(
+    reason: str,
+    duration: float,
+    response: Response,
+    profiler: Optional[cProfile.Profile],
+    reader_profiles: list[cProfile.Profile],
+) -> dict[str, Any]:
+    db = g.get("db")
+    statements = getattr(getattr(db, "stats", None), "statements", [])
+    plans: dict[str, list[str]] = {}
+    sql = []
+    for statement, params, seconds in list(statements):
+        if statement not in plans and len(plans) < MAX_EXPLAINED_STATEMENTS:
+            plans[statement] = _explain(db, statement, params)
+        sql.append(
+            {
+                "sql": statement,
+                "params": repr(params),
+                "seconds": seconds,
+                "plan": plans.get(statement),
+            }
+        )
+    return {
+        "reason": reason,
+        "method": request.method,
+        "path": request.full_path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "captured_at": datetime.datetime.now().isoformat(),
+        "duration_seconds": duration,
+        "sql": sql,
+        "profile": _format_profile(profiler, reader_profiles) if profiler is not None else None,
+    }
+
+
+def _explain(db: sqlite3.Connection, statement: str, params: Any) -> list[str]:
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "DELETE", "UPDATE")):
+        return []
+    try:
+        # a plain cursor, so the EXPLAIN itself isn't recorded as one of the request's statements
+        cursor = sqlite3.Cursor(db)
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", params or ()).fetchall()
+    except sqlite3.Error as e:
+        return [f"error: {e}"]
+    # rows are (id, parent, notused, detail)
+    return [row[3] for row in rows]
+
+
+def _format_profile(profiler: cProfile.Profile, reader_profiles: list[cProfile.Profile]) -> str:
+    """The request's profile, together with those of the reader calls made for it."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    if reader_profiles:
+        stats.add(*reader_profiles)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_LINES)
+    return stream.getvalue()
@@ -0,0 +1,617 @@
+"""Every SQL statement the app runs against its database, with the query plan it should get.
+
+Whether a `Database` method is fast depends on SQLite picking an index, and a schema change can
+quietly turn a per-run search into a full scan. So each statement is registered here with the
+indexes it is expected to search. `check_plan` compares that against `EXPLAIN QUERY PLAN` and
+also flags full scans of the tables that grow with the logs (`LARGE_TABLES`) and temporary
+B-trees for sorting and grouping, unless the statement is registered as needing them.
+
+`scripts/check_query_plans.py` runs the check against a database populated with synthetic
+logs. It also installs `check_statements`, which flags any statement that isn't registered
+here, so new SQL can't skip the check. The server installs it too with `--check-queries`.
+"""
+import re
+import sqlite3
+import sys
+import threading
+from typing import Any, Optional
+
+from logviz.analytics import _SQLITE_VALUES
+from logviz.database import (
+    _ADD_FACETS,
+    _ALL_RUN_FACETS,
+    _COPY_SPEC_COLUMNS,
+    _COUNT_FACETS,
+    _SUBTRACT_FACETS,
+    RUN_FACET_COLUMNS,
+    RUN_RANGE_COLUMNS,
+    RUN_SORT_COLUMNS,
+    RUN_TABLES,
+)
+from logviz.instrumentation import set_statement_hook
+from logviz.similarity import NUM_BANDS
+
+# tables with rows per sample or per event, which a full scan reads all of
+LARGE_TABLES = frozenset(
+    {
+        "events",
+        "samples",
+        "metric_data",
+        "spec_data",
+        "final_report_data",
+        "run_stats",
+        "trajectory_steps",
+    }
+)
+# statements without a plan to check: schema changes (see `MIGRATIONS`), pragmas and
+# transaction control
+UNCHECKED_PREFIXES = (
+    "CREATE",
+    "DROP",
+    "ALTER",
+    "PRAGMA",
+    "ANALYZE",
+    "VACUUM",
+    "BEGIN",
+    "COMMIT",
+    "ROLLBACK",
+    "SAVEPOINT",
+    "RELEASE",
+)
+# a table access in a plan: "SCAN events", "SEARCH runs USING INDEX sqlite_autoindex_runs_1
+# (run_id=?)", "SCAN samples USING COVERING INDEX samples_run" (older SQLite says "TABLE")
+_PLAN_ACCESS = re.compile(
+    r"^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS (\w+))?"
+    r"(?: USING (?:COVERING )?(?:INDEX (\w+)|(?:INTEGER )?PRIMARY KEY))?"
+)
+
+
+class UnregisteredQueryError(sqlite3.ProgrammingError):
+    """Raised by a strict `check_statements` hook for a statement missing from the catalogue."""
+
+    def __init__(self, sql: str) -> None:
+        super().__init__(f"SQL statement isn't in logviz.query_catalogue: {normalize(sql)}")
+
+
+class Query:
+    """A registered statement and the plan it should get.
+
+    `searches` maps each table the statement must look up through an index to the index
+    (`PRIMARY KEY` for a rowid lookup); `scans` lists the large tables it reads all of on
+    purpose; `temp_btrees` allows sorting or grouping in a temporary B-tree. Statements built
+    from parts are registered by a representative `sql`, with `pattern` matching the rest."""
+
+    __slots__ = ("name", "sql", "searches", "scans", "temp_btrees", "pattern")
+
+    def __init__(
+        self,
+        name: str,
+        sql: str,
+        searches: Optional[dict[str, str]] = None,
+        scans: tuple[str, ...] = (),
+        temp_btrees: bool = False,
+        pattern: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.sql = sql
+        self.searches = searches or {}
+        self.scans = scans
+        self.temp_btrees = temp_btrees
+        self.pattern = None if pattern is None else re.compile(pattern)
+
+
+def normalize(sql: str) -> str:
+    """A statement with its whitespace collapsed, as statements are compared."""
+    return " ".join(sql.split())
+
+
+_RUNS_PK = "sqlite_autoindex_runs_1"
+_SPEC_PK = "sqlite_autoindex_spec_data_1"
+_FINAL_REPORT_PK = "sqlite_autoindex_final_report_data_1"
+_RUN_STATS_PK = "sqlite_autoindex_run_stats_1"
+_TRAJECTORY_PK = "sqlite_autoindex_trajectory_steps_1"
+_SIGNATURES_PK = "sqlite_autoindex_sample_signatures_1"
+_METADATA_SQL = """ SELECT runs.*, spec_data.key AS spec_key, spec_data.value AS spec_value
+                    FROM runs LEFT JOIN spec_data ON spec_data.run_id = runs.run_id
+                    AND spec_data.key IN ('completion_fns', 'eval_name', 'base_eval', 'split',
+                                          'created_at') """
+_MESSAGE_CONTENT_SQL = """ SELECT substr(content, :offset + 1, coalesce(:length, length(content)))
+                           AS content FROM (
+                               SELECT CASE WHEN json_valid(data) THEN {content_sql} END
+                               AS content FROM events
+                               WHERE run_id = :run_id AND event_id = :event_id
+                           ) """
+# the indexes each table's rows are deleted through when a run is deleted
+_RUN_TABLE_INDEXES = {
+    "events": "events_run_event",
+    "spec_data": _SPEC_PK,
+    "final_report_data": _FINAL_REPORT_PK,
+    "metric_data": "metric_data_run",
+    "run_stats": _RUN_STATS_PK,
+    "external_logs": "sqlite_autoindex_external_logs_1",
+    "ingested_files": "ingested_files_run_id",
+    "trajectory_steps": _TRAJECTORY_PK,
+    "sample_signatures": _SIGNATURES_PK,
+    "sample_bands": "sample_bands_run",
+    "samples": "samples_run",
+    "runs": _RUNS_PK,
+}
+
+QUERIES = (
+    [
+        # ingest
+        Query(
+            "ingested_file_by_hash",
+            "SELECT run_id FROM ingested_files WHERE content_hash = ?",
+            {"ingested_files": "sqlite_autoindex_ingested_files_1"},
+        ),
+        Query(
+            "insert_ingested_file",
+            "INSERT OR REPLACE INTO ingested_files (content_hash, run_id, uploaded_at) "
+            "VALUES (?, ?, ?)",
+        ),
+        Query(
+            "update_num_samples",
+            "UPDATE runs SET num_samples = "
+            "(SELECT COUNT(*) FROM samples WHERE run_id = ?) WHERE run_id = ?",
+            {"runs": _RUNS_PK, "samples": "samples_run"},
+        ),
+        Query("insert_external_log", "INSERT INTO external_logs (run_id, path) VALUES (?, ?)"),
+        Query(
+            "insert_run",
+            "INSERT INTO runs (run_id, uploaded_at, name, num_samples) VALUES (?, ?, ?, ?)",
+        ),
+        Query(
+            "copy_spec_columns",
+            _COPY_SPEC_COLUMNS + " WHERE run_id = ?",
+            {"runs": _RUNS_PK, "spec_data": _SPEC_PK},
+        ),
+        Query(
+            "add_run_facets",
+            _ADD_FACETS,
+            {"runs": _RUNS_PK},
+        ),
+        # (filling in the columns and facet counts of every run, when they are added by migration 8)
+        Query("copy_spec_columns_all", _COPY_SPEC_COLUMNS, {"spec_data": _SPEC_PK}),
+        Query("count_run_facets_all", _COUNT_FACETS, temp_btrees=True),
+        Query("insert_spec_data", "INSERT INTO spec_data (run_id, key, value) VALUES (?, ?, ?)"),
+        Query(
+            "insert_final_report_data",
+            "INSERT INTO final_report_data (run_id, key, value) VALUES (?, ?, ?)",
+        ),
+        Query(
+            "insert_run_stats",
+            "INSERT OR REPLACE INTO run_stats (run_id, key, value) VALUES (?, ?, ?)",
+        ),
+        Query(
+            "insert_metric_data",
+            "INSERT INTO metric_data (run_id, sample_id, key, value) VALUES (?, ?, ?, ?)",
+        ),
+        Query("insert_sample", "INSERT INTO samples (run_id, sample_id) VALUES (?, ?)"),
+        Query(
+            "insert_event",
+            "INSERT INTO events (run_id, sample_id, event_id, event_type, data, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+        ),
+        Query(
+            "insert_trajectory_steps",
+            "INSERT OR IGNORE INTO trajectory_steps (run_id, sample_id, step, event_id, kind, "
+            "role, content, name, function_call, rewind_to) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ),
+        Query(
+            "delete_trajectory",
+            "DELETE FROM trajectory_steps WHERE run_id = ? AND sample_id = ?",
+            {"trajectory_steps": _TRAJECTORY_PK},
+        ),
+        # runs
+        Query(
+            "external_log_path",
+            "SELECT path FROM external_logs WHERE run_id = ?",
+            {"external_logs": "sqlite_autoindex_external_logs_1"},
+        ),
+        Query("run_name", "SELECT name FROM runs WHERE run_id = ?", {"runs": _RUNS_PK}),
+        # the runs table has a row per run, so listing it is as cheap as it gets
+        Query("run_ids", "SELECT run_id FROM runs"),
+        Query("num_runs", "SELECT COUNT(*) FROM runs"),
+        Query("run", "SELECT * FROM runs WHERE run_id = ?", {"runs": _RUNS_PK}),
+        Query("runs", "SELECT * FROM runs"),
+        Query("num_samples", "SELECT num_samples FROM runs WHERE run_id = ?", {"runs": _RUNS_PK}),
+        Query(
+            "run_size",
+            """ SELECT runs.num_samples, run_stats.value AS num_events
+            FROM runs LEFT JOIN run_stats
+            ON run_stats.run_id = runs.run_id AND run_stats.key = 'num_events'
+            WHERE runs.run_id = ? """,
+            {"runs": _RUNS_PK, "run_stats": _RUN_STATS_PK},
+        ),
+        Query("metadata_list", _METADATA_SQL, {"spec_data": _SPEC_PK}),
+        Query(
+            "metadata_page",
+            _METADATA_SQL + " WHERE runs.run_id IN (?, ?)",
+            {"runs": _RUNS_PK, "spec_data": _SPEC_PK},
+            pattern=re.escape(normalize(_METADATA_SQL)) + r" WHERE runs\.run_id IN \(\?(, \?)*\)$",
+        ),
+        Query(
+            "metadata",
+            _METADATA_SQL + " WHERE runs.run_id = ?",
+            {"runs": _RUNS_PK, "spec_data": _SPEC_PK},
+        ),
+        Query("spec", "SELECT * FROM spec_data WHERE run_id = ?", {"spec_data": _SPEC_PK}),
+        # every run's spec, for the legacy full listing
+        Query("specs", "SELECT * FROM spec_data", scans=("spec_data",)),
+        Query(
+            "final_report",
+            "SELECT * FROM final_report_data WHERE run_id = ?",
+            {"final_report_data": _FINAL_REPORT_PK},
+        ),
+        Query(
+            "final_report_json",
+            "SELECT key, value FROM final_report_data WHERE run_id = ?",
+            {"final_report_data": _FINAL_REPORT_PK},
+        ),
+        Query(
+            "run_stats",
+            "SELECT key, value FROM run_stats WHERE run_id = ?",
+            {"run_stats": _RUN_STATS_PK},
+        ),
+        Query("rename_run", "UPDATE runs SET name = ? WHERE run_id = ?", {"runs": _RUNS_PK}),
+        # samples
+        Query(
+            "sample_ids",
+            "SELECT sample_id FROM samples WHERE run_id = ?",
+            {"samples": "samples_run"},
+        ),
+        Query(
+            "sample_id_for_page",
+            "SELECT sample_id FROM samples WHERE run_id = ? ORDER BY sample_id LIMIT 1 OFFSET ?",
+            {"samples": "samples_run"},
+        ),
+        Query(
+            "sample_ids_for_pages",
+            "SELECT sample_id FROM samples WHERE run_id = ? ORDER BY sample_id LIMIT ? OFFSET ?",
+            {"samples": "samples_run"},
+        ),
+        # events
+        Query(
+            "sampling_events",
+            "SELECT * FROM events WHERE run_id = ? AND sample_id = ? AND event_type = 'sampling'",
+            {"events": "events_sample"},
+        ),
+        Query(
+            "sampling_event_json",
+            """ SELECT event_id, CASE WHEN json_valid(data) THEN (
+                CASE json_type(data, '$.prompt') WHEN 'text' THEN json_object(
+                    'prompt', json_array(json_object(
+                        'role', 'prompt', 'content', json_extract(data, '$.prompt')
+                    )),
+                    'sampled', json_extract(data, '$.sampled')
+                ) ELSE data END
+            ) ELSE data END AS data
+            FROM events
+            WHERE run_id = ? AND sample_id = ? AND event_type = 'sampling'
+            ORDER BY event_id """,
+            {"events": "events_sample"},
+        ),
+        Query(
+            "sampling_event_preview_json",
+            """ SELECT event_id, CASE WHEN json_valid(data) THEN json_object(
+                'prompt', CASE json_type(data, '$.prompt') WHEN 'text' THEN json_array(
+                    json_object(
+                        'role', 'prompt',
+                        'content', substr(json_extract(data, '$.prompt'), 1, :max_chars),
+                        'name', NULL,
+                        'content_length', length(json_extract(data, '$.prompt'))
+                    )
+                ) ELSE (
+                    SELECT json_group_array(json_object(
+                        'role', json_extract(message.value, '$.role'),
+                        'content',
+                        substr(json_extract(message.value, '$.content'), 1, :max_chars),
+                        'name', json_extract(message.value, '$.name'),
+                        'content_length', length(json_extract(message.value, '$.content'))
+                    )) FROM json_each(data, '$.prompt') AS message
+                ) END,
+                'sampled', (
+                    SELECT json_group_array(substr(sampled.value, 1, :max_chars))
+                    FROM json_each(data, '$.sampled') AS sampled
+                ),
+                'sampled_lengths', (
+                    SELECT json_group_array(length(sampled.value))
+                    FROM json_each(data, '$.sampled') AS sampled
+                )
+            ) ELSE data END AS data
+            FROM events
+            WHERE run_id = :run_id AND sample_id = :sample_id AND event_type = 'sampling'
+            ORDER BY event_id """,
+            {"events": "events_sample"},
+        ),
+        Query(
+            "prompt_message_content",
+            _MESSAGE_CONTENT_SQL.format(
+                content_sql=""" CASE json_type(data, '$.prompt') WHEN 'text'
+                            THEN CASE :index WHEN 0 THEN json_extract(data, '$.prompt') END
+                            ELSE json_extract(data, '$.prompt[' || :index || '].content') END """
+            ),
+            {"events": "events_run_event"},
+        ),
+        Query(
+            "sampled_content",
+            _MESSAGE_CONTENT_SQL.format(
+                content_sql="json_extract(data, '$.sampled[' || :index || ']')"
+            ),
+            {"events": "events_run_event"},
+        ),
+        Query(
+            "events",
+            "SELECT * FROM events WHERE run_id = ? ORDER BY sample_id, event_id",
+            {"events": "events_sample"},
+        ),
+        Query(
+            "sample_event_summaries",
+            """ SELECT run_id, sample_id, COUNT(*) AS num_events,
+                   SUM(event_type = 'sampling') AS num_sampling,
+                   SUM(event_type = 'function_call') AS num_function_calls,
+                   MIN(created_at) AS first_created_at, MAX(created_at) AS last_created_at
+            FROM events WHERE run_id = ? GROUP BY sample_id ORDER BY sample_id """,
+            {"events": "events_sample"},
+        ),
+        # trajectories
+        Query(
+            "num_trajectory_steps",
+            "SELECT COUNT(*) FROM trajectory_steps WHERE run_id = ? AND sample_id = ?",
+            {"trajectory_steps": _TRAJECTORY_PK},
+        ),
+        Query(
+            "trajectory_events",
+            """ SELECT event_id, event_type, data FROM events
+            WHERE run_id = ? AND sample_id = ?
+            AND event_type IN ('sampling', 'function_call') """,
+            {"events": "events_sample"},
+        ),
+        Query(
+            "trajectory_steps",
+            """ SELECT step, event_id, kind, role, content, name, function_call, rewind_to
+            FROM trajectory_steps
+            WHERE run_id = ? AND sample_id = ? AND step > ?
+            ORDER BY step LIMIT ? """,
+            {"trajectory_steps": _TRAJECTORY_PK},
+        ),
+        Query(
+            "trajectory_step_previews",
+            """ SELECT step, event_id, kind, role,
+                substr(content, 1, ?) AS content_preview, length(content) AS content_length,
+                name, function_call, rewind_to
+            FROM trajectory_steps
+            WHERE run_id = ? AND sample_id = ? AND step > ?
+            ORDER BY step LIMIT ? """,
+            {"trajectory_steps": _TRAJECTORY_PK},
+        ),
+        # similar samples
+        Query(
+            "insert_sample_signature",
+            "INSERT OR REPLACE INTO sample_signatures (run_id, sample_id, signature) "
+            "VALUES (?, ?, ?)",
+        ),
+        Query(
+            "insert_sample_bands",
+            "INSERT OR IGNORE INTO sample_bands (bucket, run_id, sample_id) VALUES (?, ?, ?)",
+        ),
+        Query(
+            "sample_signature",
+            "SELECT signature FROM sample_signatures WHERE run_id = ? AND sample_id = ?",
+            {"sample_signatures": _SIGNATURES_PK},
+        ),
+        Query(
+            "first_sampling_event",
+            """ SELECT data FROM events
+            WHERE run_id = ? AND sample_id = ? AND event_type = 'sampling'
+            ORDER BY event_id LIMIT 1 """,
+            {"events": "events_sample"},
+        ),
+        Query(
+            "similar_sample_candidates",
+            f""" SELECT signature.run_id, signature.sample_id, signature.signature
+            FROM (
+                SELECT run_id, sample_id, COUNT(*) AS shared_bands FROM sample_bands
+                WHERE bucket IN ({", ".join("?" for _ in range(NUM_BANDS))})
+                GROUP BY run_id, sample_id ORDER BY shared_bands DESC LIMIT ?
+            ) AS candidate
+            JOIN sample_signatures AS signature
+            ON signature.run_id = candidate.run_id
+            AND signature.sample_id = candidate.sample_id """,
+            {"sample_bands": "sqlite_autoindex_sample_bands_1", "signature": _SIGNATURES_PK},
+            temp_btrees=True,
+        ),
+        # metrics
+        Query(
+            "sample_metrics",
+            "SELECT * FROM metric_data WHERE run_id = ? AND sample_id = ?",
+            {"metric_data": "metric_data_run"},
+        ),
+        Query(
+            "sample_metrics_json",
+            "SELECT key, value FROM metric_data WHERE run_id = ? AND sample_id = ?",
+            {"metric_data": "metric_data_run"},
+        ),
+        Query(
+            "metric_rows",
+            "SELECT sample_id, key, value FROM metric_data WHERE run_id = ? "
+            "ORDER BY sample_id, key",
+            {"metric_data": "metric_data_run"},
+        ),
+        # groups a run's metric rows by key, which no index orders them by; the rows are read
+        # through the run's index either way
+        Query(
+            "metric_key_types",
+            """ SELECT key, MIN(
+                CASE WHEN json_valid(value)
+                THEN json_type(value) IN ('integer', 'real', 'true', 'false', 'null')
+                ELSE value IN ('NaN', 'Infinity', '-Infinity') END
+            ) AS is_numeric
+            FROM metric_data WHERE run_id = ? GROUP BY key ORDER BY key """,
+            {"metric_data": "metric_data_run"},
+            temp_btrees=True,
+        ),
+        # cross-run aggregates without the columnar mirror (see `logviz.analytics`) read every
+        # value of a metric key, of every run
+        Query(
+            "analytics_values",
+            f""" SELECT eval_name, COUNT(DISTINCT run_id) AS num_runs, COUNT(value) AS count,
+                    AVG(value) AS mean, MIN(value) AS min, MAX(value) AS max,
+                    AVG(value * value) AS mean_square
+             FROM ({_SQLITE_VALUES}) AS metric_values
+             GROUP BY eval_name ORDER BY eval_name """,
+            scans=("metric_data", "spec_data"),
+            temp_btrees=True,
+            pattern=re.escape(normalize(_SQLITE_VALUES)),
+        ),
+        # runs the mirror has yet to rewrite, a handful at most between two syncs
+        Query("insert_analytics_pending", "INSERT INTO analytics_pending (run_id) VALUES (?)"),
+        Query("analytics_pending", "SELECT rowid, run_id FROM analytics_pending ORDER BY rowid"),
+        Query(
+            "delete_analytics_pending",
+            "DELETE FROM analytics_pending WHERE rowid <= ?",
+            {"analytics_pending": "PRIMARY KEY"},
+        ),
+    ]
+    + [
+        Query(
+            f"delete_run_{table}",
+            f"DELETE FROM {table} WHERE run_id = ?",
+            {table: _RUN_TABLE_INDEXES[table]},
+        )
+        for table in RUN_TABLES
+    ]
+)
+# the run list (see `Database.get_run_page`), read in order from the sort column's index: the
+# first page, and the pages after a cursor; filtered pages may be read from a filter column's
+# index and sorted instead
+for column in RUN_SORT_COLUMNS:
+    QUERIES += [
+        Query(
+            f"run_page_{column}",
+            f"SELECT run_id, {column} FROM runs ORDER BY {column} DESC, run_id DESC LIMIT ?",
+        ),
+        Query(
+            f"run_page_{column}_after",
+            f""" SELECT run_id, {column} FROM runs WHERE ({column}, run_id) < (?, ?)
+            ORDER BY {column} DESC, run_id DESC LIMIT ? """,
+            {"runs": f"runs_{column}"},
+            pattern=rf"^SELECT run_id, {column} FROM runs( WHERE .*)? "
+            rf"ORDER BY {column} (ASC|DESC), run_id \2 LIMIT \?$",
+        ),
+    ]
+# the run list's facets: without filters, as counted at ingest; with them, counted from the
+# filter columns' indexes (or the facet's, for the facet itself) and grouped in temporary B-trees
+QUERIES += [
+    Query(
+        "all_run_facets",
+        _ALL_RUN_FACETS,
+        {"runs": "runs_created_at"},
+    ),
+    Query(
+        "run_facets",
+        " UNION ALL ".join(
+            [
+                f"SELECT '{column}' AS facet, json_quote({column}) AS value, NULL AS max_value, "
+                f"COUNT(*) AS count FROM runs WHERE split IN (?) GROUP BY {column}"
+                for column in RUN_FACET_COLUMNS
+            ]
+            + [
+                f"SELECT '{column}', MIN({column}), MAX({column}), NULL "
+                f"FROM runs WHERE split IN (?) AND {column} > ''"
+                for column in RUN_RANGE_COLUMNS
+            ]
+        ),
+        {"runs": "runs_split"},
+        temp_btrees=True,
+        pattern=rf"^SELECT '{RUN_FACET_COLUMNS[0]}' AS facet, ",
+    ),
+]
+# deleting a run starts with its facet values (see `Database.delete_run`)
+QUERIES += [
+    Query("subtract_run_facets", _SUBTRACT_FACETS, {"runs": _RUNS_PK}),
+    Query("delete_run_facet_counts", "DELETE FROM run_facet_counts WHERE count = 0"),
+]
+
+_by_sql = {normalize(query.sql): query for query in QUERIES}
+_patterns = [(query.pattern, query) for query in QUERIES if query.pattern is not None]
+# statements already reported by a non-strict `check_statements`
+_reported: set[str] = set()
+_reported_lock = threading.Lock()
+
+
+def lookup(sql: str) -> Optional[Query]:
+    """The registered query `sql` runs, or None if it isn't registered."""
+    statement = normalize(sql)
+    query = _by_sql.get(statement)
+    if query is None:
+        query = next((q for pattern, q in _patterns if pattern.search(statement)), None)
+    return query
+
+
+def is_checked(sql: str) -> bool:
+    """Whether `sql` is a statement that has to be registered (see UNCHECKED_PREFIXES)."""
+    return not sql.lstrip().upper().startswith(UNCHECKED_PREFIXES)
+
+
+def check_statements(strict: bool = False) -> None:
+    """Flag every statement that isn't registered as it runs: raise `UnregisteredQueryError`
+    if `strict`, otherwise print each one to stderr the first time it runs."""
+
+    def check(sql: str) -> None:
+        if not is_checked(sql) or lookup(sql) is not None:
+            return
+        if strict:
+            raise UnregisteredQueryError(sql)
+        statement = normalize(sql)
+        with _reported_lock:
+            if statement in _reported:
+                return
+            _reported.add(statement)
+        print(f"Unregistered SQL statement: {statement}", file=sys.stderr)
+
+    set_statement_hook(check)
+
+
+def explain(conn: sqlite3.Connection, query: Query) -> list[str]:
+    """The `EXPLAIN QUERY PLAN` details of a registered query, with all parameters NULL."""
+    # (strftime formats have colons too, but not followed by a name)
+    names = set(re.findall(r":(\w+)", query.sql))
+    if names:
+        parameters: Any = {name: None for name in names}
+    else:
+        parameters = (None,) * query.sql.count("?")
+    # a plain cursor, so the EXPLAIN itself isn't checked or recorded
+    cursor = sqlite3.Cursor(conn)
+    rows = cursor.execute(f"EXPLAIN QUERY PLAN {query.sql}", parameters).fetchall()
+    # rows are (id, parent, notused, detail)
+    return [row[3] for row in rows]
+
+
+def check_plan(query: Query, plan: list[str]) -> list[str]:
+    """What is wrong with `plan` for `query` (nothing, if it is as registered)."""
+    problems = []
+    searched: dict[str, set[str]] = {}
+    for detail in plan:
+        if detail.startswith("USE TEMP B-TREE") and not query.temp_btrees:
+            problems.append(f"sorts in a temporary B-tree: {detail}")
+        match = _PLAN_ACCESS.match(detail)
+        if match is None:
+            continue
+        access, table, alias, index = match.groups()
+        if index is None and "PRIMARY KEY" in detail:
+            index = "PRIMARY KEY"
+        if access == "SCAN":
+            if table in LARGE_TABLES and table not in query.scans:
+                problems.append(f"scans all of {table}: {detail}")
+        else:
+            searched.setdefault(table, set()).add(index or "")
+            if alias:
+                searched.setdefault(alias, set()).add(index or "")
+    for table, index in query.searches.items():
+        if index not in searched.get(table, ()):
+            used = ", ".join(sorted(searched.get(table, ()))) or "no index"
+            problems.append(f"should search {table} using {index}, but uses {used}")
+    return problems
@@ -0,0 +1,407 @@
+"""Limits that stop a single GraphQL request from monopolising the server.
+
+Every query is statically costed during validation, before anything is executed:
+- the cost of a field is roughly the number of rows it reads, estimated from `runs.num_samples`
+  and the run's stored event count (see `FIELD_ROWS`), plus one for every selected field;
+- queries nested deeper than `GRAPHQL_MAX_DEPTH` or costing more than `GRAPHQL_MAX_COST` are
+  rejected;
+- each client (by remote address) has a budget of `GRAPHQL_CLIENT_BUDGET` cost per
+  `GRAPHQL_CLIENT_WINDOW_SECONDS`, refilled continuously, and queries beyond it are rejected.
+
+Queries that pass are executed with a deadline of `GRAPHQL_TIMEOUT_SECONDS`, enforced by a
+SQLite progress handler that interrupts whatever statement is running once it has passed, on
+the request's connection and on the reader threads' (see `logviz.readers`).
+Introspection fields (GraphiQL's schema queries) are exempt from depth and cost limits.
+
+Documents are parsed and checked against the schema's own validation rules once, and then
+served from a `DocumentCache` (see `logviz.persisted_queries`); the cost rule runs on every
+request.
+"""
+import asyncio
+import inspect
+import json
+import sqlite3
+import threading
+from functools import partial
+from time import monotonic
+from typing import Any, Awaitable, Callable, Optional
+
+from flask import Response, current_app, g, request
+from graphql import ExecutionContext, ExecutionResult, GraphQLError, execute, validate
+from graphql.language import (
+    FieldNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+    OperationType,
+    SelectionSetNode,
+)
+from graphql.pyutils import is_awaitable
+from graphql.utilities import get_operation_ast, value_from_ast_untyped
+from graphql.validation import ValidationContext, ValidationRule
+from graphql_server import (
+    GraphQLParams,
+    HttpQueryError,
+    assume_not_awaitable,
+    encode_execution_results,
+    format_error_default,
+    get_graphql_params,
+)
+from graphql_server.flask import GraphQLView
+
+from logviz.database import DEFAULT_RUN_PAGE_SIZE, MAX_RUN_PAGE_SIZE, Database
+from logviz.fast_path import MAX_PAGE_WINDOW_RADIUS
+from logviz.persisted_queries import DocumentCache
+from logviz.readers import QUERY_DEADLINE, ReaderPool, set_deadline
+from logviz.similarity import MAX_SIMILARITY_CANDIDATES
+from logviz.trajectory import DEFAULT_TIMELINE_PAGE_SIZE, MAX_TIMELINE_PAGE_SIZE
+
+# used for runs whose event count isn't known yet (their run stats haven't been computed)
+DEFAULT_EVENTS_PER_SAMPLE = 10
+
+
+class RunSize:
+    def __init__(self, num_samples: int, num_events: Optional[int]) -> None:
+        self.num_samples = num_samples
+        self.num_events = (
+            num_events if num_events is not None else num_samples * DEFAULT_EVENTS_PER_SAMPLE
+        )
+        self.events_per_sample = self.num_events / max(num_samples, 1)
+
+
+# estimated rows read by each run-level Query field, given the run's size and the arguments
+FIELD_ROWS: dict[str, Callable[[RunSize, dict], float]] = {
+    "sample_ids": lambda run, args: run.num_samples,
+    "sampling_events": lambda run, args: run.events_per_sample,
+    "all_sampling_events": lambda run, args: run.num_events,
+    "all_metrics": lambda run, args: run.num_samples,
+    "sample_page": lambda run, args: run.events_per_sample,
+    "sample_page_window": lambda run, args: run.events_per_sample
+    * (2 * min(max(args.get("radius", 1), 0), MAX_PAGE_WINDOW_RADIUS) + 1),
+    "sample_pages": lambda run, args: run.num_events,
+    # computing the stats of an older run reads all of its events
+    "run_stats": lambda run, args: run.num_events,
+    # one page of steps, or a sample's events if its trajectory has to be built first
+    "timeline": lambda run, args: max(
+        min(args.get("first") or DEFAULT_TIMELINE_PAGE_SIZE, MAX_TIMELINE_PAGE_SIZE),
+        run.events_per_sample,
+    ),
+    # the candidates' band entries and signatures, wherever they are
+    "similar_samples": lambda run, args: MAX_SIMILARITY_CANDIDATES,
+}
+# estimated rows read by each Query field that lists runs a page at a time, given the arguments;
+# their facets are counted from index entries, not rows
+RUN_PAGE_ROWS: dict[str, Callable[[dict], float]] = {
+    "runs": lambda args: min(max(args.get("first") or DEFAULT_RUN_PAGE_SIZE, 0), MAX_RUN_PAGE_SIZE),
+}
+# Query fields that read one row per run
+PER_RUN_FIELDS = {
+    "metadata_list",
+    "specs",
+    "final_reports",
+    "metric_group_by",
+    "metric_pivot",
+    "metric_timeseries",
+}
+
+
+class QueryCostEstimator:
+    """Estimates the cost and depth of operations, looking run sizes up as needed."""
+
+    def __init__(self, context: ValidationContext, variables: dict) -> None:
+        self.context = context
+        self.variables = variables
+        self._run_sizes: dict[str, Optional[RunSize]] = {}
+        self._num_runs: Optional[int] = None
+
+    def cost(self, selection_set: Optional[SelectionSetNode], is_root: bool = True) -> float:
+        total = 0.0
+        for field in self._fields(selection_set):
+            total += 1 + self.cost(field.selection_set, is_root=False)
+            if is_root:
+                total += self._rows(field)
+        return total
+
+    def depth(self, selection_set: Optional[SelectionSetNode]) -> int:
+        return max(
+            (1 + self.depth(field.selection_set) for field in self._fields(selection_set)),
+            default=0,
+        )
+
+    def _fields(self, selection_set: Optional[SelectionSetNode], seen: Optional[set] = None):
+        """The fields of a selection set, with fragments expanded and introspection skipped."""
+        if selection_set is None:
+            return
+        seen = set() if seen is None else seen
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                if not selection.name.value.startswith("__"):
+                    yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from self._fields(selection.selection_set, seen)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.context.get_fragment(name)
+                # cycles are reported by NoFragmentCyclesRule; just don't recurse forever
+                if fragment is not None and name not in seen:
+                    yield from self._fields(fragment.selection_set, seen | {name})
+
+    def _rows(self, field: FieldNode) -> float:
+        name = field.name.value
+        if name in PER_RUN_FIELDS:
+            if self._num_runs is None:
+                self._num_runs = Database.get_num_runs()
+            return self._num_runs
+        if name not in FIELD_ROWS and name not in RUN_PAGE_ROWS:
+            return 0
+        args = {
+            arg.name.value: value_from_ast_untyped(arg.value, self.variables)
+            for arg in field.arguments
+        }
+        if name in RUN_PAGE_ROWS:
+            return RUN_PAGE_ROWS[name](args)
+        run_size = self._run_size(args.get("run_id"))
+        return 0 if run_size is None else FIELD_ROWS[name](run_size, args)
+
+    def _run_size(self, run_id: Any) -> Optional[RunSize]:
+        if not isinstance(run_id, str):
+            return None
+        if run_id not in self._run_sizes:
+            size = Database.get_run_size(run_id)
+            self._run_sizes[run_id] = None if size is None else RunSize(*size)
+        return self._run_sizes[run_id]
+
+
+class ClientBudgets:
+    """Token buckets of query cost, one per client."""
+
+    def __init__(self) -> None:
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, client: str, cost: float, budget: float, window_seconds: float) -> bool:
+        """Take `cost` from the client's bucket if it has enough left."""
+        now = monotonic()
+        with self._lock:
+            available, updated_at = self._buckets.get(client, (budget, now))
+            available = min(budget, available + (now - updated_at) * budget / window_seconds)
+            if cost > available:
+                self._buckets[client] = (available, now)
+                return False
+            self._buckets[client] = (available - cost, now)
+            return True
+
+
+CLIENT_BUDGETS = ClientBudgets()
+
+
+def query_cost_rule(variables: dict, config: Any) -> type[ValidationRule]:
+    """A validation rule enforcing the configured depth, cost and client budget limits."""
+
+    class QueryCostRule(ValidationRule):
+        def __init__(self, context: ValidationContext) -> None:
+            super().__init__(context)
+            self.estimator = QueryCostEstimator(context, variables)
+
+        def enter_operation_definition(self, node: OperationDefinitionNode, *_args: Any) -> None:
+            depth = self.estimator.depth(node.selection_set)
+            if depth > config["GRAPHQL_MAX_DEPTH"]:
+                self.report_error(
+                    GraphQLError(
+                        f"Query depth {depth} exceeds the limit of {config['GRAPHQL_MAX_DEPTH']}",
+                        node,
+                    )
+                )
+                return
+            cost = self.estimator.cost(node.selection_set)
+            g.graphql_query_cost = g.get("graphql_query_cost", 0) + cost
+            if cost > config["GRAPHQL_MAX_COST"]:
+                self.report_error(
+                    GraphQLError(
+                        f"Query cost {cost:.0f} exceeds the limit of "
+                        f"{config['GRAPHQL_MAX_COST']}; ask for fewer samples or pages at a time",
+                        node,
+                    )
+                )
+            elif not CLIENT_BUDGETS.charge(
+                request.remote_addr or "unknown",
+                cost,
+                config["GRAPHQL_CLIENT_BUDGET"],
+                config["GRAPHQL_CLIENT_WINDOW_SECONDS"],
+            ):
+                self.report_error(
+                    GraphQLError(
+                        f"Query cost {cost:.0f} exceeds this client's remaining budget; "
+                        "try again later",
+                        node,
+                    )
+                )
+
+        def leave_document(self, *_args: Any) -> None:
+            # the deadline covers execution only, so costing (which reads run sizes) can't trip it
+            deadline = monotonic() + config["GRAPHQL_TIMEOUT_SECONDS"]
+            QUERY_DEADLINE.set(deadline)
+            set_deadline(Database.get_connection(), deadline)
+
+    return QueryCostRule
+
+
+class AsyncioExecutionContext(ExecutionContext):
+    """Runs queries with async resolvers from a synchronous view, in an event loop of their own.
+
+    graphql_server's Flask view executes queries synchronously, so the result of a query whose
+    resolvers are coroutines is awaited here, with independent fields awaited concurrently."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # the view tells graphql-core that nothing will be awaitable
+        self.is_awaitable = is_awaitable
+
+    def execute_operation(self, operation: OperationDefinitionNode, root_value: Any) -> Any:
+        result = super().execute_operation(operation, root_value)
+        if inspect.isawaitable(result):
+            return asyncio.run(_awaited(result))
+        return result
+
+
+class LogvizGraphQLView(GraphQLView):
+    """GraphQLView with query cost limits and an execution timeout, whose resolvers read from
+    the database on a pool of reader threads, and which caches parsed documents."""
+
+    execution_context_class = AsyncioExecutionContext
+    readers: Optional[ReaderPool] = None
+    documents: Optional[DocumentCache] = None
+
+    def get_context(self):
+        context = super().get_context()
+        context["readers"] = self.readers
+        return context
+
+    def get_validation_rules(self):
+        return [*super().get_validation_rules(), query_cost_rule(_variables(), current_app.config)]
+
+    def dispatch_request(self):
+        try:
+            # GraphiQL's page itself is rendered by graphql_server
+            if self.documents is None or (
+                request.method == "GET" and self.should_display_graphiql()
+            ):
+                response = super().dispatch_request()
+            else:
+                response = self.dispatch_query()
+        finally:
+            # set by the cost rule once the query has been validated
+            QUERY_DEADLINE.set(None)
+            set_deadline(Database.get_connection(), None)
+        if "graphql_query_cost" in g:
+            response.headers["X-Logviz-Query-Cost"] = f"{g.graphql_query_cost:.0f}"
+        return response
+
+    def dispatch_query(self) -> Response:
+        """Run a query (or a persisted query) as graphql_server would, but with its document
+        from the cache."""
+        try:
+            if request.method not in ("GET", "POST"):
+                raise HttpQueryError(
+                    405,
+                    "GraphQL only supports GET and POST requests.",
+                    headers={"Allow": "GET, POST"},
+                )
+            data = self.parse_body()
+            if not isinstance(data, dict):
+                raise HttpQueryError(400, f"GraphQL params should be a dict. Received {data!r}.")
+            params = get_graphql_params(data, request.args)
+            extensions = data.get("extensions") or request.args.get("extensions")
+            if isinstance(extensions, str):
+                try:
+                    extensions = json.loads(extensions)
+                except json.JSONDecodeError:
+                    raise HttpQueryError(400, "Extensions are invalid JSON.")
+            result = self.execute_query(params, extensions)
+        except HttpQueryError as e:
+            return Response(
+                self.encode(dict(errors=[self.format_error(GraphQLError(e.message))])),
+                status=e.status_code,
+                headers=e.headers,
+                content_type="application/json",
+            )
+        body, status_code = encode_execution_results(
+            [result],
+            format_error=self.format_error,
+            encode=partial(self.encode, pretty=bool(self.pretty or request.args.get("pretty"))),
+        )
+        return Response(body, status=status_code, content_type="application/json")
+
+    def execute_query(self, params: GraphQLParams, extensions: Any) -> ExecutionResult:
+        assert self.documents is not None
+        document, errors = self.documents.get(params.query, extensions)
+        if document is None:
+            return ExecutionResult(data=None, errors=errors)
+        if request.method == "GET":
+            operation = get_operation_ast(document, params.operation_name)
+            if operation is not None and operation.operation != OperationType.QUERY:
+                raise HttpQueryError(
+                    405,
+                    f"Can only perform a {operation.operation.value} operation "
+                    "from a POST request.",
+                    headers={"Allow": "POST"},
+                )
+        cost_rule = query_cost_rule(params.variables or {}, current_app.config)
+        errors = validate(self.schema, document, rules=[cost_rule])
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+        result = execute(
+            self.schema,
+            document,
+            root_value=self.get_root_value(),
+            context_value=self.get_context(),
+            variable_values=params.variables,
+            operation_name=params.operation_name,
+            middleware=self.get_middleware(),
+            execution_context_class=self.get_execution_context_class(),
+            is_awaitable=assume_not_awaitable,
+        )
+        # awaited by AsyncioExecutionContext
+        assert isinstance(result, ExecutionResult)
+        return result
+
+    @staticmethod
+    def format_error(error: GraphQLError) -> dict:
+        if (
+            isinstance(error.original_error, sqlite3.OperationalError)
+            and str(error.original_error) == "interrupted"
+        ):
+            error.message = (
+                f"Query exceeded the {current_app.config['GRAPHQL_TIMEOUT_SECONDS']} s time limit"
+            )
+        formatted: dict = format_error_default(error)
+        return formatted
+
+
+def init_config(config: Any) -> None:
+    config.setdefault("GRAPHQL_MAX_DEPTH", 10)
+    config.setdefault("GRAPHQL_MAX_COST", 100_000)
+    config.setdefault("GRAPHQL_CLIENT_BUDGET", 1_000_000)
+    config.setdefault("GRAPHQL_CLIENT_WINDOW_SECONDS", 60.0)
+    config.setdefault("GRAPHQL_TIMEOUT_SECONDS", 30.0)
+    config.setdefault("GRAPHQL_READER_THREADS", 4)
+    config.setdefault("GRAPHQL_DOCUMENT_CACHE_SIZE", 256)
+
+
+async def _awaited(result: Awaitable[Any]) -> Any:
+    return await result
+
+
+def _variables() -> dict:
+    """The request's GraphQL variables, from a JSON body or the query string."""
+    data = GraphQLView.parse_body()
+    variables = data.get("variables") if isinstance(data, dict) else None
+    if variables is None:
+        variables = request.args.get("variables")
+    if isinstance(variables, str):
+        try:
+            variables = json.loads(variables)
+        except json.JSONDecodeError:
+            # reported by graphql_server when it parses the request
+            return {}
+    return variables if isinstance(variables, dict) else {}
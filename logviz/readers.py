@@ -0,0 +1,98 @@
+"""Reader threads for running `Database` calls concurrently from async GraphQL resolvers.
+
+SQLite connections can't be shared between threads, so each reader thread opens its own
+connection (with `Database.open`) when it starts and keeps it. `ReaderPool.run` runs a call on
+one of them and awaits the result, so that independent fields of a query, and the per-sample
+loads within a field, can be awaited together rather than one after another. Calls keep to the
+request's deadline (see `logviz.query_limits`), and the SQL they run is added to the request's
+connection statistics, so `/metrics` and slow-request captures still see it. Calls made for a
+profiled request are profiled on their reader thread, for the request's capture to include.
+"""
+import asyncio
+import contextvars
+import cProfile
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Optional, TypeVar
+
+from logviz.database import Database
+from logviz.instrumentation import SQLStats
+from logviz.profiling import READER_PROFILES
+
+# how often (in SQLite VM instructions) the progress handler checks the deadline
+PROGRESS_HANDLER_INTERVAL = 10_000
+
+# the running GraphQL query's deadline, a `monotonic()` time, set once it has been validated
+QUERY_DEADLINE: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "logviz_query_deadline", default=None
+)
+
+RetType = TypeVar("RetType")
+
+
+def set_deadline(conn: sqlite3.Connection, deadline: Optional[float]) -> None:
+    """Make SQLite interrupt whatever statement `conn` is running once `deadline` has passed
+    (None removes the deadline)."""
+    if deadline is None:
+        conn.set_progress_handler(None, 0)
+    else:
+        # returning True from the handler makes SQLite abort the running statement
+        conn.set_progress_handler(lambda: monotonic() > deadline, PROGRESS_HANDLER_INTERVAL)
+
+
+class ReaderPool:
+    def __init__(self, database_uri: Any, num_threads: int) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_threads,
+            thread_name_prefix="logviz-reader",
+            initializer=Database.open,
+            initargs=(database_uri,),
+        )
+
+    async def run(self, f: Callable[..., RetType], *args: Any) -> RetType:
+        """`f(*args)` on a reader thread."""
+        loop = asyncio.get_running_loop()
+        # carries the deadline over to the reader thread
+        context = contextvars.copy_context()
+        result, stats, profile = await loop.run_in_executor(
+            self.executor, context.run, _call, f, args
+        )
+        # merged on the request's own thread, so its statistics never need a lock
+        Database.get_connection().stats.merge(stats)
+        profiles = READER_PROFILES.get()
+        if profile is not None and profiles is not None:
+            profiles.append(profile)
+        return result
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _call(
+    f: Callable[..., RetType], args: tuple
+) -> tuple[RetType, SQLStats, Optional[cProfile.Profile]]:
+    conn = Database.get_connection()
+    # fresh statistics for each call, to be added to those of the request it was made for
+    stats = SQLStats()
+    conn.stats = stats
+    conn.set_trace_callback(stats.trace)
+    set_deadline(conn, QUERY_DEADLINE.get())
+    profile = _start_profile() if READER_PROFILES.get() is not None else None
+    try:
+        return f(*args), stats, profile
+    finally:
+        if profile is not None:
+            profile.disable()
+        set_deadline(conn, None)
+
+
+def _start_profile() -> Optional[cProfile.Profile]:
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is active: from Python 3.12 on that's the request's, which then
+        # profiles every thread itself
+        return None
+    return profile
@@ -1,29 +1,186 @@
 import argparse
+import logging
+import os
+import sys
 from pathlib import Path
+from typing import Optional
 
-from logviz.database import Database
+# NOTE: keep module-level imports light: the non-serving subcommands must not load Flask,
+# graphene or numpy until they need them (see scripts/check_startup.py)
+from logviz.database import ON_DUPLICATE_MODES, Database
 
 
 def cli(args=None) -> None:
     if not args:
         args = parse_args()
+    if args.command is not None:
+        commands = {
+            "import": import_logs,
+            "register": register_logs,
+            "export": export,
+            "stats": stats,
+            "maintain": maintain,
+        }
+        commands[args.command](args)
+        return
     # importing here to avoid graphql if not necessary
     if args.old:
         from logviz.logviz_old.app import app as old_app
 
         app_to_run = old_app
     else:
-        from logviz.app import app
-
-        app_to_run = app
-        app_to_run.config["LOGVIZ_DIR"] = Path(args.dir).expanduser().resolve()
-        app_to_run.config["STORE_JSONL"] = args.store_jsonl
-        app_to_run.config["DATABASE_URI"] = app_to_run.config["LOGVIZ_DIR"] / "logviz.db"
-        Database.init_app(app_to_run)
+        app_to_run = configure_app(args)
     app_to_run.run(host="localhost", debug=args.debug, port=args.port)
 
 
-def parse_args() -> argparse.Namespace:
+def configure_app(args: argparse.Namespace):
+    """The app, configured from the server options and with its database initialised."""
+    from logviz.app import app
+
+    app.config["LOGVIZ_DIR"] = Path(args.dir).expanduser().resolve()
+    app.config["STORE_JSONL"] = args.store_jsonl
+    app.config["DATABASE_URI"] = app.config["LOGVIZ_DIR"] / "logviz.db"
+    app.config["PROFILING"] = args.profiling
+    app.config["SLOW_REQUEST_SECONDS"] = args.slow_request_seconds
+    app.config["PROFILE_SAMPLE_RATE"] = args.profile_sample_rate
+    app.config["COMPRESSION"] = not args.no_compression
+    app.config["MAINTENANCE"] = not args.no_maintenance
+    if args.check_queries:
+        from logviz.query_catalogue import check_statements
+
+        check_statements()
+    Database.init_app(app)
+    # the server's own messages (such as maintenance), without changing how werkzeug logs
+    logviz_logger = logging.getLogger("logviz")
+    if not logviz_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logviz_logger.addHandler(handler)
+        logviz_logger.setLevel(logging.INFO)
+    # under the debug reloader, only in the process that serves requests
+    if not args.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        from logviz.maintenance import Maintenance
+
+        Maintenance.start(app)
+    return app
+
+
+def _database_uri(args: argparse.Namespace) -> Path:
+    return Path(args.dir).expanduser().resolve() / "logviz.db"
+
+
+def import_logs(args: argparse.Namespace) -> None:
+    """Ingest log files into the database without starting the server."""
+    import datetime
+
+    from logviz.analytics import Analytics
+    from logviz.database import DuplicateRunError
+
+    Analytics.defer_writes = True
+    Database.open(_database_uri(args))
+    for path in args.files:
+        uploaded_at = datetime.datetime.now().isoformat()
+        with open(path, "rb") as f:
+            try:
+                run_id = Database.process_file(
+                    f, uploaded_at=uploaded_at, on_duplicate=args.on_duplicate
+                )
+            except DuplicateRunError as e:
+                # pipelines re-push the same logs, so this is reported rather than fatal
+                print(f"Skipped {path}: {e}", file=sys.stderr)
+                continue
+        print(f"Imported {path} as run {run_id}", file=sys.stderr)
+    Database.close()
+
+
+def register_logs(args: argparse.Namespace) -> None:
+    """Register log files to be served in place, building only their offset indexes."""
+    import datetime
+
+    from logviz.analytics import Analytics
+
+    Analytics.defer_writes = True
+    Database.open(_database_uri(args))
+    for path in args.files:
+        uploaded_at = datetime.datetime.now().isoformat()
+        run_id = Database.register_file(Path(path), uploaded_at=uploaded_at)
+        print(f"Registered {path} as run {run_id}", file=sys.stderr)
+    Database.close()
+
+
+def export(args: argparse.Namespace) -> None:
+    """Write a run from the database to a file (or stdout) without starting the server."""
+    from logviz.export import export_filename, iter_export
+
+    Database.open(_database_uri(args))
+    chunks = iter_export(args.run_id, args.format, args.table)
+    if args.output == "-":
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+    else:
+        output = Path(args.output or export_filename(args.run_id, args.format, args.table))
+        with output.open("wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        print(f"Exported run {args.run_id} to {output}", file=sys.stderr)
+    Database.close()
+
+
+def stats(args: argparse.Namespace) -> None:
+    """Print a run's aggregate statistics as JSON, or list the runs if no run is given."""
+    import json
+
+    Database.open(_database_uri(args))
+    if args.run_id is None:
+        for row in Database.get_run_ids():
+            print(row["run_id"])
+    else:
+        run_stats = Database.get_raw_run_stats(args.run_id)
+        if run_stats is None:
+            sys.exit(f"Run {args.run_id} not found")
+        print(json.dumps(run_stats, indent=2))
+    Database.close()
+
+
+def maintain(args: argparse.Namespace) -> None:
+    """Refresh the planner's statistics, reclaim free pages and checkpoint the write-ahead log."""
+    from logviz.maintenance import (
+        AUTO_VACUUM_INCREMENTAL,
+        analyze,
+        checkpoint,
+        incremental_vacuum,
+        page_counts,
+        vacuum,
+    )
+
+    conn = Database.open(_database_uri(args))
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def size(pages: int) -> str:
+        return f"{pages * page_size / 1e6:.1f} MB"
+
+    num_pages, free_pages = page_counts(conn)
+    print(f"Database: {size(num_pages)}, of which {size(free_pages)} free", file=sys.stderr)
+    analyze(conn, limit=0)
+    print("Refreshed the query planner's statistics", file=sys.stderr)
+    if args.vacuum:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            freed = incremental_vacuum(conn)
+            print(f"Freed {size(freed)}", file=sys.stderr)
+        else:
+            vacuum(conn)
+            print(
+                f"Rebuilt the database ({size(page_counts(conn)[0])}); from now on the server "
+                "frees space incrementally",
+                file=sys.stderr,
+            )
+    result = checkpoint(conn, "TRUNCATE")
+    if result is not None:
+        print(f"Checkpointed {result[1]} of {result[0]} WAL frames", file=sys.stderr)
+    Database.close()
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
     arg_parser = argparse.ArgumentParser(description="Logviz CLI")
     arg_parser.add_argument(
         "--old",
@@ -47,12 +204,121 @@ def parse_args() -> argparse.Namespace:
         help="Port to run the server on.",
         default=5001,
     )
+    arg_parser.add_argument(
+        "--profiling",
+        action="store_true",
+        help="Enable on-demand profiling (`?profile=1` or `X-Logviz-Profile: 1`) and slow-request "
+        "capture, viewable at /admin/profiles.",
+    )
+    arg_parser.add_argument(
+        "--slow-request-seconds",
+        type=float,
+        help="With --profiling, capture SQL and query plans for requests slower than this.",
+        default=2.0,
+    )
+    arg_parser.add_argument(
+        "--profile-sample-rate",
+        type=float,
+        help="With --profiling, fraction of requests to run under cProfile so that slow ones "
+        "also come with a profile.",
+        default=0.0,
+    )
+    arg_parser.add_argument(
+        "--check-queries",
+        action="store_true",
+        help="Report SQL statements that aren't in the query catalogue (see "
+        "scripts/check_query_plans.py) on stderr.",
+    )
+    arg_parser.add_argument(
+        "--no-compression",
+        action="store_true",
+        help="Don't gzip/brotli-compress responses (e.g. when behind a proxy that does).",
+    )
+    arg_parser.add_argument(
+        "--no-maintenance",
+        action="store_true",
+        help="Don't refresh statistics, free space or checkpoint the database while the server "
+        "is idle (see `logviz maintain`).",
+    )
     arg_parser.add_argument(
         "--debug",
         action="store_true",
         help="Run the server in debug mode.",
     )
-    return arg_parser.parse_args()
+
+    # subcommands; running without one starts the server
+    subparsers = arg_parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="Export a run from the database.")
+    export_parser.add_argument("run_id", type=str, help="Run to export.")
+    export_parser.add_argument(
+        "--format",
+        choices=["jsonl", "parquet", "arrow"],
+        help="Original-format JSONL of the whole run, or columnar Parquet/Arrow IPC of one table.",
+        default="jsonl",
+    )
+    export_parser.add_argument(
+        "--table",
+        choices=["metrics", "spec"],
+        help="Table to export for the columnar formats.",
+        default="metrics",
+    )
+    export_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Output path (`-` for stdout). Defaults to `<run_id>.<format>` in the current dir.",
+        default=None,
+    )
+
+    import_parser = subparsers.add_parser("import", help="Ingest log files into the database.")
+    import_parser.add_argument("files", nargs="+", type=str, help="Log files to ingest.")
+    import_parser.add_argument(
+        "--on-duplicate",
+        choices=ON_DUPLICATE_MODES,
+        help="What to do with logs of runs that are already in the database: skip them with an "
+        "error, replace the run, or add the log's samples to it.",
+        default="error",
+    )
+
+    register_parser = subparsers.add_parser(
+        "register",
+        help="Serve log files in place: index them without copying their contents into the "
+        "database. The files must stay where they are.",
+    )
+    register_parser.add_argument("files", nargs="+", type=str, help="Log files to register.")
+
+    stats_parser = subparsers.add_parser("stats", help="Print a run's aggregate statistics.")
+    stats_parser.add_argument(
+        "run_id", type=str, nargs="?", default=None, help="Run to describe (omit to list runs)."
+    )
+
+    maintain_parser = subparsers.add_parser(
+        "maintain",
+        help="Refresh the query planner's statistics, free the space of deleted runs and "
+        "checkpoint the write-ahead log.",
+    )
+    maintain_parser.add_argument(
+        "--no-vacuum",
+        dest="vacuum",
+        action="store_false",
+        help="Don't free space. Databases created by older versions are rebuilt to do so, "
+        "which needs as much free disk space as the database and blocks writes until done.",
+    )
+
+    for subparser in (
+        import_parser,
+        register_parser,
+        export_parser,
+        stats_parser,
+        maintain_parser,
+    ):
+        subparser.add_argument(
+            "--dir",
+            type=str,
+            help="Directory in which the sqlite database is stored",
+            default=argparse.SUPPRESS,
+        )
+    return arg_parser.parse_args(argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+"""Per-run aggregate statistics, computed in a single pass while a log is ingested.
+
+`RunStatsAccumulator` is fed every event and metrics line by `Database.process_file` and
+produces a flat dict of JSON-serialisable values that is stored in the `run_stats` table, so
+run summaries never have to scan `events` or `metric_data`. Numeric values are collected in
+compact arrays and summarised with NumPy at the end.
+"""
+import datetime
+import math
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Optional
+
+import numpy as np
+
+QUANTILES = {"p5": 0.05, "p25": 0.25, "p50": 0.5, "p75": 0.75, "p95": 0.95}
+HISTOGRAM_BINS = 20
+# non-numeric metrics keep counts for at most this many distinct values
+MAX_CATEGORIES = 50
+METRIC_KEY_PREFIX = "metric:"
+
+
+class RunStatsAccumulator:
+    def __init__(self) -> None:
+        self.event_types: Counter[str] = Counter()
+        self.events_per_sample: Counter[str] = Counter()
+        self.prompt_chars = array("d")
+        self.completion_chars = array("d")
+        self.first_created_at: Optional[str] = None
+        self.last_created_at: Optional[str] = None
+        self.numeric_metrics: dict[str, array] = defaultdict(lambda: array("d"))
+        self.categorical_metrics: dict[str, Counter[str]] = defaultdict(Counter)
+
+    def add_event(self, sample_id: str, event_type: str, data: Any, created_at: str) -> None:
+        self.event_types[event_type] += 1
+        self.events_per_sample[sample_id] += 1
+        self._add_created_at(created_at)
+        if event_type == "sampling" and isinstance(data, dict):
+            self.prompt_chars.append(_prompt_chars(data.get("prompt")))
+            sampled = data.get("sampled") or []
+            if isinstance(sampled, str):
+                sampled = [sampled]
+            self.completion_chars.append(sum(len(s) for s in sampled if isinstance(s, str)))
+
+    def add_metrics(self, sample_id: str, data: dict, created_at: str) -> None:
+        self.event_types["metrics"] += 1
+        self._add_created_at(created_at)
+        for key, value in data.items():
+            if isinstance(value, (bool, int, float)) and key not in self.categorical_metrics:
+                self.numeric_metrics[key].append(float(value))
+            else:
+                # once a key has a non-numeric value, treat all its values as categories
+                counts = self.categorical_metrics[key]
+                for numeric_value in self.numeric_metrics.pop(key, ()):
+                    counts[_category(numeric_value)] += 1
+                category = _category(value)
+                if category in counts or len(counts) < MAX_CATEGORIES:
+                    counts[category] += 1
+                else:
+                    counts["(other)"] += 1
+
+    def _add_created_at(self, created_at: str) -> None:
+        if self.first_created_at is None or created_at < self.first_created_at:
+            self.first_created_at = created_at
+        if self.last_created_at is None or created_at > self.last_created_at:
+            self.last_created_at = created_at
+
+    def finalize(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {
+            "num_events": sum(self.event_types.values()),
+            "event_types": dict(self.event_types),
+            "events_per_sample": describe(np.fromiter(self.events_per_sample.values(), float)),
+            "prompt_chars": describe(np.frombuffer(self.prompt_chars)),
+            "completion_chars": describe(np.frombuffer(self.completion_chars)),
+            "first_created_at": self.first_created_at,
+            "last_created_at": self.last_created_at,
+            "wall_clock_seconds": _seconds_between(self.first_created_at, self.last_created_at),
+        }
+        for key, values in self.numeric_metrics.items():
+            stats[METRIC_KEY_PREFIX + key] = {
+                "kind": "numeric",
+                **describe(np.frombuffer(values)),
+            }
+        for key, counts in self.categorical_metrics.items():
+            stats[METRIC_KEY_PREFIX + key] = {
+                "kind": "categorical",
+                "count": sum(counts.values()),
+                "value_counts": dict(counts.most_common()),
+            }
+        return stats
+
+
+def describe(values: np.ndarray) -> dict[str, Any]:
+    """Summary statistics of an array, ignoring (but counting) NaNs."""
+    nan_mask = np.isnan(values)
+    finite = values[~nan_mask]
+    description: dict[str, Any] = {
+        "count": int(values.size),
+        "nan_count": int(nan_mask.sum()),
+    }
+    if finite.size == 0:
+        return description
+    counts, edges = np.histogram(finite, bins=min(HISTOGRAM_BINS, max(1, np.unique(finite).size)))
+    description.update(
+        {
+            "mean": float(finite.mean()),
+            "std": float(finite.std()),
+            "min": float(finite.min()),
+            "max": float(finite.max()),
+            **dict(zip(QUANTILES, np.quantile(finite, list(QUANTILES.values())).tolist())),
+            "histogram_counts": counts.tolist(),
+            "histogram_edges": edges.tolist(),
+        }
+    )
+    return description
+
+
+def _prompt_chars(prompt: Any) -> int:
+    if isinstance(prompt, str):
+        return len(prompt)
+    if isinstance(prompt, list):
+        return sum(
+            len(m["content"])
+            for m in prompt
+            if isinstance(m, dict) and isinstance(m.get("content"), str)
+        )
+    return 0
+
+
+def _category(value: Any) -> str:
+    return value if isinstance(value, str) else repr(value)
+
+
+def _seconds_between(first: Optional[str], last: Optional[str]) -> Optional[float]:
+    if first is None or last is None:
+        return None
+    try:
+        delta = datetime.datetime.fromisoformat(last) - datetime.datetime.fromisoformat(first)
+    except (ValueError, TypeError):
+        # unparseable, or mixing naive and aware timestamps
+        return None
+    seconds = delta.total_seconds()
+    return seconds if math.isfinite(seconds) else None
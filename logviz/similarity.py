@@ -0,0 +1,124 @@
+"""MinHash signatures of samples' prompts, for finding near-duplicate samples across runs.
+
+A sample's text is its first prompt (the task as posed, before any completions are added to
+it), lowercased and with whitespace collapsed. Its set of 8-byte shingles is summarised by a
+signature of `SIGNATURE_SIZE` MinHash values, computed with one-permutation hashing: every
+shingle is hashed once, with NumPy over the whole text at a time, the top bits of its hash pick
+one of the signature's bins, and each bin keeps the smallest hash that falls in it (bins that
+get none borrow from the next bin that does). The fraction of equal values in two signatures
+estimates the Jaccard similarity of the two shingle sets.
+
+Signatures are split into `NUM_BANDS` bands of `ROWS_PER_BAND` values (LSH banding), and each
+band is stored as one bucket key in `sample_bands`. Samples sharing a bucket are candidates,
+which finds a pair of similarity s with probability 1 - (1 - s^ROWS_PER_BAND)^NUM_BANDS (87%
+at 0.5, 99.9% at 0.7), and candidates are then compared by their full signatures. So a lookup
+reads a few index entries per band rather than comparing against every sample.
+
+`SignatureAccumulator` is fed every event by `Database.process_file`, like
+`RunStatsAccumulator`, and returns a sample's signature the first time it sees its prompt.
+"""
+import json
+from typing import Any, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SIGNATURE_SIZE = 128
+NUM_BANDS = 32
+ROWS_PER_BAND = SIGNATURE_SIZE // NUM_BANDS
+SHINGLE_BYTES = 8
+DEFAULT_SIMILARITY_THRESHOLD = 0.5
+DEFAULT_SIMILAR_SAMPLES = 20
+MAX_SIMILAR_SAMPLES = 200
+# candidates compared by signature per lookup, those sharing the most bands first
+MAX_SIMILARITY_CANDIDATES = 1000
+
+# fixed, so that signatures computed by different processes and versions can be compared
+_rng = np.random.default_rng(20240101)
+# turns each band's values into a bucket key, differently for each band
+_BAND_MULTIPLIERS = _rng.integers(1, 2**63, (NUM_BANDS, ROWS_PER_BAND), dtype=np.uint64)
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_BYTE_SHIFTS = np.arange(SHINGLE_BYTES, dtype=np.uint64) * np.uint64(8)
+# a shingle's 32-bit hash goes to the bin given by its top bits
+_BIN_SHIFT = np.uint32(32 - (SIGNATURE_SIZE - 1).bit_length())
+_EMPTY = np.uint64(2**32)
+_BORROW_OFFSET = np.uint64(0x9E3779B9)
+
+
+class SignatureAccumulator:
+    def __init__(self, skip: Optional[set[str]] = None) -> None:
+        # samples whose signature has been computed (or that already have one)
+        self.seen: set[str] = set(skip or ())
+
+    def add_event(
+        self, sample_id: str, event_type: str, data: Any
+    ) -> Optional[tuple[bytes, list[int]]]:
+        """The (signature, bucket keys) of a sample, on its first sampling event."""
+        if event_type != "sampling" or sample_id in self.seen or not isinstance(data, dict):
+            return None
+        self.seen.add(sample_id)
+        return sample_signature(data.get("prompt"))
+
+
+def sample_signature(prompt: Any) -> Optional[tuple[bytes, list[int]]]:
+    """The (signature, bucket keys) of a prompt, or None if it has no text."""
+    text = prompt_text(prompt)
+    if not text:
+        return None
+    signature = minhash(text)
+    return signature.astype("<u4").tobytes(), band_buckets(signature)
+
+
+def prompt_text(prompt: Any) -> str:
+    """A prompt's message contents (or the prompt itself, for base models) as normalised text."""
+    if isinstance(prompt, list):
+        parts = [
+            message.get("content") if isinstance(message, dict) else message for message in prompt
+        ]
+    else:
+        parts = [prompt]
+    text = " ".join(
+        part if isinstance(part, str) else json.dumps(part) for part in parts if part is not None
+    )
+    return " ".join(text.lower().split())
+
+
+def minhash(text: str) -> np.ndarray:
+    """The MinHash signature (SIGNATURE_SIZE uint32s) of a text's set of byte shingles."""
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    if data.size < SHINGLE_BYTES:
+        data = np.pad(data, (0, SHINGLE_BYTES - data.size))
+    # each shingle's bytes packed into a uint64, then mixed down to 32 bits (uint64 arithmetic
+    # wraps around, which multiplicative hashing relies on)
+    windows = sliding_window_view(data, SHINGLE_BYTES).astype(np.uint64)
+    shingles = np.bitwise_or.reduce(windows << _BYTE_SHIFTS, axis=1)
+    hashes = ((shingles * _SHINGLE_MULTIPLIER) >> np.uint64(32)).astype(np.uint32)
+    signature = np.full(SIGNATURE_SIZE, _EMPTY, dtype=np.uint64)
+    np.minimum.at(signature, hashes >> _BIN_SHIFT, hashes)
+    # empty bins take the value of the next non-empty bin (wrapping around), offset by how far
+    # away it is, so that two signatures only agree on them if they borrowed the same way
+    filled = np.flatnonzero(signature != _EMPTY)
+    if filled.size < SIGNATURE_SIZE:
+        bins = np.arange(SIGNATURE_SIZE)
+        nearest = filled[np.searchsorted(filled, bins) % filled.size]
+        distance = (nearest - bins) % SIGNATURE_SIZE
+        signature = signature[nearest] + distance.astype(np.uint64) * _BORROW_OFFSET
+    # (truncating borrowed values to 32 bits)
+    return signature.astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray) -> list[int]:
+    """One bucket key (a signed 64-bit int, as SQLite stores them) per band of a signature."""
+    bands = signature.astype(np.uint64).reshape(NUM_BANDS, ROWS_PER_BAND)
+    keys = (bands * _BAND_MULTIPLIERS).sum(axis=1, dtype=np.uint64)
+    return [int(key) for key in keys.view(np.int64)]
+
+
+def similarities(signature: bytes, candidates: list[bytes]) -> np.ndarray:
+    """The estimated Jaccard similarity of a signature to each of the candidates'."""
+    if not candidates:
+        return np.zeros(0)
+    query = np.frombuffer(signature, dtype="<u4")
+    matrix = np.frombuffer(b"".join(candidates), dtype="<u4").reshape(len(candidates), -1)
+    agreeing: np.ndarray = (matrix == query).mean(axis=1)
+    return agreeing
@@ -1,78 +1,171 @@
-const pageQuery = `
-    query {
-        sample_page(run_id: "${run_id}", page_id: ${page_id}) {
-            run_id
-            sample_id
-            sample_metrics {
-                data
-            }
-            sampling_events {
-                event_id
-                data {
-                    prompt {
-                        role
-                        content
-                        name
-                    }
-                    sampled
-                }
-            }
-        }
-        metadata(run_id: "${run_id}") {
-            num_samples
-        }
+// pages on either side of the current one to fetch in the background, and how many pages to
+// keep in memory; navigating between cached pages doesn't touch the server
+const PREFETCH_RADIUS = 2;
+const PAGE_CACHE_SIZE = 50;
+// message contents arrive cut to PREVIEW_CHARS characters (DEFAULT_PREVIEW_CHARS on the
+// server, which builds the bootstrap), and "Show more" loads MORE_CHARS at a time
+const PREVIEW_CHARS = 2000;
+const MORE_CHARS = 100000;
+const BUTTON_CLASSES = "px-4 py-2 bg-blue-500 text-white rounded";
+const DISABLED_BUTTON_CLASSES =
+    "px-4 py-2 text-white rounded bg-gray-200 text-slate-500 border-slate-200";
+
+// page number -> sample_page, least recently used first
+const pageCache = new Map();
+// page number -> in-flight request for a window containing it
+const pendingPages = new Map();
+let currentPage = parseInt(page_id);
+let numSamples = null;
+
+// the first page comes from the bootstrap, or from the fast path if there isn't one (a
+// graphene-free endpoint with the response shape of GraphQL's sample_page)
+const initialData =
+    bootstrap !== null
+        ? Promise.resolve(bootstrap)
+        : fetch(
+              `/api/sample_page?run_id=${encodeURIComponent(run_id)}&page_id=${page_id}` +
+                  `&max_chars=${PREVIEW_CHARS}`,
+              { headers: { Accept: "application/json" } }
+          )
+              .then((response) => response.json())
+              .then((obj) => obj.data);
+
+initialData.then((data) => {
+    console.log(data);
+
+    if (!data || data.sample_page === null) {
+        return console.error(
+            `Page not found for run_id '${run_id}' and page_id '${page_id}'`
+        );
     }
+    numSamples = data.metadata.num_samples;
+    cachePage(currentPage, data.sample_page);
+    history.replaceState({ page_id: currentPage }, "");
+    renderPage(currentPage, data.sample_page);
+    prefetchAround(currentPage);
+});
 
-`;
-        // spec(run_id: "${run_id}") {
-        //     num_samples
-        // }
-    // }
-
-fetch("/graphql", {
-    method: "POST",
-    headers: {
-        "Content-Type": "application/json",
-        Accept: "application/json",
-    },
-    body: JSON.stringify({ query: pageQuery }),
-})
-    .then((response) => response.json())
-    .then((obj) => {
-        console.log(obj);
-
-        if (!obj.data || obj.data.sample_page === null) {
+window.addEventListener("popstate", (event) => {
+    if (event.state && event.state.page_id) {
+        navigateTo(event.state.page_id, false);
+    }
+});
+
+// called by the Previous/Next buttons; updates the page in place instead of reloading it
+function navigateTo(pageNumber, pushHistory = true) {
+    if (pageNumber < 1 || (numSamples !== null && pageNumber > numSamples)) {
+        return;
+    }
+    currentPage = pageNumber;
+    if (pushHistory) {
+        const url = new URL(window.location);
+        url.searchParams.set("page_id", pageNumber);
+        history.pushState({ page_id: pageNumber }, "", url);
+    }
+    getPage(pageNumber).then((page) => {
+        // the user may have moved on while this page was loading
+        if (pageNumber !== currentPage) {
+            return;
+        }
+        if (page === undefined) {
             return console.error(
-                `Page not found for run_id '${run_id}' and page_id '${page_id}'`
+                `Page not found for run_id '${run_id}' and page_id '${pageNumber}'`
             );
         }
-        const metrics = obj.data.sample_page.sample_metrics;
-        const samplingEvents = obj.data.sample_page.sampling_events;
-        const numSamples = obj.data.metadata.num_samples;
-
-        activateButtons(numSamples, page_id);
-        populateMetrics(metrics);
-        buildTables(samplingEvents);
+        renderPage(pageNumber, page);
+        prefetchAround(pageNumber);
     });
+}
+
+function renderPage(pageNumber, page) {
+    activateButtons(numSamples, pageNumber);
+    populateMetrics(page.sample_metrics);
+    document.getElementById("sample-section").replaceChildren();
+    buildTables(page.sampling_events);
+}
+
+function cachePage(pageNumber, page) {
+    pageCache.delete(pageNumber);
+    pageCache.set(pageNumber, page);
+    while (pageCache.size > PAGE_CACHE_SIZE) {
+        pageCache.delete(pageCache.keys().next().value);
+    }
+}
+
+function getPage(pageNumber) {
+    if (pageCache.has(pageNumber)) {
+        const page = pageCache.get(pageNumber);
+        cachePage(pageNumber, page);
+        return Promise.resolve(page);
+    }
+    const pending = pendingPages.get(pageNumber) || fetchWindow(pageNumber, PREFETCH_RADIUS);
+    return pending.then(() => pageCache.get(pageNumber));
+}
 
-    function activateButtons(numSamples, page_id) {
-        // TODO (ian): use proper tailwind installation to
-        // have 'disabled' styling work better
-        const prevButton = document.getElementById("prev-button");
-        const nextButton = document.getElementById("next-button");
-        console.log(`numSamples: ${numSamples}, page_id: ${page_id}`);
-        if (parseInt(page_id) === 1) {
-            prevButton.classList = "px-4 py-2 text-white rounded bg-gray-200 text-slate-500 border-slate-200"
-            prevButton.disabled = true;
+function prefetchAround(pageNumber) {
+    const lastPage = numSamples === null ? pageNumber + PREFETCH_RADIUS : numSamples;
+    const missing = [];
+    for (
+        let p = Math.max(1, pageNumber - PREFETCH_RADIUS);
+        p <= Math.min(lastPage, pageNumber + PREFETCH_RADIUS);
+        p++
+    ) {
+        if (!pageCache.has(p) && !pendingPages.has(p)) {
+            missing.push(p);
         }
-        if (parseInt(page_id) === parseInt(numSamples)) {
-            nextButton.classList = "px-4 py-2 text-white rounded bg-gray-200 text-slate-500 border-slate-200"
-            nextButton.disabled = true;
+    }
+    if (missing.length === 0) {
+        return;
+    }
+    // a single request for the smallest window covering every missing neighbour
+    const first = missing[0];
+    const last = missing[missing.length - 1];
+    fetchWindow(Math.floor((first + last) / 2), Math.ceil((last - first) / 2)).catch((error) =>
+        console.error("Error prefetching pages:", error)
+    );
+}
+
+function fetchWindow(pageNumber, radius) {
+    const request = fetch(
+        `/api/sample_page_window?run_id=${encodeURIComponent(run_id)}` +
+            `&page_id=${pageNumber}&radius=${radius}&max_chars=${PREVIEW_CHARS}`,
+        { headers: { Accept: "application/json" } }
+    )
+        .then((response) => response.json())
+        .then((obj) => {
+            obj.data.sample_page_window.forEach((page) => cachePage(page.page_id + 1, page));
+        })
+        .finally(() => {
+            for (let p = pageNumber - radius; p <= pageNumber + radius; p++) {
+                if (pendingPages.get(p) === request) {
+                    pendingPages.delete(p);
+                }
+            }
+        });
+    for (let p = pageNumber - radius; p <= pageNumber + radius; p++) {
+        if (!pendingPages.has(p)) {
+            pendingPages.set(p, request);
         }
-        // change text of page-number div to reflect current page
-        const pageNumber = document.getElementById("page-number");
-        pageNumber.innerHTML = `Page ${parseInt(page_id)} of ${numSamples}`;
     }
+    return request;
+}
+
+function activateButtons(numSamples, page_id) {
+    // TODO (ian): use proper tailwind installation to
+    // have 'disabled' styling work better
+    const prevButton = document.getElementById("prev-button");
+    const nextButton = document.getElementById("next-button");
+    console.log(`numSamples: ${numSamples}, page_id: ${page_id}`);
+    const isFirst = parseInt(page_id) === 1;
+    const isLast = parseInt(page_id) === parseInt(numSamples);
+    prevButton.classList = isFirst ? DISABLED_BUTTON_CLASSES : BUTTON_CLASSES;
+    prevButton.disabled = isFirst;
+    nextButton.classList = isLast ? DISABLED_BUTTON_CLASSES : BUTTON_CLASSES;
+    nextButton.disabled = isLast;
+    // change text of page-number div to reflect current page
+    const pageNumber = document.getElementById("page-number");
+    pageNumber.innerHTML = `Page ${parseInt(page_id)} of ${numSamples}`;
+}
 
 function populateMetrics(metrics) {
     const metricsSection = document.getElementById("metrics-section");
@@ -128,12 +221,21 @@ function generateTable(event, eventIndex) {
         const rowClass =
             (eventIndex + promptIndex) % 2 === 0 ? "bg-gray-100" : "bg-white";
         const row = createTableRow(prompt.role, prompt.content);
+        if (prompt.content_length > codePointLength(prompt.content || "")) {
+            appendShowMore(row.lastChild, event.event_id, promptIndex, prompt.content_length);
+        }
         row.classList.add(rowClass);
         tblBody.appendChild(row);
     });
 
     // add sampled row
     const sampledRow = createSampledRow(event.data.sampled);
+    if (
+        event.data.sampled_lengths &&
+        event.data.sampled.some((s, i) => event.data.sampled_lengths[i] > codePointLength(s))
+    ) {
+        appendShowFullSampled(sampledRow.lastChild, event);
+    }
     tblBody.appendChild(sampledRow);
     tbl.appendChild(tblBody);
     containerDiv.appendChild(tbl);
@@ -213,3 +315,83 @@ function toggleTableBody(event) {
         tableBody.style.display = "none";
     }
 }
+
+const messageContentQuery = `
+    query ($run_id: String!, $event_id: Int!, $index: Int!, $offset: Int, $length: Int, $sampled: Boolean) {
+        message_content(run_id: $run_id, event_id: $event_id, index: $index, offset: $offset, length: $length, sampled: $sampled)
+    }
+`;
+
+function fetchMessageContent(eventId, index, sampled, offset, length) {
+    return graphql(messageContentQuery, {
+        run_id,
+        event_id: eventId,
+        index,
+        offset,
+        length,
+        sampled,
+    }).then((obj) => obj.data.message_content);
+}
+
+// adds a button under a truncated message that loads the rest of it chunk by chunk
+function appendShowMore(contentCell, eventId, index, contentLength) {
+    const contentText = contentCell.firstChild;
+    // characters loaded so far, which is the offset of the next chunk
+    let loaded = codePointLength(contentText.data);
+    const button = document.createElement("button");
+    button.className = "block mt-2 text-blue-500 hover:underline";
+    const updateLabel = () => {
+        const remaining = contentLength - loaded;
+        button.textContent = `Show more (${remaining.toLocaleString()} more characters)`;
+    };
+    updateLabel();
+    button.addEventListener("click", () => {
+        button.disabled = true;
+        fetchMessageContent(eventId, index, false, loaded, MORE_CHARS)
+            .then((more) => {
+                contentText.appendData(more || "");
+                loaded += codePointLength(more || "");
+                if (!more || loaded >= contentLength) {
+                    button.remove();
+                } else {
+                    updateLabel();
+                    button.disabled = false;
+                }
+            })
+            .catch((error) => {
+                console.error("Error fetching message content:", error);
+                button.disabled = false;
+            });
+    });
+    contentCell.appendChild(button);
+}
+
+// sampled strings are shown together in one cell, so load all of their remainders at once
+function appendShowFullSampled(sampledCell, event) {
+    const sampledText = sampledCell.firstChild;
+    const button = document.createElement("button");
+    button.className = "block mt-2 text-blue-500 hover:underline";
+    button.textContent = "Show all";
+    button.addEventListener("click", () => {
+        button.disabled = true;
+        const { sampled, sampled_lengths } = event.data;
+        Promise.all(
+            sampled.map((s, i) =>
+                sampled_lengths[i] > codePointLength(s)
+                    ? fetchMessageContent(event.event_id, i, true, codePointLength(s), null).then(
+                          (more) => s + (more || "")
+                      )
+                    : s
+            )
+        )
+            .then((fullSampled) => {
+                sampledText.data = String(fullSampled);
+                button.remove();
+            })
+            .catch((error) => {
+                console.error("Error fetching sampled content:", error);
+                button.disabled = false;
+            });
+    });
+    sampledCell.appendChild(button);
+}
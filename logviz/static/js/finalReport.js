@@ -1,40 +1,37 @@
 const finalReportQuery = `
-    query {
-        final_report(run_id: "${run_id}") {
+    query ($run_id: String!) {
+        final_report(run_id: $run_id) {
             data
         }
     }
 `;
 console.log(finalReportQuery);
 
-fetch("/graphql", {
-    method: "POST",
-    headers: {
-        "Content-Type": "application/json",
-        Accept: "application/json",
-    },
-    body: JSON.stringify({ query: finalReportQuery }),
-})
-    .then((response) => response.json())
-    .then((obj) => {
-        console.log(obj);
+if (bootstrap !== null) {
+    renderFinalReport(bootstrap);
+} else {
+    graphql(finalReportQuery, { run_id })
+        .then((obj) => {
+            console.log(obj);
+            renderFinalReport(obj.data);
+        })
+        .catch((error) => {
+            console.error("Error fetching final_report:", error);
+        });
+}
 
-        const finalReport = obj.data.final_report;
-        const finalReportSection =
-            document.getElementById("finalReportSection");
+function renderFinalReport(data) {
+    const finalReportSection = document.getElementById("finalReportSection");
 
-        if (!obj.data || obj.data.final_report === null) {
-            console.log(`Final report not found for run_id '${run_id}'`);
-            finalReportSection.innerHTML = "<div>No final report found!</div>";
-        } else {
-            const finalReportObject = JSON5.parse(finalReport["data"]);
-            var formattedFinalReport = "";
-            for (var key in finalReportObject) {
-                formattedFinalReport += `<div class="mb-4 break-words"><strong>${key}:</strong> ${finalReportObject[key]}</div>`;
-            }
-            finalReportSection.innerHTML = formattedFinalReport;
+    if (!data || data.final_report === null) {
+        console.log(`Final report not found for run_id '${run_id}'`);
+        finalReportSection.innerHTML = "<div>No final report found!</div>";
+    } else {
+        const finalReportObject = JSON5.parse(data.final_report["data"]);
+        var formattedFinalReport = "";
+        for (var key in finalReportObject) {
+            formattedFinalReport += `<div class="mb-4 break-words"><strong>${key}:</strong> ${finalReportObject[key]}</div>`;
         }
-    })
-    .catch((error) => {
-        console.error("Error fetching final_report:", error);
-    });
+        finalReportSection.innerHTML = formattedFinalReport;
+    }
+}
@@ -0,0 +1,47 @@
+// Sends GraphQL queries as persisted queries (see logviz/persisted_queries.py): first just the
+// hash of the query, and the query itself only if the server doesn't know it yet. Queries take
+// their ids as variables, so every page sends the same few documents.
+const queryHashes = new Map();
+
+function postGraphql(body) {
+    return fetch("/graphql", {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+            Accept: "application/json",
+        },
+        body: JSON.stringify(body),
+    }).then((response) => response.json());
+}
+
+async function queryHash(query) {
+    if (!queryHashes.has(query)) {
+        const digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(query));
+        const hex = Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0"));
+        queryHashes.set(query, hex.join(""));
+    }
+    return queryHashes.get(query);
+}
+
+// lengths and offsets from the server count characters as Python and SQLite do (code points),
+// not UTF-16 code units as String.length does, which count an emoji as two
+function codePointLength(text) {
+    let length = 0;
+    for (const _ of text) {
+        length++;
+    }
+    return length;
+}
+
+async function graphql(query, variables) {
+    // hashing is only available in secure contexts (https or localhost)
+    if (!window.crypto || !crypto.subtle) {
+        return postGraphql({ query, variables });
+    }
+    const extensions = { persistedQuery: { version: 1, sha256Hash: await queryHash(query) } };
+    const obj = await postGraphql({ variables, extensions });
+    if (obj.errors && obj.errors.some((error) => error.message === "PersistedQueryNotFound")) {
+        return postGraphql({ query, variables, extensions });
+    }
+    return obj;
+}
@@ -1,6 +1,6 @@
 const metricsQuery = `
-    query {
-        sample_metrics(run_id: "${run_id}", page_id: ${page_id}) {
+    query ($run_id: String!, $page_id: Int!) {
+        sample_metrics(run_id: $run_id, page_id: $page_id) {
             sample_id
             data
         }
@@ -8,8 +8,8 @@ const metricsQuery = `
 
         `
 const specQuery = `
-    query {
-        spec(run_id: "${run_id}") {
+    query ($run_id: String!) {
+        spec(run_id: $run_id) {
             completion_fns
             base_eval
             split
@@ -18,15 +18,7 @@ const specQuery = `
     }
 `;
 
-fetch("/graphql", {
-    method: "POST",
-    headers: {
-        "Content-Type": "application/json",
-        Accept: "application/json",
-    },
-    body: JSON.stringify({ query: specQuery }),
-})
-    .then((response) => response.json())
+graphql(specQuery, { run_id })
     .then((obj) => {
         console.log(obj);
 
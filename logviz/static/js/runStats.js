@@ -0,0 +1,71 @@
+const runStatsQuery = `
+    query ($run_id: String!) {
+        run_stats(run_id: $run_id) {
+            num_events
+            wall_clock_seconds
+            events_per_sample {
+                mean
+                max
+            }
+            prompt_chars {
+                mean
+                p95
+            }
+            completion_chars {
+                mean
+                p95
+            }
+            metrics {
+                key
+                kind
+                count
+                value_counts
+                distribution {
+                    mean
+                    p5
+                    p50
+                    p95
+                    nan_count
+                }
+            }
+        }
+    }
+`;
+
+graphql(runStatsQuery, { run_id })
+    .then((obj) => {
+        console.log(obj);
+
+        const runStatsSection = document.getElementById("runStatsSection");
+        if (!obj.data || obj.data.run_stats === null) {
+            runStatsSection.innerHTML = "<div>No stats found!</div>";
+            return;
+        }
+        const stats = obj.data.run_stats;
+        const fmt = (x) => (x === null || x === undefined ? "-" : Number(x.toFixed(3)));
+
+        var formattedStats = `
+            <div class="mb-2"><strong>Events:</strong> ${stats.num_events}
+                (${fmt(stats.events_per_sample.mean)} per sample, max ${fmt(stats.events_per_sample.max)})</div>
+            <div class="mb-2"><strong>Wall clock:</strong> ${fmt(stats.wall_clock_seconds)} s</div>
+            <div class="mb-2"><strong>Prompt chars:</strong> mean ${fmt(stats.prompt_chars.mean)}, p95 ${fmt(stats.prompt_chars.p95)}</div>
+            <div class="mb-2"><strong>Completion chars:</strong> mean ${fmt(stats.completion_chars.mean)}, p95 ${fmt(stats.completion_chars.p95)}</div>
+        `;
+        stats.metrics.forEach((metric) => {
+            if (metric.kind === "numeric") {
+                const d = metric.distribution;
+                formattedStats += `<div class="mb-2 break-words"><strong>${metric.key}:</strong> mean ${fmt(d.mean)}
+                    (p5 ${fmt(d.p5)}, p50 ${fmt(d.p50)}, p95 ${fmt(d.p95)}, n=${metric.count}${d.nan_count ? `, ${d.nan_count} NaN` : ""})</div>`;
+            } else {
+                const counts = JSON5.parse(metric.value_counts);
+                const formattedCounts = Object.entries(counts)
+                    .map(([value, count]) => `${value}: ${count}`)
+                    .join(", ");
+                formattedStats += `<div class="mb-2 break-words"><strong>${metric.key}:</strong> ${formattedCounts}</div>`;
+            }
+        });
+        runStatsSection.innerHTML = formattedStats;
+    })
+    .catch((error) => {
+        console.error("Error fetching run_stats:", error);
+    });
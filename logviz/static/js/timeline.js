@@ -0,0 +1,149 @@
+// the task view: a sample's trajectory (see logviz/trajectory.py), loaded a page at a time
+const TIMELINE_PAGE_SIZE = 100;
+// step contents arrive cut to this many characters; "Show more" loads the whole step
+const TIMELINE_PREVIEW_CHARS = 2000;
+const STEP_CLASSES = {
+    message: "bg-white",
+    sampled: "bg-blue-200",
+    function_call: "bg-green-100",
+};
+
+const timelineQuery = `
+    query ($run_id: String!, $sample_id: String!, $first: Int, $after: String, $max_chars: Int) {
+        timeline(run_id: $run_id, sample_id: $sample_id, first: $first, after: $after) {
+            total_count
+            end_cursor
+            has_next_page
+            steps {
+                step
+                event_id
+                kind
+                role
+                name
+                function_call
+                rewind_to
+                content_preview(max_chars: $max_chars)
+                content_length
+            }
+        }
+    }
+`;
+
+const stepContentQuery = `
+    query ($run_id: String!, $sample_id: String!, $after: String) {
+        timeline(run_id: $run_id, sample_id: $sample_id, first: 1, after: $after) {
+            steps {
+                content
+            }
+        }
+    }
+`;
+
+let timelineCursor = null;
+
+function fetchTimeline(query, variables) {
+    return graphql(query, { run_id, sample_id, ...variables }).then((obj) => obj.data.timeline);
+}
+
+function loadTimelinePage() {
+    const moreButton = document.getElementById("timeline-more");
+    moreButton.disabled = true;
+    fetchTimeline(timelineQuery, {
+        first: TIMELINE_PAGE_SIZE,
+        after: timelineCursor,
+        max_chars: TIMELINE_PREVIEW_CHARS,
+    })
+        .then((timeline) => {
+            const section = document.getElementById("timeline-section");
+            if (timelineCursor === null) {
+                section.replaceChildren();
+            }
+            if (timeline === null) {
+                section.textContent = "No timeline found for this sample!";
+                return;
+            }
+            if (timeline.total_count === 0) {
+                section.textContent = "This sample has no sampling or function call events.";
+            }
+            timeline.steps.forEach((step) => section.appendChild(createStep(step)));
+            timelineCursor = timeline.end_cursor;
+            moreButton.disabled = false;
+            if (timeline.has_next_page) {
+                const remaining = timeline.total_count - parseInt(timeline.end_cursor) - 1;
+                moreButton.textContent = `Load more (${remaining} more steps)`;
+                moreButton.classList.remove("hidden");
+            } else {
+                moreButton.classList.add("hidden");
+            }
+        })
+        .catch((error) => {
+            console.error("Error fetching timeline:", error);
+            moreButton.disabled = false;
+        });
+}
+
+function createStep(step) {
+    const container = document.createElement("div");
+    if (step.rewind_to !== null) {
+        const divider = document.createElement("div");
+        divider.className = "my-2 text-sm text-gray-600 italic";
+        divider.textContent = `Context rewound: the prompt below keeps only the first ${step.rewind_to} messages of the previous one`;
+        container.appendChild(divider);
+    }
+    const row = document.createElement("div");
+    row.className = `my-1 p-2 rounded-md flex ${STEP_CLASSES[step.kind] || "bg-white"}`;
+
+    const label = document.createElement("div");
+    label.className = "w-48 flex-none px-2 font-semibold";
+    label.textContent = `${step.step} | ${step.kind === "sampled" ? "sampled" : step.role}`;
+    label.title = `Event ID: ${step.event_id}`;
+    row.appendChild(label);
+
+    const body = document.createElement("div");
+    body.className = "flex-grow px-2";
+    if (step.function_call !== null) {
+        const call = JSON5.parse(step.function_call);
+        const callText = document.createElement("div");
+        callText.className = "font-mono mb-2";
+        callText.textContent = `${call.name}(${JSON5.stringify(call.arguments)})`;
+        body.appendChild(callText);
+    }
+    const content = document.createElement("div");
+    content.style["white-space"] = "pre-wrap";
+    content.textContent = step.content_preview;
+    body.appendChild(content);
+    if (step.content_length > codePointLength(step.content_preview || "")) {
+        appendShowStep(body, content, step);
+    }
+    row.appendChild(body);
+    container.appendChild(row);
+    return container;
+}
+
+function appendShowStep(body, content, step) {
+    const button = document.createElement("button");
+    button.className = "block mt-2 text-blue-500 hover:underline";
+    const remaining = step.content_length - codePointLength(content.textContent);
+    button.textContent = `Show more (${remaining.toLocaleString()} more characters)`;
+    button.addEventListener("click", () => {
+        button.disabled = true;
+        // the step's own page of one, found by the cursor of the step before it
+        fetchTimeline(stepContentQuery, { after: String(step.step - 1) })
+            .then((timeline) => {
+                content.textContent = timeline.steps[0].content;
+                button.remove();
+            })
+            .catch((error) => {
+                console.error("Error fetching step content:", error);
+                button.disabled = false;
+            });
+    });
+    body.appendChild(button);
+}
+
+document.getElementById("timeline-more").addEventListener("click", loadTimelinePage);
+if (sample_id === null) {
+    document.getElementById("timeline-section").textContent = "No sample on this page!";
+} else {
+    loadTimelinePage();
+}
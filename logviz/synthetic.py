@@ -0,0 +1,148 @@
+"""Synthetic evals logs, for populating a database to benchmark or load test against.
+
+The logs have the shape of real agent evals logs: a spec line, then for each sample a
+conversation of sampling events whose prompts grow by the previous completion (and the output of
+a function call, if there was one), a match event, a metrics event, and finally the final report.
+The same seed always gives the same log.
+"""
+import datetime
+import json
+import random
+import uuid
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+WORDS = (
+    "the model should answer question with a short explanation of each step before giving "
+    "final result file output error value list function return test case input expected"
+).split()
+
+
+def synthetic_log(
+    run_id: Optional[str] = None,
+    num_samples: int = 100,
+    turns: int = 4,
+    message_words: int = 80,
+    function_calls: bool = True,
+    metrics: bool = True,
+    eval_name: str = "synthetic.dev.v0",
+    completion_fn: str = "synthetic-model",
+    seed: int = 0,
+) -> Iterator[dict]:
+    """The lines of a synthetic log, in the order evals writes them."""
+    rng = random.Random(seed)
+    run_id = run_id or uuid.UUID(int=rng.getrandbits(128)).hex[:16]
+    base_eval = eval_name.split(".")[0]
+    created_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def timestamp() -> str:
+        nonlocal created_at
+        created_at += datetime.timedelta(milliseconds=rng.randint(50, 5000))
+        return created_at.strftime("%Y-%m-%d %H:%M:%S.%f%z")
+
+    def text(num_words: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(max(num_words, 1)))
+
+    def event(sample_id: str, event_id: int, event_type: str, data: dict) -> dict:
+        return {
+            "run_id": run_id,
+            "event_id": event_id,
+            "sample_id": sample_id,
+            "type": event_type,
+            "data": data,
+            "created_by": "",
+            "created_at": timestamp(),
+        }
+
+    yield {
+        "spec": {
+            "completion_fns": [completion_fn],
+            "eval_name": eval_name,
+            "base_eval": base_eval,
+            "split": "dev",
+            "run_config": {
+                "completion_fns": [completion_fn],
+                "eval_spec": {"cls": "synthetic", "args": {}},
+                "seed": seed,
+                "max_samples": None,
+            },
+            "created_by": "",
+            "run_id": run_id,
+            "created_at": timestamp(),
+        }
+    }
+    event_id = 0
+    num_correct = 0
+    for index in range(num_samples):
+        sample_id = f"{eval_name}.{index}"
+        prompt = [
+            {"role": "system", "content": text(message_words // 2)},
+            {"role": "user", "content": text(rng.randint(message_words // 2, message_words * 2))},
+        ]
+        sampled = ""
+        for turn in range(turns):
+            sampled = text(rng.randint(message_words // 4, message_words))
+            yield event(sample_id, event_id, "sampling", {"prompt": prompt, "sampled": [sampled]})
+            event_id += 1
+            prompt = prompt + [{"role": "assistant", "content": sampled}]
+            if function_calls and turn < turns - 1:
+                output = text(rng.randint(1, message_words))
+                yield event(
+                    sample_id,
+                    event_id,
+                    "function_call",
+                    {"name": "bash", "arguments": {"cmd": text(3)}, "return_value": output},
+                )
+                event_id += 1
+                prompt = prompt + [{"role": "user", "content": output}]
+        correct = rng.random() < 0.6
+        num_correct += correct
+        yield event(
+            sample_id,
+            event_id,
+            "match",
+            {
+                "correct": correct,
+                "expected": text(2),
+                "picked": sampled.split()[0],
+                "score": round(rng.random(), 4),
+            },
+        )
+        event_id += 1
+        if metrics:
+            yield event(
+                sample_id,
+                event_id,
+                "metrics",
+                {"accuracy": float(correct), "num_turns": turns, "latency": rng.random() * 10},
+            )
+            event_id += 1
+    yield {"final_report": {"accuracy": num_correct / max(num_samples, 1)}}
+
+
+def write_synthetic_log(f: IO[str], **kwargs) -> str:
+    """Write a synthetic log (see `synthetic_log` for the options) and return its run id."""
+    run_id = ""
+    for line in synthetic_log(**kwargs):
+        if "spec" in line:
+            run_id = line["spec"]["run_id"]
+        f.write(json.dumps(line) + "\n")
+    return run_id
+
+
+def write_synthetic_logs(directory: Path, num_runs: int, seed: int = 0, **kwargs) -> list[Path]:
+    """`num_runs` logs (across a few evals and models) in `directory`, one per file."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(num_runs):
+        path = directory / f"synthetic_{seed}_{index}.jsonl"
+        with path.open("w") as f:
+            write_synthetic_log(
+                f,
+                eval_name=f"synthetic-{index % 3}.dev.v0",
+                completion_fn=f"synthetic-model-{index % 2}",
+                seed=seed * 1_000_003 + index,
+                **kwargs,
+            )
+        paths.append(path)
+    return paths
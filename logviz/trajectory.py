@@ -0,0 +1,191 @@
+"""Per-sample trajectories: an agent's whole conversation as a single ordered list of steps.
+
+Evals agents resend the conversation so far in every sampling event, so a sample's events
+mostly repeat each other. A trajectory keeps each prompt message once, at the point it first
+appeared, interleaved with the sampled completions and the function calls (with their return
+values) in event id order. `TrajectoryAccumulator` is fed every event by
+`Database.process_file`, like `RunStatsAccumulator`, and returns the new steps as they are
+found so that they can be stored in `trajectory_steps` without holding the log in memory.
+
+Each prompt is compared with the previous one by fingerprint rather than by content: every
+message is hashed once, together with its length, and chained into a running hash of the
+prompt up to it. The previous prompt's running hashes are all that is kept, so finding the
+shared prefix is a single comparison when a prompt extends the previous one (and a binary
+search when it doesn't), and no message text outlives the event it came from.
+"""
+import itertools
+import json
+from typing import Any, Iterable, Optional
+
+DEFAULT_TIMELINE_PAGE_SIZE = 100
+MAX_TIMELINE_PAGE_SIZE = 500
+
+# (role, content, name) of a prompt message
+Message = tuple[str, Optional[str], Optional[str]]
+# (content length, hash) of a prompt message
+Fingerprint = tuple[int, int]
+
+
+class TrajectoryBuilder:
+    """Turns one sample's events, fed in event id order, into trajectory steps.
+
+    Each step is a dict with:
+    - `step`: its position in the trajectory, from 0
+    - `event_id`: the event it comes from
+    - `kind`: "message" (a prompt message), "sampled" (a completion) or "function_call"
+    - `role`, `content` and `name`: the message; function calls have role "function", the
+      function's name and its return value as the content
+    - `function_call`: {"name", "arguments"} for function calls
+    - `rewind_to`: on the first step of an event whose prompt doesn't extend the previous
+      prompt (e.g. the agent truncated its context), how many of the previous prompt's
+      messages it kept
+    """
+
+    def __init__(self) -> None:
+        self.num_steps = 0
+        self.last_event_id: Optional[int] = None
+        # running hashes of the previous prompt: [i] covers its messages up to and including i
+        self._prefix_hashes: list[int] = []
+        self._sampled: set[Fingerprint] = set()
+
+    def add_event(self, event_id: int, event_type: str, data: Any) -> list[dict]:
+        """The steps an event adds to the trajectory (none for other event types)."""
+        self.last_event_id = event_id
+        if not isinstance(data, dict):
+            return []
+        if event_type == "sampling":
+            return self._add_sampling(event_id, data)
+        if event_type == "function_call":
+            function_call = {"name": data.get("name"), "arguments": data.get("arguments")}
+            return [
+                self._step(
+                    event_id,
+                    "function_call",
+                    "function",
+                    _as_text(data.get("return_value")),
+                    name=data.get("name"),
+                    function_call=function_call,
+                )
+            ]
+        return []
+
+    def _add_sampling(self, event_id: int, data: dict) -> list[dict]:
+        prompt = _prompt_messages(data.get("prompt"))
+        fingerprints = [_fingerprint(message) for message in prompt]
+        prefix_hashes = list(itertools.accumulate(fingerprints, _chain, initial=0))[1:]
+        shared = _shared_prefix_length(self._prefix_hashes, prefix_hashes)
+        new_messages = prompt[shared:]
+        rewind_to = shared if shared < len(self._prefix_hashes) else None
+        if rewind_to is None and new_messages and fingerprints[shared] in self._sampled:
+            # the previous completion, sent back as part of the conversation
+            new_messages = new_messages[1:]
+        sampled = data.get("sampled") or []
+        if isinstance(sampled, str):
+            sampled = [sampled]
+        sampled = [_as_text(s) or "" for s in sampled]
+
+        steps = [
+            self._step(event_id, "message", role, content, name=name)
+            for role, content, name in new_messages
+        ]
+        steps += [self._step(event_id, "sampled", "assistant", s) for s in sampled]
+        if steps and rewind_to is not None:
+            steps[0]["rewind_to"] = rewind_to
+        self._prefix_hashes = prefix_hashes
+        self._sampled = {_fingerprint(("assistant", s, None)) for s in sampled}
+        return steps
+
+    def _step(
+        self,
+        event_id: int,
+        kind: str,
+        role: str,
+        content: Optional[str],
+        name: Optional[str] = None,
+        function_call: Optional[dict] = None,
+    ) -> dict:
+        step = {
+            "step": self.num_steps,
+            "event_id": event_id,
+            "kind": kind,
+            "role": role,
+            "content": content,
+            "name": name,
+            "function_call": function_call,
+            "rewind_to": None,
+        }
+        self.num_steps += 1
+        return step
+
+
+class TrajectoryAccumulator:
+    """Builds the trajectory of every sample in a log while it is ingested."""
+
+    def __init__(self) -> None:
+        self.builders: dict[str, TrajectoryBuilder] = {}
+        # samples whose events weren't in event id order; rebuilt from the stored events
+        self.out_of_order: set[str] = set()
+
+    def add_event(self, sample_id: str, event_id: int, event_type: str, data: Any) -> list[dict]:
+        if sample_id in self.out_of_order:
+            return []
+        builder = self.builders.setdefault(sample_id, TrajectoryBuilder())
+        if builder.last_event_id is not None and event_id < builder.last_event_id:
+            self.out_of_order.add(sample_id)
+            del self.builders[sample_id]
+            return []
+        return builder.add_event(event_id, event_type, data)
+
+
+def build_trajectory(events: Iterable[tuple[int, str, Any]]) -> list[dict]:
+    """The trajectory of one sample from its (event_id, event_type, data) in any order."""
+    builder = TrajectoryBuilder()
+    steps = []
+    for event_id, event_type, data in sorted(events, key=lambda event: event[0]):
+        steps += builder.add_event(event_id, event_type, data)
+    return steps
+
+
+def _prompt_messages(prompt: Any) -> list[Message]:
+    """A sampling event's prompt as messages; base model prompts are a single message."""
+    if not isinstance(prompt, list):
+        return [("prompt", _as_text(prompt), None)]
+    return [
+        (
+            (message.get("role") or "", _as_text(message.get("content")), message.get("name"))
+            if isinstance(message, dict)
+            else ("prompt", _as_text(message), None)
+        )
+        for message in prompt
+    ]
+
+
+def _fingerprint(message: Message) -> Fingerprint:
+    content = message[1]
+    return (-1 if content is None else len(content), hash(message))
+
+
+def _chain(prefix_hash: int, fingerprint: Fingerprint) -> int:
+    return hash((prefix_hash, fingerprint))
+
+
+def _shared_prefix_length(previous: list[int], prompt: list[int]) -> int:
+    """How many leading messages two prompts share, given their running hashes."""
+    length = min(len(previous), len(prompt))
+    if length == 0 or previous[length - 1] == prompt[length - 1]:
+        return length
+    # running hashes match up to the first differing message and (almost surely) not after it
+    low, high = 0, length - 1
+    while low < high:
+        middle = (low + high) // 2
+        if previous[middle] == prompt[middle]:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _as_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
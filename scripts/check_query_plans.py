@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""Check the query plan of every SQL statement the app runs against the query catalogue.
+
+Builds a database in a temporary directory from `--runs` synthetic logs (ingested, appended
+to, replaced and registered, so that every write path runs), then:
+- calls every `Database` read method on it with the catalogue's statement hook installed, and
+  fails on statements that aren't registered in `logviz.query_catalogue`;
+- runs `EXPLAIN QUERY PLAN` on every registered statement and fails if it scans a large table,
+  sorts in a temporary B-tree or doesn't use the indexes it is registered with.
+
+Registered statements that never ran are listed too, as they are likely stale.
+
+Usage: ./scripts/check_query_plans.py [--runs 20] [--samples 50] [--analyze] [--verbose]
+"""
+import argparse
+import datetime
+import io
+import sys
+import tempfile
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from logviz.analytics import Analytics  # noqa: E402
+from logviz.database import RUN_SORT_COLUMNS, Database  # noqa: E402
+from logviz.instrumentation import set_statement_hook  # noqa: E402
+from logviz.maintenance import analyze  # noqa: E402
+from logviz.query_catalogue import (  # noqa: E402
+    QUERIES,
+    check_plan,
+    explain,
+    is_checked,
+    lookup,
+    normalize,
+)
+from logviz.synthetic import write_synthetic_log, write_synthetic_logs  # noqa: E402
+
+
+def synthetic_file(**kwargs) -> io.BytesIO:
+    buffer = io.StringIO()
+    write_synthetic_log(buffer, **kwargs)
+    return io.BytesIO(buffer.getvalue().encode())
+
+
+def populate(directory: Path, num_runs: int, num_samples: int) -> tuple[str, str]:
+    """Fill the database through every write path; returns (an ingested run, a registered run).
+
+    The analytics mirror's writes are deferred, as in `logviz import`, until its first query."""
+    uploaded_at = datetime.datetime.now().isoformat()
+    Analytics.defer_writes = True
+    for path in write_synthetic_logs(directory / "logs", num_runs, num_samples=num_samples):
+        with path.open("rb") as f:
+            run_id = Database.process_file(f, uploaded_at)
+    # appending rewrites the run's final report and sample count, and drops its stats
+    appended = synthetic_file(run_id=run_id, num_samples=num_samples * 2, seed=1)
+    Database.process_file(appended, uploaded_at, on_duplicate="append")
+    replaced = synthetic_file(run_id="replaced", num_samples=num_samples, seed=2)
+    Database.process_file(replaced, uploaded_at)
+    Database.process_file(
+        synthetic_file(run_id="replaced", num_samples=num_samples, seed=3),
+        uploaded_at,
+        on_duplicate="replace",
+    )
+    registered_path = directory / "registered.jsonl"
+    with registered_path.open("w") as f:
+        write_synthetic_log(f, run_id="registered", num_samples=num_samples, seed=4)
+    registered = Database.register_file(registered_path, uploaded_at)
+    Analytics.defer_writes = False
+    return run_id, registered
+
+
+def read_calls(run_id: str) -> list[tuple[str, Callable[[], object]]]:
+    """Every `Database` read, as (name, call) on the given run."""
+    sample_ids = sorted(Database.get_sample_ids(run_id))
+    sample_id = sample_ids[0]
+    event_id = Database.get_sampling_event_json(run_id, sample_id)[0][0]
+    filtered = {
+        "split": ["dev"],
+        "eval_name": ["synthetic-0.dev.v0"],
+        "created_at": ("2024-01-01T00:00:00.000", None),
+    }
+    return [
+        ("get_run_name", lambda: Database.get_run_name(run_id)),
+        ("get_run_ids", Database.get_run_ids),
+        ("get_num_samples", lambda: Database.get_num_samples(run_id)),
+        ("get_run_size", lambda: Database.get_run_size(run_id)),
+        ("get_num_runs", Database.get_num_runs),
+        ("get_sample_id_for_page", lambda: Database.get_sample_id_for_page(run_id, 3)),
+        ("get_sample_ids_for_pages", lambda: Database.get_sample_ids_for_pages(run_id, 3, 5)),
+        ("get_sampling_event_json", lambda: Database.get_sampling_event_json(run_id, sample_id)),
+        (
+            "get_sampling_event_preview_json",
+            lambda: Database.get_sampling_event_preview_json(run_id, sample_id, 100),
+        ),
+        ("get_message_content", lambda: Database.get_message_content(run_id, event_id, 1)),
+        (
+            "get_message_content (sampled)",
+            lambda: Database.get_message_content(run_id, event_id, 0, sampled=True),
+        ),
+        ("get_sample_metrics_json", lambda: Database.get_sample_metrics_json(run_id, sample_id)),
+        ("get_final_report_json", lambda: Database.get_final_report_json(run_id)),
+        ("get_metadata_json_rows", Database.get_metadata_json_rows),
+        ("get_metadata_json_rows (one)", lambda: Database.get_metadata_json_rows(run_id)),
+        (
+            "get_run_page (filtered)",
+            lambda: Database.get_run_page(filtered, "name", True, 5, ("Run", run_id)),
+        ),
+        ("get_run_facets", lambda: Database.get_run_facets({})),
+        ("get_run_facets (filtered)", lambda: Database.get_run_facets(filtered)),
+        ("get_raw_sampling_events", lambda: Database.get_raw_sampling_events(run_id, sample_id)),
+        ("get_timeline", lambda: Database.get_timeline(run_id, sample_id, -1, 10)),
+        (
+            "get_timeline (previews)",
+            lambda: Database.get_timeline(run_id, sample_id, -1, 10, preview_chars=100),
+        ),
+        (
+            "get_similar_samples",
+            lambda: Database.get_similar_samples(run_id, sample_id, 0.5, 10),
+        ),
+        # runs ingested before signatures were stored get them when first looked up
+        (
+            "get_similar_samples (unsigned)",
+            lambda: (
+                Database.get_connection().execute(
+                    "DELETE FROM sample_signatures WHERE run_id = ?", (run_id,)
+                ),
+                Database.get_similar_samples(run_id, sample_id, 0.5, 10),
+            ),
+        ),
+        # trajectories built before they were stored at ingest are rebuilt from the events
+        (
+            "get_timeline (rebuilt)",
+            lambda: (
+                Database.delete_trajectories(run_id, [sample_id]),
+                Database.get_timeline(run_id, sample_id, -1, 10),
+            ),
+        ),
+        *run_page_calls(run_id),
+        ("get_raw_specs", Database.get_raw_specs),
+        ("get_raw_spec", lambda: Database.get_raw_spec(run_id)),
+        ("get_raw_final_report", lambda: Database.get_raw_final_report(run_id)),
+        ("get_raw_sample_metrics", lambda: Database.get_raw_sample_metrics(run_id, sample_id)),
+        ("get_raw_run_stats", lambda: Database.get_raw_run_stats(run_id)),
+        ("compute_run_stats", lambda: Database.compute_run_stats(run_id)),
+        ("get_sample_event_summaries", lambda: Database.get_sample_event_summaries(run_id)),
+        ("get_metric_key_types", lambda: Database.get_metric_key_types(run_id)),
+        ("get_raw_metadata", lambda: Database.get_raw_metadata(run_id)),
+        ("get_raw_metadata_list", Database.get_raw_metadata_list),
+        ("update_name", lambda: Database.update_name(run_id, "renamed")),
+        ("metric_group_by", lambda: Analytics.group_by("accuracy", ["eval_name"], {})),
+        (
+            "metric_timeseries",
+            lambda: Analytics.timeseries("accuracy", "day", None, {"split": ["dev"]}),
+        ),
+        ("delete_run", lambda: Database.delete_run(run_id)),
+    ]
+
+
+def run_page_calls(run_id: str) -> list[tuple[str, Callable[[], object]]]:
+    """The first page of runs and the page after this run, in every sort order."""
+    calls: list[tuple[str, Callable[[], object]]] = []
+    for sort in RUN_SORT_COLUMNS:
+        _, after, _ = Database.get_run_page({"run_id": [run_id]}, sort, True, 1)
+        calls += [
+            (f"get_run_page ({sort})", partial(Database.get_run_page, {}, sort, True, 5)),
+            (
+                f"get_run_page ({sort}, after)",
+                partial(Database.get_run_page, {}, sort, True, 5, after),
+            ),
+        ]
+    return calls
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Check the plans with table statistics, as gathered by `logviz maintain`.",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Print every plan.")
+    args = parser.parse_args()
+
+    ran: set[str] = set()
+    unregistered: dict[str, str] = {}
+    current = "populate"
+
+    def record(sql: str) -> None:
+        if not is_checked(sql):
+            return
+        query = lookup(sql)
+        if query is None:
+            unregistered.setdefault(normalize(sql), current)
+        else:
+            ran.add(query.name)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        Database.open(Path(directory) / "logviz.db")
+        set_statement_hook(record)
+        try:
+            run_id, registered = populate(Path(directory), args.runs, args.samples)
+            for target in (registered, run_id):
+                for name, call in read_calls(target):
+                    current = name
+                    call()
+        finally:
+            set_statement_hook(None)
+
+        for statement, caller in sorted(unregistered.items(), key=lambda item: item[1]):
+            print(f"FAIL: unregistered statement (from {caller}): {statement}")
+            failed = True
+
+        conn = Database.get_connection()
+        if args.analyze:
+            # as the server's maintenance does
+            analyze(conn)
+        for query in QUERIES:
+            plan = explain(conn, query)
+            problems = check_plan(query, plan)
+            if args.verbose or problems:
+                print(f"{query.name}:")
+                for detail in plan:
+                    print(f"    {detail}")
+            for problem in problems:
+                print(f"  FAIL: {problem}")
+                failed = True
+        Database.close()
+
+    not_run = [query.name for query in QUERIES if query.name not in ran]
+    if not_run:
+        print(f"registered but never run: {', '.join(not_run)}")
+    print(f"{len(QUERIES)} statements checked, {len(unregistered)} unregistered")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
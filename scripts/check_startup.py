@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Check the CLI's cold-start import profile against a budget.
+
+Runs each non-serving subcommand for real, on a tiny synthetic log in a temporary directory,
+as `python -X importtime -m logviz.run <cmd> ...` in a fresh interpreter. Prints the slowest
+imports, and fails if the total import time exceeds the budget or if a command imported
+packages only the server (or another command's body) needs. The packages a command's body does
+need are reported, but not counted against the budget.
+
+Usage: ./scripts/check_startup.py [--budget-ms 150] [--top 10]
+"""
+import argparse
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from logviz.synthetic import write_synthetic_log  # noqa: E402
+
+# packages that only the server (or a specific command body) should ever load; the analytics
+# mirror's are written to by the server, after the CLI's ingest commands defer it
+FORBIDDEN_PREFIXES = (
+    "flask",
+    "werkzeug",
+    "graphene",
+    "graphql",
+    "graphql_server",
+    "numpy",
+    "duckdb",
+    "pyarrow",
+    "pandas",
+)
+# ingesting and registering compute run stats and prompt signatures (see logviz.run_stats and
+# logviz.similarity) with numpy
+ALLOWED_PREFIXES = {"import": ("numpy",), "register": ("numpy",)}
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def subcommands(directory: Path) -> list[list[str]]:
+    """Arguments of a run of each subcommand, in an order in which they all have work to do."""
+    imported = directory / "imported.jsonl"
+    registered = directory / "registered.jsonl"
+    with imported.open("w") as f:
+        run_id = write_synthetic_log(f, run_id="imported", num_samples=5)
+    with registered.open("w") as f:
+        write_synthetic_log(f, run_id="registered", num_samples=5, seed=1)
+    db = ["--dir", str(directory / "db")]
+    return [
+        ["import", *db, str(imported)],
+        ["register", *db, str(registered)],
+        ["export", *db, run_id, "--output", str(directory / "export.jsonl")],
+        ["stats", *db, run_id],
+        ["maintain", *db],
+    ]
+
+
+def profile(args: list[str]) -> list[tuple[str, int, int, int]]:
+    """(module, self us, cumulative us, depth) for each import of `logviz <args>`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "logviz.run", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for command in subcommands(Path(directory)):
+            subcommand = command[0]
+            imports = profile(command)
+            allowed = ALLOWED_PREFIXES.get(subcommand, ())
+            # top-level imports' cumulative times cover everything they pulled in
+            total_ms = sum(cum for _, _, cum, depth in imports if depth == 0) / 1000
+            needed_ms = sum(s for m, s, _, _ in imports if m.split(".")[0] in allowed) / 1000
+            total_ms -= needed_ms
+            needed = f" (and {needed_ms:.1f} ms of {', '.join(allowed)})" if needed_ms else ""
+            print(f"logviz {subcommand}: {total_ms:.1f} ms of imports{needed}")
+            top = sorted(imports, key=lambda x: -x[1])[: args.top]
+            for module, self_us, cumulative_us, _ in top:
+                print(
+                    f"    {self_us / 1000:7.2f} ms self "
+                    f"{cumulative_us / 1000:8.2f} ms cum  {module}"
+                )
+            forbidden = sorted(
+                {
+                    m
+                    for m, _, _, _ in imports
+                    if m.split(".")[0] in FORBIDDEN_PREFIXES and m.split(".")[0] not in allowed
+                },
+                key=len,
+            )
+            if forbidden:
+                print(f"  FAIL: imports server-only packages: {', '.join(forbidden[:5])}")
+                failed = True
+            if total_ms > args.budget_ms:
+                print(f"  FAIL: over the {args.budget_ms:.0f} ms budget")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
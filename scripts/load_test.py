@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+"""Load test a logviz server with simulated reviewers browsing runs while logs are uploaded.
+
+The server is first populated with `--runs` synthetic logs (see `logviz.synthetic`). Then
+`--sessions` reviewer sessions run concurrently for `--duration` seconds, each repeatedly picking
+an action from the session model and making the requests a browser makes for it, with a think
+time in between. The GraphQL queries are read out of the frontend's own HTML and JS, so they
+are exactly the ones the app sends, and are sent as persisted queries as the frontend does
+(see `logviz.persisted_queries`). Meanwhile `--uploaders` sessions each upload a new synthetic
+log every `--upload-interval` seconds.
+
+The report gives the throughput, p50/p95/p99 latency and errors of each kind of request, and
+counts SQLite lock errors ("database is locked") separately. Without `--url`, a server is
+started on a free port with a fresh database and stopped afterwards, so the whole test runs
+offline; its log is searched for lock errors too.
+
+The session model (`--session-model`, a JSON file) sets the think time range and the weight of
+each action; see `DEFAULT_SESSION_MODEL` for its format and the actions.
+
+Usage: ./scripts/load_test.py [--url http://localhost:5001] [--sessions 20] [--duration 60]
+           [--runs 10] [--samples 100] [--session-model model.json] [--json report.json]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from logviz.persisted_queries import PERSISTED_QUERY_NOT_FOUND  # noqa: E402
+from logviz.synthetic import synthetic_log  # noqa: E402
+
+LOGVIZ_DIR = Path(__file__).resolve().parent.parent / "logviz"
+# (file, name of the template literal) of each frontend query
+FRONTEND_QUERIES = {
+    "runs": ("templates/index.html", "runsQuery"),
+    "message_content": ("static/js/defaultSampleSection.js", "messageContentQuery"),
+    "spec": ("static/js/spec.js", "specQuery"),
+    "metrics_spec": ("static/js/metrics.js", "specQuery"),
+    "final_report": ("static/js/finalReport.js", "finalReportQuery"),
+    "run_stats": ("static/js/runStats.js", "runStatsQuery"),
+    "timeline": ("static/js/timeline.js", "timelineQuery"),
+}
+# as in index.html, defaultSampleSection.js and timeline.js
+RUNS_PAGE_SIZE = 50
+PREFETCH_RADIUS = 2
+PREVIEW_CHARS = 2000
+MORE_CHARS = 100000
+TIMELINE_PAGE_SIZE = 100
+DEFAULT_SESSION_MODEL: dict[str, Any] = {
+    # seconds a reviewer waits between actions, drawn uniformly from this range
+    "think_seconds": [0.5, 2.0],
+    # relative frequency of each action:
+    # - home: the run list (`/`, then the first page of runs it loads)
+    # - filter_runs: narrowing the run list to one eval, and sorting it by name
+    # - open_run: a run's first page, with the requests its scripts make (run stats, the spec
+    #   for the metrics table, prefetching the pages around it)
+    # - next_page: moving on through the run's samples, prefetching as the browser does
+    # - show_more: loading the rest of a truncated message
+    # - page_graphql: a page without its embedded data, loaded from the page fast path, with
+    #   the spec and final report GraphQL queries
+    # - task_view: a sample's timeline
+    "actions": {
+        "home": 1,
+        "filter_runs": 0.5,
+        "open_run": 2,
+        "next_page": 8,
+        "show_more": 1,
+        "page_graphql": 1,
+        "task_view": 1,
+    },
+}
+LOCK_ERROR = b"database is locked"
+
+
+class Stats:
+    """Latencies and errors of the requests made by all sessions."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.lock_errors = 0
+        self.error_samples: dict[str, str] = {}
+
+    def record(self, label: str, seconds: float, error: Optional[str], locked: bool) -> None:
+        with self.lock:
+            self.latencies[label].append(seconds)
+            if error is not None:
+                self.errors[label] += 1
+                self.error_samples.setdefault(label, error)
+            if locked:
+                self.lock_errors += 1
+
+
+class Client:
+    def __init__(self, url: str, stats: Optional[Stats]) -> None:
+        self.url = url.rstrip("/")
+        self.stats = stats
+
+    def request(
+        self,
+        label: str,
+        path: str,
+        body: Optional[bytes] = None,
+        content_type: Optional[str] = None,
+        expected: tuple[int, ...] = (200,),
+    ) -> Optional[bytes]:
+        """Make a request, recording its latency; returns the (decompressed) body."""
+        headers = {"Accept-Encoding": "gzip"}
+        if content_type is not None:
+            headers["Content-Type"] = content_type
+        req = urllib.request.Request(self.url + path, data=body, headers=headers)
+        error: Optional[str] = None
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                status = response.status
+                data = response.read()
+                encoding = response.headers.get("Content-Encoding")
+        except urllib.error.HTTPError as e:
+            status, data, encoding = e.code, e.read(), e.headers.get("Content-Encoding")
+        except OSError as e:
+            status, data, encoding = 0, b"", None
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        if error is None and status not in expected:
+            error = f"HTTP {status}: {data[:200]!r}"
+        if error is None and label.startswith("graphql "):
+            errors = json.loads(data).get("errors")
+            # (the query is sent again in full)
+            if errors and errors[0].get("message") != PERSISTED_QUERY_NOT_FOUND:
+                error = errors[0].get("message", str(errors[0]))
+        if self.stats is not None:
+            self.stats.record(label, seconds, error, LOCK_ERROR in data)
+        return data if error is None else None
+
+    def get(self, label: str, path: str, **params: Any) -> Optional[bytes]:
+        query = urllib.parse.urlencode(params)
+        return self.request(label, f"{path}?{query}" if query else path)
+
+    def graphql(self, name: str, query: str, variables: Optional[dict] = None) -> Optional[dict]:
+        """Send a query as a persisted query, and in full if the server doesn't have it yet."""
+        query_hash = hashlib.sha256(query.encode()).hexdigest()
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash}}
+        body = json.dumps({"variables": variables, "extensions": extensions}).encode()
+        # (an unknown hash is a 400, like any query that can't be run)
+        data = self.request(f"graphql {name}", "/graphql", body, "application/json", (200, 400))
+        if data is None:
+            return None
+        result = json.loads(data)
+        if any(
+            error.get("message") == PERSISTED_QUERY_NOT_FOUND for error in result.get("errors", [])
+        ):
+            body = json.dumps(
+                {"query": query, "variables": variables, "extensions": extensions}
+            ).encode()
+            data = self.request(f"graphql {name}", "/graphql", body, "application/json")
+            if data is None:
+                return None
+            result = json.loads(data)
+        graphql_data: Optional[dict] = result["data"]
+        return graphql_data
+
+    def upload(
+        self, label: str, log: bytes, filename: str, expected: tuple[int, ...] = (200,)
+    ) -> Optional[bytes]:
+        boundary = uuid.uuid4().hex
+        body = b"".join(
+            [
+                f"--{boundary}\r\n".encode(),
+                b'Content-Disposition: form-data; name="files[]"; '
+                + f'filename="{filename}"\r\n'.encode(),
+                b"Content-Type: application/octet-stream\r\n\r\n",
+                log,
+                f"\r\n--{boundary}--\r\n".encode(),
+            ]
+        )
+        content_type = f"multipart/form-data; boundary={boundary}"
+        return self.request(label, "/api/upload", body, content_type, expected)
+
+
+def load_frontend_queries() -> dict[str, str]:
+    """The GraphQL queries the frontend sends, by name."""
+    queries = {}
+    for name, (filename, variable) in FRONTEND_QUERIES.items():
+        source = (LOGVIZ_DIR / filename).read_text()
+        match = re.search(rf"const {variable} = `(.*?)`", source, re.DOTALL)
+        if match is None:
+            raise SystemExit(f"Couldn't find the `{variable}` query in {filename}")
+        queries[name] = match.group(1)
+    return queries
+
+
+class ReviewerSession:
+    """A reviewer browsing runs, one action at a time."""
+
+    def __init__(self, client: Client, queries: dict[str, str], model: dict, seed: int) -> None:
+        self.client = client
+        self.queries = queries
+        self.model = model
+        self.rng = random.Random(seed)
+        self.runs: list[dict] = []
+        self.run_id: Optional[str] = None
+        self.num_samples = 0
+        self.page_id = 1
+        self.event_ids: list[int] = []
+
+    def run(self, deadline: float) -> None:
+        actions = list(self.model["actions"])
+        weights = [self.model["actions"][action] for action in actions]
+        self.home()
+        while time.monotonic() < deadline:
+            time.sleep(self.rng.uniform(*self.model["think_seconds"]))
+            if time.monotonic() >= deadline:
+                break
+            action = self.rng.choices(actions, weights)[0]
+            if action != "home" and not self.runs:
+                action = "home"
+            getattr(self, action)()
+
+    def _pick_run(self) -> None:
+        run = self.rng.choice(self.runs)
+        self.run_id = run["run_id"]
+        self.num_samples = run.get("num_samples") or 1
+        self.page_id = 1
+
+    def _prefetch(self) -> None:
+        data = self.client.get(
+            "GET /api/sample_page_window",
+            "/api/sample_page_window",
+            run_id=self.run_id,
+            page_id=self.page_id,
+            radius=PREFETCH_RADIUS,
+            max_chars=PREVIEW_CHARS,
+        )
+        if data is None:
+            return
+        for page in json.loads(data)["data"]["sample_page_window"]:
+            if page["page_id"] + 1 == self.page_id:
+                self.event_ids = [event["event_id"] for event in page["sampling_events"]]
+
+    def home(self) -> None:
+        self.client.get("GET /", "/")
+        self._load_runs("runs", {"sort": "-created_at", "first": RUNS_PAGE_SIZE})
+
+    def filter_runs(self) -> None:
+        if not self.runs:
+            return self.home()
+        base_eval = self.rng.choice(self.runs)["base_eval"]
+        variables = {"filter": {"base_evals": [base_eval]}, "sort": "name", "first": RUNS_PAGE_SIZE}
+        self._load_runs("runs (filtered)", variables)
+
+    def _load_runs(self, label: str, variables: dict) -> None:
+        data = self.client.graphql(label, self.queries["runs"], variables)
+        if data is not None and data["runs"]["runs"]:
+            self.runs = data["runs"]["runs"]
+
+    def open_run(self) -> None:
+        self._pick_run()
+        self.client.get("GET /run", "/run", run_id=self.run_id, page_id=self.page_id)
+        variables = {"run_id": self.run_id}
+        self.client.graphql("run_stats", self.queries["run_stats"], variables)
+        self.client.graphql("metrics spec", self.queries["metrics_spec"], variables)
+        self._prefetch()
+
+    def next_page(self) -> None:
+        if self.run_id is None:
+            return self.open_run()
+        if self.page_id >= self.num_samples:
+            self.page_id = 0
+        self.page_id += 1
+        # the pages around the current one are cached, so only every few pages hit the server
+        if self.page_id % PREFETCH_RADIUS == 0:
+            self._prefetch()
+
+    def show_more(self) -> None:
+        if not self.event_ids:
+            return self.next_page()
+        self.client.graphql(
+            "message_content",
+            self.queries["message_content"],
+            {
+                "run_id": self.run_id,
+                "event_id": self.rng.choice(self.event_ids),
+                "index": 0,
+                "offset": PREVIEW_CHARS,
+                "length": MORE_CHARS,
+                "sampled": False,
+            },
+        )
+
+    def page_graphql(self) -> None:
+        if self.run_id is None:
+            self._pick_run()
+        data = self.client.get(
+            "GET /api/sample_page",
+            "/api/sample_page",
+            run_id=self.run_id,
+            page_id=self.page_id,
+            max_chars=PREVIEW_CHARS,
+        )
+        page = None if data is None else json.loads(data)["data"]["sample_page"]
+        if page is not None:
+            self.event_ids = [e["event_id"] for e in page["sampling_events"]]
+        run = {"run_id": self.run_id}
+        self.client.graphql("spec", self.queries["spec"], run)
+        self.client.graphql("final_report", self.queries["final_report"], run)
+
+    def task_view(self) -> None:
+        if self.run_id is None:
+            self._pick_run()
+        data = self.client.get(
+            "GET /run (task)", "/run", run_id=self.run_id, page_id=self.page_id, view="task"
+        )
+        if data is None:
+            return
+        match = re.search(rb"const sample_id = (.*?);", data)
+        sample_id = json.loads(match.group(1)) if match else None
+        if sample_id is None:
+            return
+        self.client.graphql(
+            "timeline",
+            self.queries["timeline"],
+            {
+                "run_id": self.run_id,
+                "sample_id": sample_id,
+                "first": TIMELINE_PAGE_SIZE,
+                "after": None,
+                "max_chars": PREVIEW_CHARS,
+            },
+        )
+
+
+def synthetic_log_bytes(seed: int, **kwargs: Any) -> bytes:
+    buffer = io.StringIO()
+    for line in synthetic_log(seed=seed, **kwargs):
+        buffer.write(json.dumps(line) + "\n")
+    return buffer.getvalue().encode()
+
+
+def uploader(client: Client, args: argparse.Namespace, index: int, deadline: float) -> None:
+    rng = random.Random(args.seed * 7919 + index)
+    while time.monotonic() < deadline:
+        seed = rng.getrandbits(32)
+        log = synthetic_log_bytes(seed, num_samples=args.samples, turns=args.turns)
+        client.upload("POST /api/upload", log, f"upload_{seed}.jsonl")
+        time.sleep(args.upload_interval)
+
+
+def populate(client: Client, args: argparse.Namespace) -> None:
+    for index in range(args.runs):
+        log = synthetic_log_bytes(
+            args.seed * 1_000_003 + index,
+            num_samples=args.samples,
+            turns=args.turns,
+            eval_name=f"synthetic-{index % 3}.dev.v0",
+            completion_fn=f"synthetic-model-{index % 2}",
+        )
+        # 409: already uploaded by a previous test against the same server
+        client.upload("populate", log, f"synthetic_{index}.jsonl", expected=(200, 409))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return int(sock.getsockname()[1])
+
+
+def start_server(directory: Path, server_args: list[str], log_file: Any) -> tuple[Any, str]:
+    port = free_port()
+    command = [sys.executable, "-m", "logviz.run", "--dir", str(directory), "--port", str(port)]
+    process = subprocess.Popen(
+        command + server_args, stdout=log_file, stderr=subprocess.STDOUT, cwd=LOGVIZ_DIR.parent
+    )
+    url = f"http://localhost:{port}"
+    for _ in range(300):
+        if process.poll() is not None:
+            raise SystemExit(f"The server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(url + "/", timeout=1).close()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit("The server didn't start within 30 s")
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": len(values) / seconds,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def report(stats: Stats, seconds: float, server_lock_errors: Optional[int]) -> dict:
+    rows = {
+        label: summarize(latencies, stats.errors[label], seconds)
+        for label, latencies in sorted(stats.latencies.items())
+    }
+    all_latencies = [value for latencies in stats.latencies.values() for value in latencies]
+    if all_latencies:
+        rows["total"] = summarize(all_latencies, sum(stats.errors.values()), seconds)
+    print(
+        f"{'request':34} {'count':>7} {'errors':>7} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for label, row in rows.items():
+        print(
+            f"{label:34} {row['requests']:7} {row['errors']:7} {row['throughput']:8.1f} "
+            f"{row['p50_ms']:8.1f} {row['p95_ms']:8.1f} {row['p99_ms']:8.1f} {row['max_ms']:8.1f}"
+        )
+    print(f"\nSQLite lock errors in responses: {stats.lock_errors}")
+    if server_lock_errors is not None:
+        print(f"SQLite lock errors in the server log: {server_lock_errors}")
+    for label, error in sorted(stats.error_samples.items()):
+        print(f"first error of {label}: {error}")
+    return {
+        "seconds": seconds,
+        "requests": rows,
+        "lock_errors": stats.lock_errors,
+        "server_lock_errors": server_lock_errors,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Server to test; by default one is started locally.")
+    parser.add_argument(
+        "--server-args",
+        default="",
+        help="Extra options for the server started without --url, e.g. '--no-compression'.",
+    )
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent reviewers.")
+    parser.add_argument("--uploaders", type=int, default=1, help="Concurrent uploaders.")
+    parser.add_argument("--upload-interval", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run for.")
+    parser.add_argument("--runs", type=int, default=10, help="Synthetic runs to populate with.")
+    parser.add_argument("--samples", type=int, default=100, help="Samples per synthetic run.")
+    parser.add_argument("--turns", type=int, default=4, help="Sampling events per sample.")
+    parser.add_argument("--session-model", type=Path, help="JSON session model.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the report to this file.")
+    args = parser.parse_args()
+
+    model = dict(DEFAULT_SESSION_MODEL)
+    if args.session_model is not None:
+        model.update(json.loads(args.session_model.read_text()))
+    unknown = set(model["actions"]) - set(DEFAULT_SESSION_MODEL["actions"])
+    if unknown:
+        raise SystemExit(f"Unknown actions in the session model: {', '.join(sorted(unknown))}")
+    queries = load_frontend_queries()
+
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryFile("w+") as server_log:
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(Path(tmp), args.server_args.split(), server_log)
+        try:
+            print(f"Populating {url} with {args.runs} runs of {args.samples} samples...")
+            populate(Client(url, None), args)
+
+            stats = Stats()
+            client = Client(url, stats)
+            print(
+                f"Running {args.sessions} sessions and {args.uploaders} uploaders "
+                f"for {args.duration:.0f} s..."
+            )
+            started = time.monotonic()
+            deadline = started + args.duration
+            threads = [
+                threading.Thread(
+                    target=ReviewerSession(client, queries, model, args.seed * 7919 + i).run,
+                    args=(deadline,),
+                )
+                for i in range(args.sessions)
+            ] + [
+                threading.Thread(target=uploader, args=(client, args, i, deadline))
+                for i in range(args.uploaders)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.monotonic() - started
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+        server_lock_errors = None
+        if process is not None:
+            server_log.seek(0)
+            server_lock_errors = server_log.read().count(LOCK_ERROR.decode())
+    result = report(stats, seconds, server_lock_errors)
+    if args.json is not None:
+        args.json.write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
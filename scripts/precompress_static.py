@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Write gzip (and, if `brotli` is installed, brotli) variants of the app's static assets.
+
+The app serves `<file>.gz` / `<file>.br` in place of `<file>` to clients that accept them (see
+logviz/compression.py), so run this before building or deploying. Variants are written at the
+highest compression levels, and only for files that have changed since their last run.
+
+Usage: ./scripts/precompress_static.py [--clean]
+"""
+import argparse
+import gzip
+import sys
+from pathlib import Path
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "logviz" / "static"
+SUFFIXES = {".js", ".css", ".html", ".svg", ".json"}
+# files smaller than this gain too little from compression to be worth a variant
+MIN_SIZE = 1024
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clean", action="store_true", help="Delete the variants instead.")
+    args = parser.parse_args()
+
+    if args.clean:
+        for variant in [*STATIC_DIR.rglob("*.gz"), *STATIC_DIR.rglob("*.br")]:
+            variant.unlink()
+            print(f"removed {variant.relative_to(STATIC_DIR)}")
+        return 0
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("brotli is not installed, only writing gzip variants", file=sys.stderr)
+
+    for path in sorted(STATIC_DIR.rglob("*")):
+        if path.suffix not in SUFFIXES or not path.is_file() or path.stat().st_size < MIN_SIZE:
+            continue
+        data = path.read_bytes()
+        variants = {".gz": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = lambda: brotli.compress(data, quality=11)
+        for suffix, compress in variants.items():
+            variant = path.with_name(path.name + suffix)
+            if variant.exists() and variant.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            compressed = compress()
+            variant.write_bytes(compressed)
+            print(f"{variant.relative_to(STATIC_DIR)}: {len(data)} -> {len(compressed)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Fixtures for the regression tests: a fresh database per test, used directly (`database`) or
+through the app (`client`), and synthetic logs (see `logviz.synthetic`) to fill it with."""
+import io
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from logviz.app import app as logviz_app
+from logviz.database import Database
+from logviz.synthetic import write_synthetic_log
+
+
+def synthetic_log_bytes(**kwargs: Any) -> bytes:
+    """A synthetic log, as `write_synthetic_log(**kwargs)` writes it."""
+    buffer = io.StringIO()
+    write_synthetic_log(buffer, **kwargs)
+    return buffer.getvalue().encode()
+
+
+def upload(client: FlaskClient, log: bytes, filename: str = "log.jsonl", **form: str) -> Any:
+    """POST a log to /api/upload, with `form` fields such as on_duplicate."""
+    return client.post(
+        "/api/upload",
+        data={"files[]": (io.BytesIO(log), filename), **form},
+        content_type="multipart/form-data",
+    )
+
+
+def graphql(client: FlaskClient, query: str, **variables: Any) -> dict:
+    """The data of a GraphQL query, which must succeed."""
+    response = client.post("/graphql", json={"query": query, "variables": variables})
+    body = response.get_json()
+    assert response.status_code == 200 and not body.get("errors"), body
+    data: dict = body["data"]
+    return data
+
+
+@pytest.fixture
+def database(tmp_path: Path) -> Iterator[Path]:
+    """A fresh database, open on the test's thread without Flask."""
+    path = tmp_path / "logviz.db"
+    Database.open(path)
+    yield path
+    Database.close()
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory: pytest.TempPathFactory) -> Flask:
+    # `Database.init_app` adds request hooks, so it runs once; each test then points the app at
+    # a database of its own
+    logviz_app.config["LOGVIZ_DIR"] = tmp_path_factory.mktemp("logviz")
+    logviz_app.config["DATABASE_URI"] = logviz_app.config["LOGVIZ_DIR"] / "logviz.db"
+    logviz_app.config["STORE_JSONL"] = False
+    Database.init_app(logviz_app)
+    return logviz_app
+
+
+@pytest.fixture
+def client(app: Flask, tmp_path: Path) -> FlaskClient:
+    app.config["LOGVIZ_DIR"] = tmp_path
+    app.config["DATABASE_URI"] = tmp_path / "logviz.db"
+    with app.app_context():
+        Database.initialize_db()
+    # built on the first GraphQL request, with reader threads bound to the database
+    app.extensions.pop("logviz_graphql_view", None)
+    return app.test_client()
@@ -0,0 +1,70 @@
+import io
+import json
+
+import pytest
+from conftest import synthetic_log_bytes, upload
+
+from logviz.database import Database
+from logviz.export import RunNotFoundError, iter_export
+
+
+def export(run_id: str) -> bytes:
+    return b"".join(iter_export(run_id, "jsonl"))
+
+
+def test_jsonl_export_reproduces_the_log(database):
+    # fewer than 10 samples, so that the log's sample order is also their sort order, which
+    # exports follow
+    log = synthetic_log_bytes(run_id="run", num_samples=5)
+    Database.process_file(io.BytesIO(log), "2024-01-01T00:00:00")
+
+    expected = [json.loads(line) for line in log.splitlines()]
+    for line in expected:
+        # metrics events' ids aren't stored
+        if line.get("type") == "metrics":
+            line["event_id"] = None
+    assert [json.loads(line) for line in export("run").splitlines()] == expected
+
+
+def test_reimported_export_exports_the_same(database):
+    Database.process_file(
+        io.BytesIO(synthetic_log_bytes(run_id="run", num_samples=12)), "2024-01-01T00:00:00"
+    )
+    exported = export("run")
+
+    Database.process_file(io.BytesIO(exported), "2024-01-02T00:00:00", on_duplicate="replace")
+    assert export("run") == exported
+
+
+def test_parquet_metrics_match_the_log(database):
+    pq = pytest.importorskip("pyarrow.parquet")
+    log = synthetic_log_bytes(run_id="run", num_samples=12)
+    Database.process_file(io.BytesIO(log), "2024-01-01T00:00:00")
+
+    table = pq.read_table(io.BytesIO(b"".join(iter_export("run", "parquet"))))
+    expected = sorted(
+        (
+            {"sample_id": line["sample_id"], "created_at": line["created_at"], **line["data"]}
+            for line in map(json.loads, log.splitlines())
+            if line.get("type") == "metrics"
+        ),
+        key=lambda row: row["sample_id"],
+    )
+    assert table.to_pylist() == expected
+
+
+def test_export_of_missing_run(database):
+    with pytest.raises(RunNotFoundError):
+        export("missing")
+
+
+def test_export_endpoint(client):
+    log = synthetic_log_bytes(run_id="run", num_samples=3)
+    upload(client, log)
+
+    response = client.get("/api/export?run_id=run")
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == "attachment; filename=run.jsonl"
+    assert len(response.data.splitlines()) == len(log.splitlines())
+    assert client.get("/api/export?run_id=missing").status_code == 404
+    assert client.get("/api/export?run_id=run&format=csv").status_code == 400
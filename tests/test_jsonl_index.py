@@ -0,0 +1,100 @@
+import json
+
+import pytest
+from conftest import graphql, synthetic_log_bytes, upload
+
+from logviz.jsonl_index import INDEX_VERSION, JsonlIndex, build_index, index_path_for
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_bytes(synthetic_log_bytes(run_id="run", num_samples=12))
+    return path
+
+
+@pytest.fixture
+def lines(log_path):
+    return [json.loads(line) for line in log_path.read_text().splitlines()]
+
+
+def events(lines: list[dict]) -> list[dict]:
+    return [line for line in lines if "event_id" in line and line["type"] != "metrics"]
+
+
+def test_reads_match_the_log(log_path, lines):
+    index = JsonlIndex.load_or_build(log_path)
+
+    assert index.run_id == "run"
+    assert index.spec() == lines[0]["spec"]
+    assert index.final_report() == lines[-1]["final_report"]
+    sample_ids = list(dict.fromkeys(line["sample_id"] for line in events(lines)))
+    assert index.sample_ids() == sample_ids
+    for sample_id in sample_ids:
+        sample_events = [line for line in events(lines) if line["sample_id"] == sample_id]
+        assert list(index.event_lines(sample_id)) == sample_events
+        assert list(index.event_lines(sample_id, "sampling")) == [
+            line for line in sample_events if line["type"] == "sampling"
+        ]
+        [metrics] = [
+            line
+            for line in lines
+            if line.get("type") == "metrics" and line["sample_id"] == sample_id
+        ]
+        assert index.metrics_line(sample_id) == metrics
+    assert list(index.event_lines("missing")) == []
+    assert index.metrics_line("missing") is None
+    index.close()
+
+
+def test_event_lookup_by_id(log_path, lines):
+    index = JsonlIndex.load_or_build(log_path)
+    for line in events(lines):
+        assert index.event_line(line["event_id"]) == line
+    metrics_event_id = next(line["event_id"] for line in lines if line.get("type") == "metrics")
+    assert index.event_line(metrics_event_id) is None
+    assert index.event_line(10**9) is None
+    index.close()
+
+
+def test_sidecar_is_reused_until_the_log_changes(log_path):
+    JsonlIndex.load_or_build(log_path).close()
+    sidecar = index_path_for(log_path)
+    assert json.loads(sidecar.read_text())["version"] == INDEX_VERSION
+
+    # a valid sidecar is read rather than rebuilt
+    marked = {**json.loads(sidecar.read_text()), "final_report": None}
+    sidecar.write_text(json.dumps(marked))
+    index = JsonlIndex.load_or_build(log_path)
+    assert index.final_report() is None
+    index.close()
+
+    # as is one of an older version, or of another version of the log
+    for stale in ({**marked, "version": INDEX_VERSION - 1}, {**marked, "size": 0}):
+        sidecar.write_text(json.dumps(stale))
+        index = JsonlIndex.load_or_build(log_path)
+        assert index.final_report() is not None
+        index.close()
+
+
+def test_log_without_a_spec_is_rejected(tmp_path):
+    path = tmp_path / "log.jsonl"
+    path.write_bytes(b"\n".join(synthetic_log_bytes(num_samples=1).splitlines()[1:]))
+    with pytest.raises(KeyError):
+        build_index(path)
+
+
+def test_registered_run_reads_like_an_ingested_one(client):
+    log = synthetic_log_bytes(run_id="run", num_samples=3)
+    query = """query ($run_id: String!) {
+      sample_ids(run_id: $run_id)
+      all_sampling_events(run_id: $run_id) { event_id sample_id type }
+      all_metrics(run_id: $run_id) { sample_id }
+      timeline(run_id: $run_id, sample_id: "synthetic.dev.v0.1") { total_count steps { kind } }
+    }"""
+    assert upload(client, log).status_code == 200
+    ingested = graphql(client, query, run_id="run")
+
+    client.delete("/api/delete?run_id=run")
+    assert upload(client, log, mode="index").status_code == 200
+    assert graphql(client, query, run_id="run") == ingested
@@ -0,0 +1,30 @@
+from conftest import synthetic_log_bytes, upload
+
+ALL_EVENTS = """query ($run_id: String!) {
+  all_sampling_events(run_id: $run_id) { event_id }
+}"""
+
+
+def test_query_over_the_cost_limit_is_rejected(app, client, monkeypatch):
+    upload(client, synthetic_log_bytes(run_id="big", num_samples=20))
+    query = {"query": ALL_EVENTS, "variables": {"run_id": "big"}}
+    # the run's events are counted when it is ingested, so its size is known
+    assert client.post("/graphql", json=query).status_code == 200
+
+    monkeypatch.setitem(app.config, "GRAPHQL_MAX_COST", 50)
+    response = client.post("/graphql", json=query)
+    assert response.status_code == 400
+    body = response.get_json()
+    assert "data" not in body or body["data"] is None
+    [error] = body["errors"]
+    assert "exceeds the limit of 50" in error["message"]
+
+
+def test_cheap_query_under_a_low_limit_is_served(app, client, monkeypatch):
+    upload(client, synthetic_log_bytes(run_id="big", num_samples=20))
+    monkeypatch.setitem(app.config, "GRAPHQL_MAX_COST", 50)
+    query = '{ metadata(run_id: "big") { run_id num_samples } }'
+    response = client.post("/graphql", json={"query": query})
+    assert response.status_code == 200
+    assert response.get_json()["data"]["metadata"] == {"run_id": "big", "num_samples": 20}
+    assert float(response.headers["X-Logviz-Query-Cost"]) <= 50
@@ -0,0 +1,64 @@
+import pytest
+from conftest import graphql, synthetic_log_bytes, upload
+
+RUNS = """query ($sort: String, $first: Int, $after: String, $filter: RunFilter) {
+  runs(sort: $sort, first: $first, after: $after, filter: $filter) {
+    total_count runs { run_id } end_cursor has_next_page
+  }
+}"""
+
+
+@pytest.fixture
+def runs(client):
+    """Seven runs, three of them of another eval, with different numbers of samples."""
+    run_ids = [f"run{i}" for i in range(7)]
+    for i, run_id in enumerate(run_ids):
+        eval_name = "other.dev.v0" if i % 3 == 0 else "synthetic.dev.v0"
+        log = synthetic_log_bytes(run_id=run_id, num_samples=i % 4 + 1, eval_name=eval_name)
+        assert upload(client, log).status_code == 200
+    return run_ids
+
+
+def pages(client, sort: str, first: int, filter=None) -> list[list[str]]:
+    """The run ids of every page of the run list, following end_cursor."""
+    result = []
+    after = None
+    while True:
+        page = graphql(client, RUNS, sort=sort, first=first, after=after, filter=filter)["runs"]
+        result.append([run["run_id"] for run in page["runs"]])
+        if not page["has_next_page"]:
+            return result
+        after = page["end_cursor"]
+
+
+@pytest.mark.parametrize("sort", ["name", "-name", "uploaded_at", "-uploaded_at", "num_samples"])
+def test_keyset_pages_cover_the_list_once(client, runs, sort):
+    [everything] = pages(client, sort, 100)
+    assert sorted(everything) == runs
+
+    paged = pages(client, sort, 3)
+    assert [len(page) for page in paged] == [3, 3, 1]
+    assert [run_id for page in paged for run_id in page] == everything
+
+
+def test_keyset_pages_keep_to_the_filter(client, runs):
+    filter = {"eval_names": ["other.dev.v0"]}
+    paged = pages(client, "name", 2, filter)
+    assert paged == [["run0", "run3"], ["run6"]]
+    data = graphql(client, RUNS, sort="name", first=2, filter=filter)
+    assert data["runs"]["total_count"] == 3
+
+
+def test_sort_order(client, runs):
+    assert pages(client, "name", 100) == [runs]
+    assert pages(client, "-name", 100) == [runs[::-1]]
+
+
+def test_cursor_of_another_sort_is_rejected(client, runs):
+    cursor = graphql(client, RUNS, sort="name", first=3)["runs"]["end_cursor"]
+    response = client.post(
+        "/graphql",
+        json={"query": RUNS, "variables": {"sort": "-name", "first": 3, "after": cursor}},
+    )
+    [error] = response.get_json()["errors"]
+    assert "is for a list sorted by `name`" in error["message"]
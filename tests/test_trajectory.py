@@ -0,0 +1,114 @@
+import io
+import json
+
+from conftest import synthetic_log_bytes
+
+from logviz.database import Database
+from logviz.trajectory import build_trajectory
+
+
+def sampling(prompt: list[dict], sampled: str) -> dict:
+    return {"prompt": prompt, "sampled": [sampled]}
+
+
+def message(role: str, content: str) -> dict:
+    return {"role": role, "content": content}
+
+
+def summary(steps: list[dict]) -> list[tuple]:
+    return [(s["event_id"], s["kind"], s["role"], s["content"], s["rewind_to"]) for s in steps]
+
+
+SYSTEM = message("system", "be brief")
+USER_1 = message("user", "first question")
+USER_2 = message("user", "second question")
+
+
+def test_resent_prompt_prefix_is_kept_once():
+    steps = build_trajectory(
+        [
+            (0, "sampling", sampling([SYSTEM, USER_1], "first answer")),
+            (
+                1,
+                "sampling",
+                sampling(
+                    [SYSTEM, USER_1, message("assistant", "first answer"), USER_2],
+                    "second answer",
+                ),
+            ),
+        ]
+    )
+    assert summary(steps) == [
+        (0, "message", "system", "be brief", None),
+        (0, "message", "user", "first question", None),
+        (0, "sampled", "assistant", "first answer", None),
+        # the first answer, sent back, isn't repeated
+        (1, "message", "user", "second question", None),
+        (1, "sampled", "assistant", "second answer", None),
+    ]
+    assert [s["step"] for s in steps] == list(range(5))
+
+
+def test_prompt_that_drops_messages_rewinds():
+    steps = build_trajectory(
+        [
+            (0, "sampling", sampling([SYSTEM, USER_1], "first answer")),
+            # the agent dropped its history but kept the system message
+            (1, "sampling", sampling([SYSTEM, USER_2], "second answer")),
+        ]
+    )
+    assert summary(steps)[3:] == [
+        (1, "message", "user", "second question", 1),
+        (1, "sampled", "assistant", "second answer", None),
+    ]
+
+
+def test_events_are_ordered_by_event_id():
+    events = [
+        (0, "sampling", sampling([SYSTEM, USER_1], "first answer")),
+        (1, "function_call", {"name": "lookup", "arguments": "{}", "return_value": "42"}),
+        (2, "sampling", sampling([SYSTEM, USER_1, USER_2], "second answer")),
+    ]
+    assert build_trajectory(events[::-1]) == build_trajectory(events)
+
+
+def test_ingested_trajectory_matches_one_rebuilt_from_the_events(database):
+    log = synthetic_log_bytes(run_id="run", num_samples=3)
+    Database.process_file(io.BytesIO(log), "2024-01-01T00:00:00")
+
+    for sample_id in Database.get_sample_ids("run"):
+        events = sample_events(log, sample_id)
+        expected = build_trajectory(events)
+        # prompts resend the conversation so far, so most of their messages are repeats
+        num_prompt_messages = sum(
+            len(data["prompt"]) for _, event_type, data in events if event_type == "sampling"
+        )
+        assert len(expected) < num_prompt_messages
+
+        steps, num_steps = Database.get_timeline("run", sample_id, after=-1, first=1000)
+        assert num_steps == len(expected)
+        assert summary(steps) == summary(expected)
+
+
+def test_concurrent_rebuilds_store_each_step_once(database):
+    log = synthetic_log_bytes(run_id="run", num_samples=1)
+    Database.process_file(io.BytesIO(log), "2024-01-01T00:00:00")
+    [sample_id] = Database.get_sample_ids("run")
+    before = Database.get_timeline("run", sample_id, after=-1, first=1000)
+
+    # two readers that both found the trajectory missing, and both built it
+    Database.delete_trajectories("run", [sample_id])
+    steps = build_trajectory(sample_events(log, sample_id))
+    Database.insert_trajectory_steps("run", sample_id, steps)
+    Database.insert_trajectory_steps("run", sample_id, steps)
+
+    assert Database.get_timeline("run", sample_id, after=-1, first=1000) == before
+
+
+def sample_events(log: bytes, sample_id: str) -> list[tuple]:
+    """(event_id, event_type, data) of a sample's events in a log."""
+    return [
+        (line["event_id"], line["type"], line["data"])
+        for line in map(json.loads, log.splitlines())
+        if line.get("sample_id") == sample_id
+    ]
@@ -0,0 +1,64 @@
+import json
+
+from conftest import graphql, synthetic_log_bytes, upload
+
+RUN = """query ($run_id: String!) {
+  sample_ids(run_id: $run_id)
+  metadata(run_id: $run_id) { num_samples }
+  final_report(run_id: $run_id) { data }
+}"""
+
+
+def test_duplicate_run_is_rejected(client):
+    assert upload(client, synthetic_log_bytes(run_id="dup", num_samples=3)).status_code == 200
+
+    # the same file, then another log of the same run
+    for log in (
+        synthetic_log_bytes(run_id="dup", num_samples=3),
+        synthetic_log_bytes(run_id="dup", num_samples=3, seed=1),
+    ):
+        response = upload(client, log)
+        assert response.status_code == 409
+        assert response.get_json()["run_id"] == "dup"
+    assert len(graphql(client, RUN, run_id="dup")["sample_ids"]) == 3
+
+
+def test_invalid_on_duplicate_mode(client):
+    log = synthetic_log_bytes(run_id="dup", num_samples=3)
+    assert upload(client, log, on_duplicate="merge").status_code == 400
+
+
+def test_replace(client):
+    upload(client, synthetic_log_bytes(run_id="dup", num_samples=5))
+    replacement = synthetic_log_bytes(run_id="dup", num_samples=2, seed=1)
+
+    assert upload(client, replacement, on_duplicate="replace").status_code == 200
+    data = graphql(client, RUN, run_id="dup")
+    assert sorted(data["sample_ids"]) == ["synthetic.dev.v0.0", "synthetic.dev.v0.1"]
+    assert data["metadata"]["num_samples"] == 2
+    # replacing with the same file again is allowed too
+    assert upload(client, replacement, on_duplicate="replace").status_code == 200
+
+
+def test_append(client):
+    upload(client, synthetic_log_bytes(run_id="dup", num_samples=3))
+    # more samples of the same run, as a resumed eval would write them
+    appended = synthetic_log_bytes(run_id="dup", num_samples=2, eval_name="synthetic.dev.v1")
+
+    assert upload(client, appended, on_duplicate="append").status_code == 200
+    data = graphql(client, RUN, run_id="dup")
+    assert sorted(data["sample_ids"]) == [
+        "synthetic.dev.v0.0",
+        "synthetic.dev.v0.1",
+        "synthetic.dev.v0.2",
+        "synthetic.dev.v1.0",
+        "synthetic.dev.v1.1",
+    ]
+    assert data["metadata"]["num_samples"] == 5
+    # the appended log's final report replaces the run's
+    assert (
+        json.loads(data["final_report"]["data"])
+        == json.loads(appended.splitlines()[-1])["final_report"]
+    )
+    # appending the same file twice is still an error
+    assert upload(client, appended, on_duplicate="append").status_code == 409